@@ -0,0 +1,130 @@
+"""
+Read-only JSON views of the directory.
+
+Each response carries a strong ETag derived from the directory
+generation, so a client repeating a request gets a bodiless 304 at the
+cost of a single version check.
+"""
+import hashlib
+
+from django.db.models import Q
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.views.decorators.http import condition, require_safe
+
+from .pagination import InvalidCursor, keyset_page, page_params
+from .models import Student, Adult, Guardian, FamilyCard, OLSClass
+from .models import DirectoryVersion, normalize_phone, normalize_email
+
+def directory_etag(request, *args, **kwargs):
+    path = hashlib.md5(request.get_full_path()).hexdigest()
+    return "%d-%s" % (DirectoryVersion.objects.current(), path)
+
+def api_view(view):
+    return require_safe(condition(etag_func=directory_etag)(view))
+
+@api_view
+def families(request):
+    try:
+        after, limit = page_params(request)
+        page = keyset_page(FamilyCard.objects.all(), after, limit)
+    except InvalidCursor as err:
+        return HttpResponseBadRequest(str(err))
+    families = []
+    for card in page.items:
+        info = card.directory_info()
+        info['name'] = card.name
+        families.append(info)
+    return JsonResponse({'families': families, 'next': page.next_cursor})
+
+@api_view
+def classes(request):
+    return JsonResponse({'classes': OLSClass.objects.rosters()})
+
+@api_view
+def students(request):
+    try:
+        after, limit = page_params(request)
+        page = keyset_page(Student.objects.select_related('olsclass'),
+                after, limit, name_field=('lastname', 'firstname'))
+    except InvalidCursor as err:
+        return HttpResponseBadRequest(str(err))
+    students = []
+    for student in page.items:
+        students.append({
+            'id': student.id,
+            'firstname': student.firstname,
+            'lastname': student.lastname,
+            'grade': student.olsclass.grade,
+            'class': student.olsclass_id,
+            'family': student.family_id,
+            })
+    return JsonResponse({'students': students, 'next': page.next_cursor})
+
+@api_view
+def adults(request):
+    try:
+        after, limit = page_params(request)
+        page = keyset_page(Adult.objects.all(), after, limit,
+                name_field=('lastname', 'firstname'))
+    except InvalidCursor as err:
+        return HttpResponseBadRequest(str(err))
+    adults = []
+    for adult in page.items:
+        adults.append({
+            'id': adult.id,
+            'firstname': adult.firstname,
+            'lastname': adult.lastname,
+            'email': adult.email,
+            'homephone': adult.homephone,
+            'cellphone': adult.cellphone,
+            })
+    return JsonResponse({'adults': adults, 'next': page.next_cursor})
+
+@api_view
+def lookup(request):
+    """
+    Resolve a phone number or email address to the adults it belongs
+    to, with their relation, family and children.
+    """
+    phone = normalize_phone(request.GET.get('phone'))
+    email = normalize_email(request.GET.get('email'))
+    if phone:
+        query = Q(homephone_digits=phone) | Q(cellphone_digits=phone)
+    elif email:
+        query = Q(email_key=email)
+    else:
+        return HttpResponseBadRequest("give a phone or email")
+    adults = list(Adult.objects.filter(query).select_related(
+        'guardian__family'))
+    guardians = {}
+    for adult in adults:
+        try:
+            guardians[adult.id] = adult.guardian
+        except Guardian.DoesNotExist:
+            pass
+    children = {}
+    for student in Student.objects.filter(family__in=[g.family_id
+            for g in guardians.values()]).select_related('olsclass'):
+        children.setdefault(student.family_id, []).append({
+            'id': student.id,
+            'name': student.name(),
+            'grade': student.olsclass.grade,
+            })
+    matches = []
+    for adult in adults:
+        match = {
+            'id': adult.id,
+            'name': adult.name(),
+            'contact_info': adult.contact_info(),
+            'relation': None,
+            'family': None,
+            'children': [],
+            }
+        guardian = guardians.get(adult.id)
+        if guardian is not None:
+            match['relation'] = guardian.relation
+            match['family'] = {'id': guardian.family_id,
+                    'name': guardian.family.name}
+            match['children'] = children.get(guardian.family_id, [])
+        matches.append(match)
+    return JsonResponse({'matches': matches})
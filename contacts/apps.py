@@ -0,0 +1,7 @@
+from django.apps import AppConfig
+
+class ContactsConfig(AppConfig):
+    name = 'contacts'
+
+    def ready(self):
+        from . import pragmas, signals
@@ -0,0 +1,77 @@
+"""
+A whole-page cache for the directory views.
+
+Pages are cached under the current directory generation, which is
+bumped whenever the directory data changes (see contacts.signals), so
+a cached page is served until the data it was built from changes.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from .models import DirectoryVersion
+
+# Response headers kept with a cached page
+CACHED_HEADERS = ('Content-Type', 'Content-Disposition')
+
+HITS_KEY = "contacts:page-cache:hits"
+MISSES_KEY = "contacts:page-cache:misses"
+
+def page_cache():
+    return caches[getattr(settings, 'DIRECTORY_PAGE_CACHE', 'default')]
+
+def page_key(generation, request):
+    path = hashlib.md5(request.get_full_path()).hexdigest()
+    return "contacts:page:%d:%s" % (generation, path)
+
+def count(key):
+    cache = page_cache()
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted between add() and incr()
+        cache.set(key, 1, None)
+
+def cache_stats():
+    """
+    Return the page cache hit and miss counts.
+    """
+    cache = page_cache()
+    return {
+            'hits': cache.get(HITS_KEY, 0),
+            'misses': cache.get(MISSES_KEY, 0),
+            'generation': DirectoryVersion.objects.current(),
+            }
+
+def directory_page(view):
+    """
+    Cache the successful GET responses of a directory view under the
+    current directory generation.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        cache = page_cache()
+        key = page_key(DirectoryVersion.objects.current(), request)
+        cached = cache.get(key)
+        if cached is not None:
+            count(HITS_KEY)
+            content, headers = cached
+            response = HttpResponse(content)
+            for header, value in headers:
+                response[header] = value
+            return response
+        count(MISSES_KEY)
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            headers = [(header, response[header]) for header in
+                    CACHED_HEADERS if response.has_header(header)]
+            cache.set(key, (response.content, headers),
+                    getattr(settings, 'DIRECTORY_PAGE_CACHE_TIMEOUT', None))
+        return response
+    return wrapper
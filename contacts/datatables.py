@@ -0,0 +1,77 @@
+"""
+Server-side processing for DataTables (1.9) tables.
+
+The browser sends the sort column and direction, the search term and
+the page window; the database does the filtering, sorting and slicing,
+so only one page of rows ever leaves the server.
+"""
+import operator
+
+from django.db.models import Q
+from django.http import JsonResponse
+from django.utils.html import escape
+
+# The largest page we'll serve, including for "show all" (-1) requests.
+MAX_PAGE = 500
+
+class Column(object):
+    def __init__(self, title, ordering, value):
+        self.title = title
+        self.ordering = ordering    # order_by() fields, ascending
+        self.value = value          # row -> displayed value
+
+    def cell(self, row):
+        # DataTables inserts cells as HTML, so the values are escaped
+        return escape(self.value(row))
+
+def int_param(params, name, default):
+    try:
+        return int(params.get(name, default))
+    except ValueError:
+        return default
+
+def ordering(params, columns):
+    fields = []
+    for idx in range(int_param(params, 'iSortingCols', 0)):
+        col = int_param(params, 'iSortCol_%d' % idx, -1)
+        if not 0 <= col < len(columns):
+            continue
+        prefix = "-" if params.get('sSortDir_%d' % idx) == "desc" else ""
+        for field in columns[col].ordering:
+            fields.append(prefix + field)
+    return fields or list(columns[0].ordering)
+
+def search_filter(term, search_fields):
+    """
+    Return a Q object requiring every word of the search term to appear
+    in at least one of the search fields.
+    """
+    query = Q()
+    for word in term.split():
+        query &= reduce(operator.or_, [Q(**{field + '__icontains': word})
+            for field in search_fields])
+    return query
+
+def datatables_response(request, queryset, columns, search_fields):
+    """
+    Answer a DataTables server-side request for the given queryset.
+    """
+    params = request.GET
+    total = queryset.count()
+    term = params.get('sSearch', "").strip()
+    if term:
+        queryset = queryset.filter(search_filter(term, search_fields))
+        filtered = queryset.count()
+    else:
+        filtered = total
+    start = max(0, int_param(params, 'iDisplayStart', 0))
+    length = int_param(params, 'iDisplayLength', 10)
+    if not 0 < length <= MAX_PAGE:
+        length = MAX_PAGE
+    rows = queryset.order_by(*ordering(params, columns))[start:start + length]
+    return JsonResponse({
+        'sEcho': int_param(params, 'sEcho', 0),
+        'iTotalRecords': total,
+        'iTotalDisplayRecords': filtered,
+        'aaData': [[col.cell(row) for col in columns] for row in rows],
+        })
@@ -0,0 +1,4 @@
+from django import forms
+
+class SearchForm(forms.Form):
+    q = forms.CharField(label="Search", required=False)
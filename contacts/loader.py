@@ -0,0 +1,608 @@
+"""
+Plain Python objects for the school directory - students, guardians,
+staff, families and classes - as read from the directory spreadsheets
+by scripts/load_spreadsheet.py, or from the database by
+contacts.reports.  They don't depend on Django.
+"""
+import re
+
+guys_first_sortkey = { 
+    "Father": 0,
+    "Brother": 1,
+    "Grandfather": 2,
+    "Uncle": 3,
+    "Mother": 10,
+    "Sister": 11,
+    "Grandmother": 12,
+    "Aunt": 13,
+    "Guardian": 20 }
+
+ladies_first_sortkey = { 
+    "Mother": 0,
+    "Sister": 1,
+    "Grandmother": 2,
+    "Aunt": 3,
+    "Father": 10,
+    "Brother": 11,
+    "Grandfather": 12,
+    "Uncle": 13,
+    "Guardian": 20 }
+
+# If True, private information will NOT be redacted.
+no_hidden_fields = False
+
+#######################################################################
+# Helper functions
+#######################################################################
+
+def cleanup_zipcode(zipcode):
+    try:
+        return "%05d" % int(zipcode)
+    except ValueError:
+        return zipcode
+
+def class_sortkey(classname):
+    if classname.startswith("P"):
+        return "00 " + classname
+    elif classname.startswith("K"):
+        return "01 " + classname
+    else:
+        return "02 " + classname
+
+def is_couple(g1, g2):
+    if g1.relation == "Father" and g2.relation == "Mother":
+        return True
+    elif g1.relation == "Mother" and g2.relation == "Father":
+        return True
+    elif g1.relation == "Grandfather" and g2.relation == "Grandmother":
+        return True
+    elif g1.relation == "Grandmother" and g2.relation == "Grandfather":
+        return True
+    elif g1.relation == "Uncle" and g2.relation == "Aunt":
+        return True
+    elif g1.relation == "Aunt" and g2.relation == "Uncle":
+        return True
+    else:
+        return False
+
+def group_key(persons):
+    return "; ".join(sorted([p.key() for p in persons]))
+
+grade_names = [
+    ("Unknown", "??"),
+    ("Pre-K 2.5", "PK2"),
+    ("Pre-K 3", "PK3"),
+    ("Pre-K 4", "PK4"),
+    ("Kindergarten", "K"),
+    ("First Grade", "1"),
+    ("Second Grade", "2"),
+    ("Third Grade", "3"),
+    ("Fourth Grade", "4"),
+    ("Fifth Grade", "5"),
+    ("Sixth Grade", "6"),
+    ("Seventh Grade", "7"),
+    ("Eighth Grade", "8"),
+]
+
+gradelevel = {}
+graderank = {}
+
+for idx, item in enumerate(grade_names):
+    name, level = item
+    gradelevel[name] = level
+    graderank[name] = "%02d" % idx
+
+def redacted(field):
+    """
+    If the given value was marked "private", by enclosing it in
+    square brackets, return the empty string.  Otherwise, return
+    the value as is.
+    """
+    if not field or no_hidden_fields:
+        return field
+    if field.startswith("[") or field.endswith("]"):
+        return ""
+    else:
+        return field
+
+#######################################################################
+# Classes
+#######################################################################
+
+# These use __slots__ rather than an instance __dict__: several years of
+# directories may be loaded at once, and the dicts would dominate memory.
+
+class Student(object):
+    __slots__ = ('firstname', 'lastname', 'olsclass', 'family', '_sortkey',
+            '_id')
+
+    def __init__(self, firstname, lastname, olsclass):
+        self.firstname = firstname
+        self.lastname = lastname
+        self.olsclass = olsclass
+        self.family = None
+        self._sortkey = (class_sortkey(olsclass.key if olsclass else ""),
+                firstname)
+        self._id = None     # database id
+
+    def key(self):
+        return self.name(lastname_first=True)
+
+    def name(self, lastname_first=False):
+        if lastname_first:
+            return self.lastname + ", " + self.firstname
+        else:
+            return self.firstname + " " + self.lastname
+
+    def siblings(self):
+        sibs = set(self.family.children)
+        sibs.discard(self)
+        return sibs
+
+    def sortkey(self):
+        return self._sortkey
+
+class Adult(object):
+    __slots__ = ('firstname', 'lastname', 'email', 'homephone', 'cellphone',
+            'address', '_id')
+
+    def __init__(self, firstname, lastname, 
+            email=None, homephone=None, cellphone=None):
+        self.firstname = firstname
+        self.lastname = lastname
+        self.email = email
+        self.homephone = homephone
+        self.cellphone = cellphone
+        self.address = None
+        self._id = None     # database id
+
+    def key(self):
+        return self.lastname + ", " + self.firstname
+
+    def name(self, lastname_first=False):
+        first, last = [redacted(f) for f in (self.firstname, self.lastname)]
+        if not first and not last:
+            return ""
+        elif first and last:
+            if lastname_first:
+                return last + ", " + first
+            else:
+                return first + " " + last
+        else:
+            return first + last
+
+class Staff(Adult):
+    __slots__ = ('role', 'olsclass')
+
+    def __init__(self, firstname, lastname, role, 
+            email=None, homephone=None, cellphone=None):
+        Adult.__init__(self, firstname, lastname, email, homephone, cellphone)
+        self.role = role
+        self.olsclass = None
+
+class Guardian(Adult):
+    __slots__ = ('relation', 'family')
+
+    def __init__(self, firstname, lastname, relation, 
+            email=None, homephone=None, cellphone=None):
+        Adult.__init__(self, firstname, lastname, email, homephone, cellphone)
+        if relation:
+            self.relation = relation.capitalize()
+        else:
+            self.relation = "Guardian"
+        self.family = None
+        self._id = None     # database id
+
+    def guys_first(self):
+        return guys_first_sortkey[self.relation]
+
+    def ladies_first(self):
+        return ladies_first_sortkey[self.relation]
+
+    def shortrelation(self):
+        if self.relation == "Mother" or self.relation == "_mother":
+            return "Mom"
+        elif self.relation == "Father" or self.relation == "_father":
+            return "Dad"
+        else:
+            return self.relation
+
+class Address(object):
+    __slots__ = ('street', 'city', 'state', 'zipcode', 'residents', '_id')
+
+    def __init__(self, street, city, state, zipcode):
+        self.street = street
+        self.city = city
+        self.state = state
+        self.zipcode = cleanup_zipcode(zipcode)
+        self.residents = []
+        self._id = None     # database id
+
+    def oneline(self):
+        parts = []
+        street, city, state, zipcode = [redacted(f) for f in (
+            self.street, self.city, self.state, self.zipcode)]
+        if street:
+            parts.append(street)
+        if city:
+            parts.append(city)
+        if state or zipcode:
+            parts.append(" ".join((state, zipcode)))
+        if parts:
+            return ", ".join(parts)
+        else:
+            return ""
+
+    def multiline(self):
+        lines = []
+        street, city, state, zipcode = [redacted(f) for f in (
+            self.street, self.city, self.state, self.zipcode)]
+        if street:
+            lines.append(street)
+        if city:
+            if state or zipcode:
+                lines.append(city + ", " + state + " " + zipcode)
+            else:
+                lines.append(city)
+        if lines:
+            return "\n".join(lines)
+        else:
+            return "(no address)"
+
+    def address_line1(self):
+        return self.street
+
+    def address_line2(self):
+        city, state, zipcode = [redacted(f) for f in (
+            self.city, self.state, self.zipcode)]
+        if city:
+            if state or zipcode:
+                return city + ", " + state + " " + zipcode
+            else:
+                return city
+        else:
+            return ""
+
+class FamilyMembers(list):
+    """
+    A family's guardians or children.  Adding or removing members tells
+    the family, so it can forget what it derived from them; reordering
+    them in place doesn't.
+    """
+    __slots__ = ('family',)
+
+    def __init__(self, family, members=()):
+        list.__init__(self, members)
+        self.family = family
+
+    def changed(method):
+        def wrapper(self, *args):
+            result = method(self, *args)
+            self.family.members_changed()
+            return result
+        wrapper.__name__ = method.__name__
+        return wrapper
+
+    append = changed(list.append)
+    extend = changed(list.extend)
+    insert = changed(list.insert)
+    remove = changed(list.remove)
+    pop = changed(list.pop)
+    __setitem__ = changed(list.__setitem__)
+    __delitem__ = changed(list.__delitem__)
+    __setslice__ = changed(list.__setslice__)
+    __delslice__ = changed(list.__delslice__)
+    __iadd__ = changed(list.__iadd__)
+    del changed
+
+class Family(object):
+    __slots__ = ('address', 'email', 'private', '_guardians', '_children',
+            '_name', '_sortkey', '_by_relation', '_oldest_first',
+            '_phone_numbers', '_guardian_emails', '_id')
+
+    def __init__(self, private, street, city, state, zipcode, email=None):
+        self.address = Address(street, city, state, zipcode)
+        self.email = email
+        self.private = private
+        self._guardians = FamilyMembers(self)
+        self._children = FamilyMembers(self)
+        self._id = None     # database id
+        self.members_changed()
+
+    def get_guardians(self):
+        return self._guardians
+
+    def set_guardians(self, guardians):
+        self._guardians = FamilyMembers(self, guardians)
+        self.members_changed()
+
+    guardians = property(get_guardians, set_guardians)
+
+    def get_children(self):
+        return self._children
+
+    def set_children(self, children):
+        self._children = FamilyMembers(self, children)
+        self.members_changed()
+
+    children = property(get_children, set_children)
+
+    def members_changed(self):
+        """
+        Forget everything derived from the guardians and children, to
+        be worked out again when next needed.  The derived values use
+        loader.no_hidden_fields as it was when they were computed.
+        """
+        self._name = None
+        self._sortkey = None
+        self._by_relation = None
+        self._oldest_first = None
+        self._phone_numbers = None
+        self._guardian_emails = None
+
+    def key(self):
+        return group_key(self.guardians)
+
+    def sortkey(self):
+        """
+        Return the key families are listed by: the (last name, first
+        name) of each of their children, in order.
+        """
+        if self._sortkey is None:
+            self._sortkey = tuple(sorted((c.lastname, c.firstname)
+                for c in self.children))
+        return self._sortkey
+
+    def name(self):
+        if not self._name:
+            names = []
+            for p in self.children + self.guardians:
+                names.extend(p.lastname.split("-"))
+            parts = []
+            used = set()
+            for name in names:
+                if not name in used:
+                    parts.append(name)
+                    used.add(name)
+            self._name = "-".join(parts)
+        return self._name
+
+    def add_guardian(self, adult):
+        self.guardians.append(adult)
+
+    def guardians_ladies_first(self):
+        """
+        Return the guardians with mothers and other women first, as a
+        tuple that is only sorted again after the guardians change.
+        """
+        if self._by_relation is None:
+            self._by_relation = tuple(sorted(self.guardians,
+                key=Guardian.ladies_first))
+        return self._by_relation
+
+    def children_oldest_first(self):
+        """
+        Return the children from the highest grade down, as a tuple that
+        is only sorted again after the children change.
+        """
+        if self._oldest_first is None:
+            self._oldest_first = tuple(sorted(self.children,
+                key=Student.sortkey, reverse=True))
+        return self._oldest_first
+
+    def parent_names(self, if_none="", ladies_first=False):
+        if ladies_first:
+            guardians = self.guardians_ladies_first()
+        else:
+            guardians = self.guardians
+        guardians = [g for g in guardians if g.name() != ""
+                and not g.name().startswith("_")]
+        if len(guardians) == 0:
+            return if_none
+        if len(guardians) == 1:
+            return guardians[0].name()
+        if len(guardians) == 2:
+            (g1, g2) = (guardians[0], guardians[1])
+            if g1.lastname == g2.lastname and is_couple(g1, g2):
+                return g1.firstname + " & " + g2.firstname + " " + g2.lastname
+            else:
+                return g1.name() + " & " + g2.name()
+        return " & ".join([g.name() for g in guardians])
+
+    def children_names(self):
+        children = self.children_oldest_first()
+        last_names = set([child.lastname for child in children])
+        if len(last_names) == 1:
+            names = [child.firstname for child in children] 
+            names[-1] += " " + self.children_last_name()
+        else:
+            names = [child.name() for child in children]
+        if len(names) > 1:
+            final = " and ".join((names[-2], names[-1]))
+            names = names[:-2] + [final]
+        return ", ".join(names)
+
+    def child_with_grade(self, index=0, lastname_first=False):
+        try:
+            child = self.children_oldest_first()[index]
+            return "%s (%s)" % (child.name(lastname_first), child.olsclass.grade)
+        except IndexError:
+            return ""
+
+    def children_with_grades(self, lastname_first=False):
+        return "\n".join(["%s (%s)" % (c.name(lastname_first), c.olsclass.grade) 
+            for c in self.children_oldest_first()])
+
+    def children_first_names(self):
+        names = [c.firstname for c in self.children_oldest_first()]
+        if len(names) > 1:
+            final = " and ".join((names[-2], names[-1]))
+            names = names[:-2] + [final]
+        return ", ".join(names)
+
+    def children_last_name(self):
+        return self.children_oldest_first()[0].lastname
+
+    def children_grade_levels(self):
+        grades = [c.olsclass.gradelevel for c in self.children_oldest_first()]
+        return ",".join(grades)
+
+    def guardian_relation(self, index=0):
+        try:
+            guard = self.guardians_ladies_first()[index]
+            return guard.relation
+        except IndexError:
+            return "Other"
+
+    def guardian_name(self, index=0, lastname_first=False):
+        try:
+            guard = self.guardians_ladies_first()[index]
+            if guard.firstname.startswith("_"):
+                return ""
+            return guard.name(lastname_first)
+        except IndexError:
+            return ""
+
+    def guardian_email(self, index=0):
+        try:
+            guard = self.guardians_ladies_first()[index]
+            return guard.email
+        except IndexError:
+            return ""
+
+    def guardian_homephone(self, index=0):
+        try:
+            guard = self.guardians_ladies_first()[index]
+            return guard.homephone
+        except IndexError:
+            return ""
+
+    def guardian_cellphone(self, index=0):
+        try:
+            guard = self.guardians_ladies_first()[index]
+            return guard.cellphone
+        except IndexError:
+            return ""
+
+    def oneline_address(self):
+        return self.address.oneline()
+
+    def multiline_address(self):
+        return self.address.multiline()
+
+    def address_line1(self):
+        return self.address.address_line1()
+
+    def address_line2(self):
+        return self.address.address_line2()
+
+    def phone_numbers(self, sep=None):
+        if self._phone_numbers is None:
+            lines = []
+            homephone = None
+            for g in self.guardians_ladies_first():
+                ghome, gcell = [redacted(f) for f in (g.homephone, g.cellphone)]
+                if ghome:
+                    if not homephone:
+                        homephone = ghome
+                    elif ghome != homephone:
+                        lines.append(ghome + " (%s home)" % g.shortrelation())
+                if gcell:
+                    lines.append(gcell + " (%s cell)" % g.shortrelation())
+            if homephone:
+                lines.insert(0, homephone)
+            self._phone_numbers = tuple(lines)
+        lines = list(self._phone_numbers)
+        if sep is None:
+            return lines
+        if lines:
+            return sep.join(lines)
+        else:
+            return "(no phone numbers)"
+
+    def emails(self, sep=None):
+        if self._guardian_emails is None:
+            self._guardian_emails = tuple(
+                    g.email + " (%s)" % g.shortrelation()
+                    for g in self.guardians_ladies_first() if g.email)
+        lines = []
+        if self.email:
+            lines.append(self.email)
+        lines.extend(self._guardian_emails)
+        if sep is None:
+            return lines
+        if lines:
+            return "\n".join(lines)
+        else:
+            return "(no email addresses)"
+
+    def primary_phone(self):
+        for g in self.guardians_ladies_first():
+            if g.homephone:
+                return g.homephone
+            if g.cellphone:
+                return g.cellphone
+
+    def primary_email(self):
+        if self.email:
+            return self.email
+        for g in self.guardians_ladies_first():
+            if g.email:
+                return g.email
+
+class OLSClass(object):
+    __slots__ = ('key', 'title', 'grade', 'gradelevel', 'rank', 'teacher',
+            'aide', 'classmom', 'roster', '_id')
+
+    def __init__(self, key, title, teacher=None, aide=None, classmom=None,
+            roster=[], grade=None, level=None, rank=None):
+        # The grade, its level and rank are worked out from the title
+        # unless they are given (as they are stored in the database)
+        if grade is None:
+            grade = re.sub(r" - \S+$", "", title)
+        self.key = key
+        self.title = title
+        self.grade = grade
+        self.gradelevel = gradelevel[grade] if level is None else level
+        self.rank = graderank[grade] if rank is None else rank
+        self.teacher = teacher
+        self.aide = aide
+        self.classmom = classmom
+        self.roster = roster
+        self._id = None     # database id
+
+    def add_staff(self, person):
+        if person.role == "Teacher":
+            self.teacher = person
+        elif person.role == "Aide":
+            self.aide = person
+        elif person.role == "Classmom":
+            self.classmom = person
+        else:
+            return
+        person.olsclass = self
+
+
+def lastname_sortkey(person):
+    return person.lastname
+
+class Directory(object):
+    """
+    Everything the reports need: the families, the students, and the
+    classes with their rosters.
+
+    `families` is a tuple of the families in Family.sortkey() order.
+    `classnames` lists the class keys in the order the classes are
+    reported, `classes` maps each key to its OLSClass, and
+    `class_roster` maps each key to a tuple of the students in that
+    class, by last name.  The orderings are worked out once, here, and
+    shared by every report.
+    """
+    def __init__(self, families, students, classes, classnames, class_roster):
+        self.families = tuple(sorted(families, key=Family.sortkey))
+        self.students = students
+        self.classes = classes
+        self.classnames = classnames
+        self.class_roster = dict((classname,
+            tuple(sorted(roster, key=lastname_sortkey)))
+            for (classname, roster) in class_roster.iteritems())
@@ -0,0 +1,42 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from contacts.reports import database_directory, reports
+
+class Command(BaseCommand):
+    help = "Write the directory reports from the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('report', nargs='*',
+                help="Reports to write (default: all of them)")
+        parser.add_argument('--year',
+                default=getattr(settings, 'DIRECTORY_SCHOOL_YEAR', ""),
+                help="School year to name the report files with")
+        parser.add_argument('--output-dir', default=".",
+                help="Directory to write the report files in")
+        parser.add_argument('--list', action='store_true',
+                help="List the reports instead of writing them")
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for report in reports.values():
+                self.stdout.write("%-20s %s" % (report.name, report.title))
+            return
+
+        names = options['report'] or list(reports)
+        for name in names:
+            if name not in reports:
+                raise CommandError("Unknown report %r (try --list)" % name)
+
+        directory = database_directory()
+        for name in names:
+            report = reports[name](directory)
+            for (filename, contents) in report.outputs(options['year']):
+                path = os.path.join(options['output_dir'], filename)
+                with open(path, "w") as fp:
+                    fp.write(contents)
+                self.stdout.write("wrote %s" % path)
+            for problem in report.problems:
+                self.stderr.write(problem)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from contacts.models import FamilyCard
+
+class Command(BaseCommand):
+    help = "Rebuild the pre-rendered directory card for every family."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = FamilyCard.objects.rebuild()
+        self.stdout.write("Rebuilt %d family cards" % count)
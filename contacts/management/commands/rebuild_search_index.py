@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from contacts import search
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of families and classes."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = search.rebuild_index()
+        self.stdout.write("Indexed %d documents" % count)
@@ -0,0 +1,186 @@
+"""
+Request and SQL metrics, served in the Prometheus text format.
+
+MetricsMiddleware times each request and, by wrapping the cursors of
+the database connections, the SQL it runs.  The numbers are kept per
+URL name - a latency histogram, a histogram of queries per request, and
+running totals of queries and SQL time - and rendered by the metrics
+view.  Nothing depends on DEBUG query logging.
+
+Metrics are kept in memory, so each server process reports its own.
+The SQL run by a streaming response after it leaves the middleware
+isn't counted.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from django.db import connections
+from django.db.backends.utils import CursorWrapper
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+        5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+UNMATCHED = "<unmatched>"   # the view label of requests no URL matched
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Yield (upper bound, count at or below it) for each bucket."""
+        total = 0
+        for (bound, count) in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            yield (bound, total)
+
+class ViewMetrics(object):
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.sql_time = 0.0
+
+class Registry(object):
+    """
+    The metrics of every view, shared by the threads of this process.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, seconds, queries, sql_time):
+        with self.lock:
+            metrics = self.views.get(view)
+            if metrics is None:
+                metrics = self.views[view] = ViewMetrics()
+            metrics.latency.observe(seconds)
+            metrics.queries.observe(queries)
+            metrics.sql_time += sql_time
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+    def render(self):
+        """Return the metrics in the Prometheus text format."""
+        with self.lock:
+            views = sorted(self.views.items())
+            lines = []
+            histograms = (
+                ("directory_request_duration_seconds",
+                    "Time taken to answer each request, by view.",
+                    lambda m: m.latency),
+                ("directory_request_queries",
+                    "SQL queries run by each request, by view.",
+                    lambda m: m.queries))
+            for (name, help, histogram) in histograms:
+                lines.append("# HELP %s %s" % (name, help))
+                lines.append("# TYPE %s histogram" % name)
+                for (view, metrics) in views:
+                    label = 'view="%s"' % escape(view)
+                    for (bound, count) in histogram(metrics).cumulative():
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (
+                            name, label, bound, count))
+                    lines.append("%s_sum{%s} %r" % (name, label,
+                        float(histogram(metrics).sum)))
+                    lines.append("%s_count{%s} %d" % (name, label,
+                        histogram(metrics).count))
+            counters = (
+                ("directory_sql_queries_total",
+                    "SQL queries run by requests, by view.",
+                    lambda m: m.queries.sum),
+                ("directory_sql_duration_seconds_total",
+                    "Time spent in SQL queries by requests, by view.",
+                    lambda m: m.sql_time))
+            for (name, help, value) in counters:
+                lines.append("# HELP %s %s" % (name, help))
+                lines.append("# TYPE %s counter" % name)
+                for (view, metrics) in views:
+                    lines.append('%s{view="%s"} %r' % (name, escape(view),
+                        float(value(metrics))))
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+def escape(value):
+    return (value.replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"))
+
+class RequestMetrics(object):
+    def __init__(self):
+        self.start = time.time()
+        self.queries = 0
+        self.sql_time = 0.0
+
+# The metrics of the request being handled by each thread
+_local = threading.local()
+
+def current_request():
+    return getattr(_local, 'request', None)
+
+class TimedCursor(CursorWrapper):
+    """
+    Wraps a connection's cursor to count and time the queries it runs
+    for the current request.
+    """
+    def execute(self, sql, params=None):
+        return self.timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self.timed(self.cursor.executemany, sql, param_list)
+
+    def timed(self, method, *args):
+        request = current_request()
+        if request is None:
+            return method(*args)
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            request.queries += 1
+            request.sql_time += time.time() - start
+
+def instrument(connection):
+    """
+    Make a database connection wrap its cursors in TimedCursor.
+    """
+    if getattr(connection, 'metrics_instrumented', False):
+        return
+    for name in ('make_cursor', 'make_debug_cursor'):
+        make = getattr(connection, name)
+        setattr(connection, name, lambda cursor, make=make:
+                TimedCursor(make(cursor), connection))
+    connection.metrics_instrumented = True
+
+class MetricsMiddleware(object):
+    """
+    Record the latency and SQL of each request under the name of the
+    URL it matched.  List it first, so the time spent in the other
+    middleware counts too.
+    """
+    def process_request(self, request):
+        # Connections belong to a thread, and are created on first use
+        for connection in connections.all():
+            instrument(connection)
+        _local.request = RequestMetrics()
+
+    def process_response(self, request, response):
+        metrics = current_request()
+        if metrics is None:
+            return response
+        _local.request = None
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else UNMATCHED
+        registry.record(view, time.time() - metrics.start, metrics.queries,
+                metrics.sql_time)
+        return response
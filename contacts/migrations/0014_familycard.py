@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Prefetch
+
+
+def fill_family_cards(apps, schema_editor):
+    """
+    Build a card for each family already in the database.  The cards
+    are rendered by the current models, which load only the columns
+    that exist at this point in the migrations.
+    """
+    from contacts.models import Family, FamilyCard, Guardian, Student
+
+    guardians = Guardian.objects.select_related('person').only('relation',
+            'family', 'person', 'person__firstname', 'person__lastname',
+            'person__email', 'person__homephone', 'person__cellphone')
+    students = Student.objects.select_related('olsclass').only('firstname',
+            'lastname', 'family', 'olsclass', 'olsclass__grade')
+    families = Family.objects.select_related('address').prefetch_related(
+            Prefetch('guardian_set', queryset=guardians),
+            Prefetch('student_set', queryset=students))
+    FamilyCard.objects.bulk_create([FamilyCard.from_family(family)
+        for family in families], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0013_auto_20150907_1009'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FamilyCard',
+            fields=[
+                ('family', models.OneToOneField(related_name='card', primary_key=True, serialize=False, to='contacts.Family')),
+                ('name', models.CharField(max_length=64, blank=True)),
+                ('private', models.BooleanField(default=False)),
+                ('parents', models.CharField(max_length=255, blank=True)),
+                ('address', models.TextField(blank=True)),
+                ('phone_numbers', models.TextField(default=b'[]')),
+                ('emails', models.TextField(default=b'[]')),
+                ('students', models.TextField(default=b'[]')),
+            ],
+            options={
+                'ordering': ('name', 'family'),
+            },
+        ),
+        migrations.AlterField(
+            model_name='guardian',
+            name='relation',
+            field=models.CharField(max_length=32, choices=[(b'Mother', b'Mother'), (b'Father', b'Father'), (b'Aunt', b'Aunt'), (b'Uncle', b'Uncle'), (b'Grandmother', b'Grandmother'), (b'Grandfather', b'Grandfather'), (b'Sister', b'Sister'), (b'Brother', b'Brother'), (b'Guardian', b'Guardian')]),
+        ),
+        migrations.RunPython(fill_family_cards, migrations.RunPython.noop),
+    ]
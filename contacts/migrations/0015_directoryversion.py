@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    DirectoryVersion = apps.get_model('contacts', 'DirectoryVersion')
+    DirectoryVersion.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0014_familycard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryVersion',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('generation', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0015_directoryversion'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='familycard',
+            index_together=set([('name', 'family')]),
+        ),
+    ]
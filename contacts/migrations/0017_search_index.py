@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Prefetch
+
+
+def create_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE contacts_search USING fts5("
+        "kind UNINDEXED, object_id UNINDEXED, title, body, "
+        "tokenize = 'unicode61 remove_diacritics 1')")
+
+
+def fill_search_index(apps, schema_editor):
+    """
+    Index the families and classes already in the database.  The
+    documents are built by the current models, which load only the
+    columns that exist at this point in the migrations.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from contacts import search
+    from contacts.models import Family, Guardian, OLSClass, Student
+
+    adult_fields = ('firstname', 'lastname', 'email', 'homephone',
+            'cellphone')
+    guardians = Guardian.objects.select_related('person').only('relation',
+            'family', 'person', *['person__' + f for f in adult_fields])
+    students = Student.objects.select_related('olsclass').only('firstname',
+            'lastname', 'family', 'olsclass', 'olsclass__title')
+    families = Family.objects.select_related('address').prefetch_related(
+            Prefetch('guardian_set', queryset=guardians),
+            Prefetch('student_set', queryset=students))
+    staff = ('teacher', 'aide', 'classmom')
+    classes = OLSClass.objects.select_related(*staff).only('title', 'grade',
+            *[role + '__' + f for role in staff for f in adult_fields])
+    search.rebuild_index(families, classes)
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS contacts_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0016_familycard_name_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+
+
+def phone_digits(phone):
+    digits = re.sub(r"\D", "", phone or "")
+    if len(digits) == 11 and digits.startswith("1"):
+        digits = digits[1:]
+    return digits
+
+
+def fill_contact_keys(apps, schema_editor):
+    Adult = apps.get_model('contacts', 'Adult')
+    for adult in Adult.objects.all():
+        adult.homephone_digits = phone_digits(adult.homephone)
+        adult.cellphone_digits = phone_digits(adult.cellphone)
+        adult.email_key = (adult.email or "").strip().lower()
+        adult.save(update_fields=['homephone_digits', 'cellphone_digits',
+            'email_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0017_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='adult',
+            name='cellphone_digits',
+            field=models.CharField(db_index=True, max_length=32, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='adult',
+            name='email_key',
+            field=models.CharField(db_index=True, max_length=64, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='adult',
+            name='homephone_digits',
+            field=models.CharField(db_index=True, max_length=32, editable=False, blank=True),
+        ),
+        migrations.RunPython(fill_contact_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0018_adult_contact_keys'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='familycard',
+            options={'ordering': ('name', 'family_id')},
+        ),
+        migrations.AlterField(
+            model_name='family',
+            name='name',
+            field=models.CharField(db_index=True, max_length=64, blank=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='adult',
+            index_together=set([('lastname', 'firstname')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='guardian',
+            index_together=set([('family', 'person')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='olsclass',
+            index_together=set([('rank', 'title')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='student',
+            index_together=set([('lastname', 'firstname'), ('olsclass', 'lastname', 'firstname')]),
+        ),
+        # Address is ordered by ('-city', 'street'), which an ascending
+        # index_together can't serve
+        migrations.RunSQL(
+            ["CREATE INDEX contacts_address_city_street "
+             "ON contacts_address (city DESC, street)"],
+            ["DROP INDEX contacts_address_city_street"]),
+    ]
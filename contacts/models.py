@@ -1,4 +1,21 @@
+import json
+import re
+
 from django.db import models
+from django.db.models import F
+
+def normalize_phone(phone):
+    """
+    Reduce a phone number to its digits, dropping a leading US
+    country code.
+    """
+    digits = re.sub(r"\D", "", phone or "")
+    if len(digits) == 11 and digits.startswith("1"):
+        digits = digits[1:]
+    return digits
+
+def normalize_email(email):
+    return (email or "").strip().lower()
 
 class Student(models.Model):
     firstname = models.CharField(max_length=64)
@@ -17,6 +34,49 @@ class Student(models.Model):
 
     class Meta:
         ordering = ('lastname', 'firstname')
+        index_together = [('lastname', 'firstname'),
+                ('olsclass', 'lastname', 'firstname')]
+
+class AdultQuerySet(models.QuerySet):
+    # Correlated subqueries giving each adult's relation to their family
+    # (if they are a guardian) and their role in a class (if they are
+    # staff), so both can be filtered and sorted on in the database.
+    RELATION_SQL = ("SELECT g.relation FROM contacts_guardian g "
+            "WHERE g.person_id = contacts_adult.id")
+    STAFF_ROLE_SQL = ("SELECT CASE "
+            "WHEN c.teacher_id = contacts_adult.id THEN 'Teacher' "
+            "WHEN c.aide_id = contacts_adult.id THEN 'Aide' "
+            "ELSE 'Class Mom' END FROM contacts_olsclass c "
+            "WHERE contacts_adult.id IN (c.teacher_id, c.aide_id, c.classmom_id) "
+            "ORDER BY c.rank DESC LIMIT 1")
+    STAFF_ROLES = ("Teacher", "Aide", "Class Mom")
+    ANY_STAFF = "staff"
+    ANY_GUARDIAN = "guardian"
+
+    def with_roles(self):
+        """
+        Annotate each adult with `relation` and `staff_role` (either may
+        be None).
+        """
+        return self.extra(select={
+            'relation': self.RELATION_SQL,
+            'staff_role': self.STAFF_ROLE_SQL,
+            })
+
+    def with_role(self, role):
+        """
+        Return the adults having the given staff role or relation, or
+        with ANY_STAFF or ANY_GUARDIAN, any staff member or guardian.
+        """
+        if role == self.ANY_STAFF:
+            return self.extra(where=["(%s) IS NOT NULL" % self.STAFF_ROLE_SQL])
+        elif role == self.ANY_GUARDIAN:
+            return self.extra(where=["(%s) IS NOT NULL" % self.RELATION_SQL])
+        elif role in self.STAFF_ROLES:
+            where = "(%s) = %%s" % self.STAFF_ROLE_SQL
+        else:
+            where = "(%s) = %%s" % self.RELATION_SQL
+        return self.extra(where=[where], params=[role])
 
 class Adult(models.Model):
     firstname = models.CharField(max_length=64)
@@ -25,15 +85,44 @@ class Adult(models.Model):
     homephone = models.CharField(max_length=32, blank=True, null=True)
     cellphone = models.CharField(max_length=32, blank=True, null=True)
 
+    # Normalized copies of the contact fields, for reverse lookups
+    homephone_digits = models.CharField(max_length=32, blank=True,
+            db_index=True, editable=False)
+    cellphone_digits = models.CharField(max_length=32, blank=True,
+            db_index=True, editable=False)
+    email_key = models.CharField(max_length=64, blank=True, db_index=True,
+            editable=False)
+
+    objects = AdultQuerySet.as_manager()
+
     def __unicode__(self):
         return self.name()
 
+    def normalize(self):
+        self.homephone_digits = normalize_phone(self.homephone)
+        self.cellphone_digits = normalize_phone(self.cellphone)
+        self.email_key = normalize_email(self.email)
+
+    def save(self, *args, **kwargs):
+        self.normalize()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | set([
+                'homephone_digits', 'cellphone_digits', 'email_key'])
+        super(Adult, self).save(*args, **kwargs)
+
     def name(self, lastname_first=False):
         if lastname_first:
             return self.lastname + ", " + self.firstname
         else:
             return self.firstname + " " + self.lastname
 
+    def role(self):
+        """
+        The adult's staff role and/or relation, for adults fetched
+        with AdultQuerySet.with_roles().
+        """
+        return ", ".join(r for r in (self.staff_role, self.relation) if r)
+
     def contact_info(self):
         info = []
         if self.cellphone:
@@ -46,6 +135,7 @@ class Adult(models.Model):
 
     class Meta:
         ordering = ('lastname', 'firstname')
+        index_together = [('lastname', 'firstname')]
 
 class Guardian(models.Model):
     MOTHER = "Mother"
@@ -87,6 +177,7 @@ class Guardian(models.Model):
 
     class Meta:
         ordering = ('person',)
+        index_together = [('family', 'person')]
 
 class Address(models.Model):
     street = models.CharField(max_length=64)
@@ -111,14 +202,28 @@ class Address(models.Model):
         return "{} {}".format(self.street, self.city)
 
     class Meta:
+        # Migration 0019 adds an index on (city DESC, street) to match;
+        # index_together can't declare a descending column
         ordering = ('-city', 'street',)
 
+class FamilyQuerySet(models.QuerySet):
+    def directory(self):
+        """
+        Return the families with everything needed to render their
+        directory entries (address, guardians, and students with their
+        classes) fetched up front, in a fixed number of queries.
+        """
+        return self.select_related('address').prefetch_related(
+                'guardian_set__person', 'student_set__olsclass')
+
 class Family(models.Model):
-    name = models.CharField(max_length=64, blank=True)
+    name = models.CharField(max_length=64, blank=True, db_index=True)
     address = models.ForeignKey('Address', related_name="+", blank=True, null=True)
     email = models.CharField(max_length=64, blank=True, null=True)
     private = models.BooleanField()
 
+    objects = FamilyQuerySet.as_manager()
+
     def parent_names(self, if_none=""):
         # guardians = [g.person for g in self.guardian_set.all()]
         guardians = [g for g in self.guardian_set.all() if g.person.name() != ""
@@ -165,6 +270,29 @@ class Family(models.Model):
                     'value':g.person.email})
         return info
 
+    def directory_info(self):
+        """
+        Return the family's directory entry as a dict of display values.
+        """
+        info = {
+                'id': self.id,
+                'students': [],
+                'parents': self.parent_names(),
+                'email': '(no email)',
+                'address': ['(no address)'],
+                'phone_numbers': self.phone_numbers(),
+                'emails': self.emails(),
+                }
+        if self.address is not None:
+                info['address'] = self.address.multiline()
+        for student in self.student_set.all():
+            info['students'].append({
+                'firstname': student.firstname,
+                'lastname': student.lastname,
+                'grade': student.olsclass.grade,
+                })
+        return info
+
     def __unicode__(self):
         if self.name:
             return self.name
@@ -175,6 +303,33 @@ class Family(models.Model):
         verbose_name_plural = "Families"
         ordering = ('name',)
 
+class OLSClassQuerySet(models.QuerySet):
+    def with_staff(self):
+        """
+        Return the classes with their teacher, aide and class mom joined
+        in, so the staff names don't each cost a query.
+        """
+        return self.select_related('teacher', 'aide', 'classmom')
+
+    def rosters(self):
+        """
+        Return a dict of display values for each class, including its
+        staff and the names of its students, using two queries.
+        """
+        students = {}
+        for student in Student.objects.all():
+            students.setdefault(student.olsclass_id, []).append(student.name())
+        rosters = []
+        for olsclass in self.with_staff():
+            rosters.append({
+                'tag': olsclass.tag(),
+                'grade': olsclass.grade,
+                'teacher': olsclass.teacher_name(),
+                'aide': olsclass.aide_name(),
+                'classmom': olsclass.classmom_name(),
+                'students': students.get(olsclass.id, []) })
+        return rosters
+
 class OLSClass(models.Model):
     title = models.CharField(max_length=64)
     grade = models.CharField(max_length=16)
@@ -186,6 +341,8 @@ class OLSClass(models.Model):
 
     order_field = '-rank'
 
+    objects = OLSClassQuerySet.as_manager()
+
     def tag(self):
         return "class-{}".format(self.id)
 
@@ -214,6 +371,110 @@ class OLSClass(models.Model):
         verbose_name = "OLS Class"
         verbose_name_plural = "OLS Classes"
         ordering = ('-rank',)
+        index_together = [('rank', 'title')]
+
+class FamilyCardQuerySet(models.QuerySet):
+    def refresh(self, family_ids):
+        """
+        Rebuild the cards for the given families.  Cards for families
+        that no longer exist are simply removed.
+        """
+        family_ids = set(family_ids)
+        if not family_ids:
+            return
+        self.filter(family_id__in=family_ids).delete()
+        families = Family.objects.directory().filter(id__in=family_ids)
+        self.bulk_create([FamilyCard.from_family(f) for f in families])
+
+    def rebuild(self, families=None):
+        """
+        Throw away all cards and rebuild one for every family.  The
+        families may be passed in, fetched with Family.objects.directory().
+        """
+        if families is None:
+            families = Family.objects.directory()
+        self.all().delete()
+        cards = [FamilyCard.from_family(f) for f in families]
+        self.bulk_create(cards, batch_size=500)
+        return len(cards)
+
+class FamilyCard(models.Model):
+    """
+    A family's directory entry, rendered ahead of time so the family
+    page can be served from this one table.  Cards are kept up to date
+    by the signal handlers in contacts.signals.
+    """
+    family = models.OneToOneField('Family', primary_key=True,
+            related_name='card')
+    name = models.CharField(max_length=64, blank=True)
+    private = models.BooleanField(default=False)
+    parents = models.CharField(max_length=255, blank=True)
+    address = models.TextField(blank=True)          # one line per line
+    phone_numbers = models.TextField(default="[]")  # JSON
+    emails = models.TextField(default="[]")         # JSON
+    students = models.TextField(default="[]")       # JSON
+
+    objects = FamilyCardQuerySet.as_manager()
+
+    @classmethod
+    def from_family(cls, family):
+        info = family.directory_info()
+        return cls(family_id=family.id, name=family.name,
+                private=family.private, parents=info['parents'],
+                address="\n".join(info['address']),
+                phone_numbers=json.dumps(info['phone_numbers']),
+                emails=json.dumps(info['emails']),
+                students=json.dumps(info['students']))
+
+    def directory_info(self):
+        """
+        Return the same dict as Family.directory_info().
+        """
+        return {
+                'id': self.family_id,
+                'students': json.loads(self.students),
+                'parents': self.parents,
+                'email': '(no email)',
+                'address': self.address.split("\n"),
+                'phone_numbers': json.loads(self.phone_numbers),
+                'emails': json.loads(self.emails),
+                }
+
+    def __unicode__(self):
+        return self.name or "Family {}".format(self.family_id)
+
+    class Meta:
+        ordering = ('name', 'family_id')
+        index_together = [('name', 'family')]
+
+class DirectoryVersionQuerySet(models.QuerySet):
+    def current(self):
+        """
+        Return the current directory generation.
+        """
+        generation = self.filter(pk=1).values_list('generation', flat=True)
+        return generation[0] if generation else 0
+
+    def bump(self):
+        """
+        Advance the directory generation, invalidating anything cached
+        under the previous one.
+        """
+        if not self.filter(pk=1).update(generation=F('generation') + 1):
+            self.create(pk=1, generation=1)
+
+class DirectoryVersion(models.Model):
+    """
+    A single-row table counting changes to the directory data.  Caches
+    of rendered pages are keyed on the generation, so bumping it (see
+    contacts.signals) makes all of them stale at once.
+    """
+    generation = models.BigIntegerField(default=0)
+
+    objects = DirectoryVersionQuerySet.as_manager()
+
+    def __unicode__(self):
+        return "Generation {}".format(self.generation)
 
 def is_couple(g1, g2):
     if g1.relation == "Father" and g2.relation == "Mother":
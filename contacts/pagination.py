@@ -0,0 +1,104 @@
+"""
+Keyset (cursor) pagination.
+
+A page is fetched with a WHERE clause that starts just past the last
+row of the previous page, rather than with an OFFSET, so every page
+costs the same no matter how far into the list it is.  The cursor is
+an opaque, URL-safe encoding of that last row's sort key.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(names, pk):
+    return base64.urlsafe_b64encode(json.dumps(list(names) + [pk]))
+
+def decode_cursor(cursor, count=1):
+    """
+    Return the (names, pk) of a cursor made for `count` name fields.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        if not isinstance(key, list) or len(key) != count + 1:
+            raise ValueError
+        return (tuple(key[:-1]), int(key[-1]))
+    except (TypeError, ValueError):
+        raise InvalidCursor("bad cursor: %r" % cursor)
+
+def name_fields(name_field):
+    if isinstance(name_field, basestring):
+        return (name_field,)
+    return tuple(name_field)
+
+def after_key(fields, names, pk):
+    """
+    Return a Q matching the rows that sort after the given key.
+    """
+    q = Q(pk__gt=pk)
+    for (field, name) in reversed(zip(fields, names)):
+        q = Q(**{field + '__gt': name}) | (Q(**{field: name}) & q)
+    return q
+
+class KeysetPage(object):
+    def __init__(self, items, next_cursor, limit):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.limit = limit
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+def page_params(request):
+    """
+    Return the (after, limit) paging parameters of a request.  The
+    cursor is left encoded; a bad limit raises InvalidCursor.
+    """
+    max_limit = getattr(settings, 'DIRECTORY_MAX_PAGE_SIZE', 500)
+    try:
+        limit = int(request.GET.get('limit',
+            getattr(settings, 'DIRECTORY_PAGE_SIZE', 60)))
+    except ValueError:
+        raise InvalidCursor("bad limit: %r" % request.GET['limit'])
+    return (request.GET.get('after') or None, max(1, min(limit, max_limit)))
+
+def keyset_page(queryset, after=None, limit=60, name_field='name'):
+    """
+    Return a KeysetPage of up to `limit` items from the queryset,
+    ordered by (name_field, pk), starting after the given cursor.
+    `name_field` may also be a tuple of fields, to order by each in turn.
+    """
+    fields = name_fields(name_field)
+    # Order by the primary key's own column: when it is a relation
+    # (as on FamilyCard), 'pk' would sort by the related model's
+    # ordering through a join instead
+    queryset = queryset.order_by(*fields + (queryset.model._meta.pk.attname,))
+    if after is not None:
+        names, pk = decode_cursor(after, len(fields))
+        queryset = queryset.filter(after_key(fields, names, pk))
+    items = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, field) for field in fields],
+                last.pk)
+    return KeysetPage(items, next_cursor, limit)
+
+def keyset_chunks(queryset, size=100, name_field='name'):
+    """
+    Iterate over the whole queryset, ordered by (name_field, pk), one
+    keyset page of `size` items at a time.  Only one page is held in
+    memory, and each page costs the same single query.
+    """
+    after = None
+    while True:
+        page = keyset_page(queryset, after, size, name_field)
+        yield page.items
+        if not page.has_next():
+            return
+        after = page.next_cursor
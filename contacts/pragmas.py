@@ -0,0 +1,53 @@
+"""
+Tuning for connections to an SQLite database.
+
+Each new SQLite connection is given the PRAGMAs in the
+DIRECTORY_SQLITE_PRAGMAS setting, or DEFAULT_PRAGMAS when it isn't
+set.  The defaults, kept only here, put the database in WAL mode, so
+the pages keep being served from the last committed data while an
+import writes, wait a while for a lock rather than failing at once, and
+give each connection a larger page cache and memory-mapped reads.
+"""
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.signals import connection_created
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'wal',
+    'busy_timeout': 5000,           # milliseconds
+    'synchronous': 'normal',        # safe in WAL mode
+    'mmap_size': 64 * 1024 * 1024,  # bytes
+    'cache_size': -16000,           # negative: in KiB
+}
+
+# PRAGMA statements can't take parameters, so names and values are
+# limited to words and numbers
+WORD = re.compile(r"^-?\w+$")
+
+def sqlite_pragmas():
+    """
+    Return the (name, value) of each PRAGMA to apply, the journal mode
+    first, as it decides what some of the others mean.
+    """
+    pragmas = getattr(settings, 'DIRECTORY_SQLITE_PRAGMAS', DEFAULT_PRAGMAS)
+    pragmas = sorted((pragmas or {}).items(),
+            key=lambda item: (item[0] != 'journal_mode', item[0]))
+    for (name, value) in pragmas:
+        if not (WORD.match(name) and WORD.match(str(value))):
+            raise ImproperlyConfigured("bad SQLite pragma: %s = %r" %
+                    (name, value))
+    return pragmas
+
+def tune_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    cursor = connection.connection.cursor()
+    try:
+        for (name, value) in sqlite_pragmas():
+            cursor.execute("PRAGMA %s = %s" % (name, value))
+    finally:
+        cursor.close()
+
+connection_created.connect(tune_connection, dispatch_uid='sqlite_pragmas')
@@ -0,0 +1,387 @@
+"""
+The directory reports - class rosters, printed directories, and the
+spreadsheets for class parents and mail merges.
+
+Each report is a Report subclass registered by name in `reports`.  A
+report renders a contacts.loader.Directory, which can come from the
+spreadsheets (see scripts/load_spreadsheet.py) or from the database
+(see database_directory()).  This module doesn't import Django at load
+time, so the loader script can use it on its own.
+"""
+import csv
+import collections
+from cStringIO import StringIO
+
+from .loader import Directory, Family, Guardian, OLSClass, Staff, Student
+
+reports = collections.OrderedDict()   # report classes, by name
+
+def register(report_class):
+    reports[report_class.name] = report_class
+    return report_class
+
+class Report(object):
+    """
+    Base class for the reports.  Subclasses set `name`, `title` and
+    `filename` (formatted with the school year), and implement write().
+    """
+    name = None
+    title = None
+    filename = None
+    content_type = "text/plain"
+    single_file = True
+    # Templates are given the classes themselves, to list them
+    do_not_call_in_templates = True
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.problems = []  # data problems noticed while writing
+
+    def outputs(self, year):
+        """
+        Yield a (filename, contents) pair for each file in the report.
+        """
+        fp = StringIO()
+        self.write(fp)
+        yield (self.filename.format(year=year), fp.getvalue())
+
+    def write(self, fp):
+        raise NotImplementedError
+
+    def families(self):
+        return self.directory.families
+
+    def classes(self):
+        """
+        Yield (class, students) for each class with students in it.
+        """
+        for classname in self.directory.classnames:
+            roster = self.directory.class_roster.get(classname, [])
+            if len(roster) == 0:
+                continue
+            yield (self.directory.classes[classname], roster)
+
+class TextReport(Report):
+    def write(self, fp):
+        fp.write("\n".join(self.lines()))
+
+    def lines(self):
+        raise NotImplementedError
+
+class SpreadsheetReport(Report):
+    content_type = "text/csv"
+    header = []
+
+    def write(self, fp):
+        wtr = csv.writer(fp)
+        wtr.writerow(self.header)
+        for row in self.rows():
+            wtr.writerow(row)
+
+    def rows(self):
+        raise NotImplementedError
+
+def family_row(family):
+    """
+    The columns describing a family and its children, as used by the
+    family and mail merge spreadsheets.
+    """
+    return [family.children_last_name(),
+            family.parent_names(ladies_first=True),
+            family.children_names(),
+            family.children_grade_levels(),
+            family.child_with_grade(0),
+            family.child_with_grade(1),
+            family.child_with_grade(2)]
+
+def guardian_columns(family):
+    """
+    The columns for a family's first two guardians, ending the rows of
+    the family and mail merge spreadsheets.
+    """
+    return [family.guardian_relation(0),
+            family.guardian_email(0),
+            family.guardian_cellphone(0),
+            family.guardian_homephone(0),
+            family.guardian_relation(1),
+            family.guardian_email(1),
+            family.guardian_cellphone(1),
+            family.guardian_homephone(1),
+            "" ]
+
+@register
+class ClassRoster(TextReport):
+    name = "class-roster"
+    title = "Class rosters"
+    filename = "ols-classes-{year}.txt"
+
+    def lines(self):
+        lines = []
+        lines.append("\nClasses")
+        for (cls, roster) in self.classes():
+            if cls.teacher:
+                lines.append("%s - %s" % (cls.grade, cls.teacher.name()))
+            else:
+                lines.append("%s - " % (cls.grade))
+            if cls.aide:
+                lines.append("Aide: " + cls.aide.name())
+            if cls.classmom:
+                lines.append("Class parent: " + cls.classmom.name())
+            lines.append("")
+            for student in roster:
+                sibs = student.siblings()
+                if sibs:
+                    lines.append("    " + student.name() + " *")
+                else:
+                    lines.append("    " + student.name())
+            lines.append("")
+        lines.append("")
+        return lines
+
+@register
+class DirectoryByClass(TextReport):
+    name = "directory-by-class"
+    title = "Directory by class"
+    filename = "ols-class-directory-{year}.txt"
+
+    def lines(self):
+        lines = []
+        for (cls, roster) in self.classes():
+            lines.append("- " * 16)
+            if cls.teacher:
+                lines.append("%s - %s" % (cls.grade, cls.teacher.name()))
+            else:
+                lines.append("%s" % (cls.grade))
+            lines.append("- " * 16)
+            if cls.classmom:
+                lines.append("Class parent: " + cls.classmom.name())
+            if cls.aide:
+                lines.append("Aide: " + cls.aide.name())
+            lines.append("")
+            for student in roster:
+                if student.family.private:
+                    continue
+                lines.append(student.name(lastname_first=True))
+                lines.append(student.family.parent_names("(no parent names)"))
+                lines.append(student.family.multiline_address())
+                lines.append(student.family.phone_numbers(sep="\n"))
+                lines.append(student.family.emails(sep="\n"))
+                lines.append("")
+        lines.append("")
+        return lines
+
+@register
+class DirectoryByFamily(TextReport):
+    name = "directory-by-family"
+    title = "Directory by family"
+    filename = "ols-family-directory-{year}.txt"
+
+    def lines(self):
+        lines = []
+        for family in self.families():
+            if family.private:
+                continue
+            lines.append(family.children_with_grades(lastname_first=True))
+            lines.append(family.parent_names("(no parent names)"))
+            lines.append(family.multiline_address())
+            lines.append(family.phone_numbers(sep="\n"))
+            lines.append(family.emails(sep="\n"))
+            lines.append("")
+        lines.append("")
+        return lines
+
+@register
+class FamilySpreadsheet(SpreadsheetReport):
+    name = "family-spreadsheet"
+    title = "Family hours spreadsheet"
+    filename = "ols-family-hours-{year}.csv"
+    header = ["Family", "Parents", "Children", "Grades",
+            "Student1", "Student2", "Student3",
+            "Address", "Address2",
+            "Relation1", "Email1", "Cell1", "Phone1",
+            "Relation2", "Email2", "Cell2", "Phone2",
+            ""]
+
+    def rows(self):
+        for family in self.families():
+            yield (family_row(family) +
+                    [family.address_line1(), family.address_line2()] +
+                    guardian_columns(family))
+
+@register
+class MothersSpreadsheet(SpreadsheetReport):
+    name = "mothers"
+    title = "Mothers with a different last name"
+    filename = "mothers-{year}.csv"
+    header = ["Guardian", "Children"]
+
+    def rows(self):
+        for family in self.families():
+            guardians = family.guardians_ladies_first()
+            if guardians:
+                g = guardians[0]
+                if g.lastname != family.children_last_name():
+                    yield [g.name(), family.children_names()]
+            else:
+                self.problems.append("no guardians for %s" %
+                        family.children_last_name())
+
+@register
+class ClassParentSpreadsheets(SpreadsheetReport):
+    """
+    A contact spreadsheet for each class's class parent, written to one
+    file per class.
+    """
+    name = "class-parents"
+    title = "Class parent contact spreadsheets"
+    filename = "contact-info-%s.csv"
+    single_file = False
+    header = ["Child", "Parent1", "Email1", "Cell1", "Phone1",
+            "Parent2", "Email2", "Cell2", "Phone2",
+            ""]
+
+    def outputs(self, year):
+        for (cls, roster) in self.classes():
+            if cls.grade.startswith('Pre'):
+                class_label = cls.grade + '-' + cls.teacher.lastname[0]
+            else:
+                class_label = cls.grade
+            outfile = self.filename % class_label
+            outfile = outfile.replace("Pre-K", "PreK")
+            outfile = outfile.replace(" ", "")
+
+            fp = StringIO()
+            wtr = csv.writer(fp)
+            wtr.writerow(self.header)
+            for row in self.rows(roster):
+                wtr.writerow(row)
+            yield (outfile, fp.getvalue())
+
+    def rows(self, roster):
+        for student in roster:
+            family = student.family
+            if family.private:
+                yield [student.name(),
+                       family.guardian_name(0), "", "", "",
+                       family.guardian_name(1), "", "", "",
+                       "" ]
+            else:
+                yield [student.name(),
+                       family.guardian_name(0),
+                       family.guardian_email(0),
+                       family.guardian_cellphone(0),
+                       family.guardian_homephone(0),
+                       family.guardian_name(1),
+                       family.guardian_email(1),
+                       family.guardian_cellphone(1),
+                       family.guardian_homephone(1),
+                       "" ]
+
+@register
+class MailMergeSpreadsheet(SpreadsheetReport):
+    name = "mail-merge"
+    title = "Mail merge spreadsheet"
+    filename = "vertical-response-{year}.csv"
+    header = ["Email", "Relation", "Family", "Parents", "Children", "Grades",
+            "Student1", "Student2", "Student3",
+            "Address",
+            "Relation1", "Email1", "Cell1", "Phone1",
+            "Relation2", "Email2", "Cell2", "Phone2",
+            ""]
+
+    def rows(self):
+        for family in self.families():
+            for g in family.guardians_ladies_first():
+                if g.email:
+                    yield ([g.email, g.relation] + family_row(family) +
+                            [family.oneline_address()] +
+                            guardian_columns(family))
+
+#######################################################################
+# Reading the directory from the database
+#######################################################################
+
+def text(value):
+    """
+    Return a database value as a UTF-8 string, like the values read
+    from the spreadsheets.
+    """
+    if value is None:
+        return ""
+    return value.encode("utf-8")
+
+def staff_member(adult, role):
+    return Staff(text(adult.firstname), text(adult.lastname), role,
+            text(adult.email), text(adult.homephone), text(adult.cellphone))
+
+def database_directory(chunk_size=100):
+    """
+    Build a Directory from the contacts database.  Families are read
+    one keyset page at a time, each page with its guardians and students
+    prefetched, so the number of queries grows with the number of pages
+    rather than the number of families.
+    """
+    # Imported here so the module can be used without Django
+    from .models import Family as FamilyModel, OLSClass as OLSClassModel
+    from .pagination import keyset_chunks
+
+    classes = {}
+    classnames = []
+    class_roster = {}
+    by_id = {}
+    olsclasses = OLSClassModel.objects.with_staff().order_by('rank', 'title')
+    for olsclass_obj in olsclasses:
+        # The spreadsheet's class keys aren't stored; this one sorts the
+        # same way under class_sortkey()
+        key = "%s %s" % (text(olsclass_obj.rank), text(olsclass_obj.title))
+        olsclass = OLSClass(key, text(olsclass_obj.title),
+                grade=text(olsclass_obj.grade),
+                level=text(olsclass_obj.gradelevel),
+                rank=text(olsclass_obj.rank))
+        for (adult, role) in ((olsclass_obj.teacher, "Teacher"),
+                (olsclass_obj.aide, "Aide"),
+                (olsclass_obj.classmom, "Classmom")):
+            if adult is not None:
+                olsclass.add_staff(staff_member(adult, role))
+        classes[key] = olsclass
+        classnames.append(key)
+        class_roster[key] = []
+        by_id[olsclass_obj.id] = key
+
+    families = []
+    students = []
+    queryset = FamilyModel.objects.select_related('address').prefetch_related(
+            'guardian_set__person', 'student_set')
+    for chunk in keyset_chunks(queryset, chunk_size):
+        for family_obj in chunk:
+            address = family_obj.address
+            if address is None:
+                family = Family(family_obj.private, "", "", "", "")
+            else:
+                family = Family(family_obj.private, text(address.street),
+                        text(address.city), text(address.state),
+                        text(address.zipcode))
+            if family_obj.email:
+                family.email = text(family_obj.email)
+            guardian_objs = sorted(family_obj.guardian_set.all(),
+                    key=lambda g: g.id)
+            for guardian_obj in guardian_objs:
+                person = guardian_obj.person
+                guardian = Guardian(text(person.firstname),
+                        text(person.lastname), text(guardian_obj.relation),
+                        text(person.email), text(person.homephone),
+                        text(person.cellphone))
+                guardian.family = family
+                family.guardians.append(guardian)
+            for student_obj in sorted(family_obj.student_set.all(),
+                    key=lambda s: s.id):
+                key = by_id[student_obj.olsclass_id]
+                student = Student(text(student_obj.firstname),
+                        text(student_obj.lastname), classes[key])
+                student.family = family
+                family.children.append(student)
+                students.append(student)
+                class_roster[key].append(student)
+            families.append(family)
+
+    return Directory(families, students, classes, classnames, class_roster)
@@ -0,0 +1,149 @@
+"""
+Full-text search over the directory, using an SQLite FTS5 table.
+
+The index holds one document per family (student and guardian names,
+emails, phone numbers, street, city and the titles of the children's
+classes) and one per class (title and staff names).  It is kept up to
+date by the handlers in contacts.signals and can be rebuilt with the
+rebuild_search_index command.
+"""
+import re
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+
+from .models import Adult, Family, OLSClass, normalize_phone
+
+TABLE = "contacts_search"
+FAMILY = "family"
+CLASS = "class"
+
+# Column weights for bm25(): kind, object_id, title, body
+WEIGHTS = "0.0, 0.0, 10.0, 1.0"
+
+def search_available():
+    return connection.vendor == 'sqlite'
+
+def family_document(family):
+    title = family.parent_names() or family.name
+    words = []
+    for student in family.student_set.all():
+        words.extend([student.name(), student.olsclass.title])
+    for guardian in family.guardian_set.all():
+        adult = guardian.person
+        words.extend([adult.name(), adult.email or ""])
+        for phone in (adult.homephone, adult.cellphone):
+            if phone:
+                words.extend([phone, normalize_phone(phone)])
+    if family.email:
+        words.append(family.email)
+    if family.address is not None:
+        words.extend([family.address.street, family.address.city])
+    return (FAMILY, family.id, title, " ".join(words))
+
+def class_document(olsclass):
+    words = [olsclass.grade, olsclass.teacher_name(), olsclass.aide_name(),
+            olsclass.classmom_name()]
+    return (CLASS, olsclass.id, olsclass.title, " ".join(words))
+
+def _replace(kind, ids, documents):
+    cursor = connection.cursor()
+    if ids is None:
+        cursor.execute("DELETE FROM %s WHERE kind = %%s" % TABLE, [kind])
+    else:
+        for object_id in ids:
+            cursor.execute("DELETE FROM %s WHERE kind = %%s AND object_id = %%s"
+                    % TABLE, [kind, object_id])
+    cursor.executemany("INSERT INTO %s (kind, object_id, title, body) "
+            "VALUES (%%s, %%s, %%s, %%s)" % TABLE, documents)
+
+def index_families(family_ids):
+    """
+    Reindex the given families, dropping any that no longer exist.
+    """
+    family_ids = set(family_ids)
+    if not family_ids or not search_available():
+        return
+    families = Family.objects.directory().filter(id__in=family_ids)
+    _replace(FAMILY, family_ids, [family_document(f) for f in families])
+
+def index_classes(class_ids):
+    """
+    Reindex the given classes, dropping any that no longer exist.
+    """
+    class_ids = set(class_ids)
+    if not class_ids or not search_available():
+        return
+    classes = OLSClass.objects.with_staff().filter(id__in=class_ids)
+    _replace(CLASS, class_ids, [class_document(c) for c in classes])
+
+def rebuild_index(families=None, classes=None):
+    """
+    Reindex every family and class.  The families and classes may be
+    passed in, fetched with Family.objects.directory() and
+    OLSClass.objects.with_staff().  Returns the number of documents.
+    """
+    if not search_available():
+        return 0
+    if families is None:
+        families = Family.objects.directory()
+    if classes is None:
+        classes = OLSClass.objects.with_staff()
+    families = [family_document(f) for f in families]
+    classes = [class_document(c) for c in classes]
+    _replace(FAMILY, None, families)
+    _replace(CLASS, None, classes)
+    return len(families) + len(classes)
+
+def affected_classes(instance):
+    """
+    Return the ids of the classes whose documents include the given row.
+    """
+    if isinstance(instance, OLSClass):
+        return [instance.pk]
+    elif isinstance(instance, Adult):
+        return OLSClass.objects.filter(Q(teacher=instance) |
+                Q(aide=instance) | Q(classmom=instance)).values_list(
+                        'id', flat=True)
+    return []
+
+class SearchResult(object):
+    def __init__(self, kind, object_id, title, snippet):
+        self.kind = kind
+        self.object_id = int(object_id)
+        self.title = title
+        self.snippet = snippet
+
+    def url(self):
+        if self.kind == FAMILY:
+            return reverse('contacts:family_detail', args=[self.object_id])
+        else:
+            return "%s#class-%d" % (reverse('contacts:class_index'),
+                    self.object_id)
+
+def match_expression(query):
+    """
+    Turn free text into an FTS5 query matching every word as a prefix.
+    """
+    words = re.findall(r"\w+", query, re.UNICODE)
+    return " ".join('"%s"*' % word for word in words)
+
+def highlight(snippet):
+    return escape(snippet).replace("\x02", "<b>").replace("\x03", "</b>")
+
+def search(query, limit=200):
+    """
+    Return up to `limit` SearchResults for the query, best first.
+    """
+    expression = match_expression(query)
+    if not expression or not search_available():
+        return []
+    cursor = connection.cursor()
+    cursor.execute("SELECT kind, object_id, title, "
+            "snippet(%s, 3, char(2), char(3), '...', 12) FROM %s "
+            "WHERE %s MATCH %%s ORDER BY bm25(%s, %s) LIMIT %%s"
+            % (TABLE, TABLE, TABLE, TABLE, WEIGHTS), [expression, limit])
+    return [SearchResult(kind, object_id, title, highlight(snippet))
+            for (kind, object_id, title, snippet) in cursor.fetchall()]
@@ -0,0 +1,138 @@
+"""
+Signal handlers that keep the data derived from the directory tables
+(the pre-rendered family cards, the search index and the directory
+generation) in step with the tables themselves.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import Signal
+
+from .models import Student, Adult, Guardian, Family, Address, OLSClass
+from .models import FamilyCard, DirectoryVersion
+from . import search
+
+directory_models = (Student, Adult, Guardian, Family, Address, OLSClass)
+
+# Sent after the directory generation has been bumped.
+directory_changed = Signal()
+
+_state = threading.local()
+
+def updates_suspended():
+    return getattr(_state, 'suspended', False)
+
+@contextmanager
+def bulk_update():
+    """
+    Suspend the per-row maintenance of derived data while a large
+    number of rows are written (e.g. by the spreadsheet import), then
+    rebuild everything once at the end.
+    """
+    if updates_suspended():
+        yield
+        return
+    _state.suspended = True
+    try:
+        yield
+    finally:
+        _state.suspended = False
+    rebuild_derived_data()
+
+@contextmanager
+def deferred_update():
+    """
+    Like bulk_update(), but note which families and classes are touched
+    by the writes and refresh only those at the end.
+    """
+    if updates_suspended():
+        yield
+        return
+    _state.suspended = True
+    _state.pending = (set(), set())
+    try:
+        yield
+    finally:
+        family_ids, class_ids = _state.pending
+        _state.suspended = False
+        _state.pending = None
+    if family_ids or class_ids:
+        refresh_derived_data(family_ids, class_ids)
+
+def rebuild_derived_data():
+    families = list(Family.objects.directory())
+    FamilyCard.objects.rebuild(families)
+    search.rebuild_index(families)
+    bump_generation()
+
+def refresh_derived_data(family_ids, class_ids):
+    family_ids = set(family_ids)
+    FamilyCard.objects.refresh(family_ids)
+    search.index_families(family_ids)
+    search.index_classes(class_ids)
+    bump_generation()
+
+def bump_generation():
+    DirectoryVersion.objects.bump()
+    directory_changed.send(sender=DirectoryVersion)
+
+def affected_families(instance):
+    """
+    Return the ids of the families whose cards show data from the
+    given row.
+    """
+    if isinstance(instance, Family):
+        return [instance.pk]
+    elif isinstance(instance, (Guardian, Student)):
+        # A person moved to another family leaves that family's card too
+        previous = getattr(instance, '_previous_family_id', None)
+        if previous is not None and previous != instance.family_id:
+            return [instance.family_id, previous]
+        return [instance.family_id]
+    elif isinstance(instance, Adult):
+        return Guardian.objects.filter(person=instance).values_list(
+                'family_id', flat=True)
+    elif isinstance(instance, Address):
+        return Family.objects.filter(address=instance).values_list(
+                'id', flat=True)
+    elif isinstance(instance, OLSClass):
+        return Student.objects.filter(olsclass=instance).values_list(
+                'family_id', flat=True).distinct()
+    return []
+
+def remember_family(sender, instance, **kwargs):
+    """
+    Note the family a student or guardian belonged to before they are
+    saved, for affected_families().
+    """
+    if kwargs.get('raw') or instance.pk is None:
+        return
+    if updates_suspended() and getattr(_state, 'pending', None) is None:
+        return  # everything is rebuilt at the end
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'family' not in update_fields:
+        return
+    instance._previous_family_id = sender.objects.filter(
+            pk=instance.pk).values_list('family_id', flat=True).first()
+
+def update_derived_data(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        pending[0].update(affected_families(instance))
+        pending[1].update(search.affected_classes(instance))
+    elif not updates_suspended():
+        refresh_derived_data(affected_families(instance),
+                search.affected_classes(instance))
+
+for model in (Student, Guardian):
+    pre_save.connect(remember_family, sender=model,
+            dispatch_uid='remember_family_%s' % model.__name__)
+
+for model in directory_models:
+    post_save.connect(update_derived_data, sender=model,
+            dispatch_uid='update_derived_data_save_%s' % model.__name__)
+    post_delete.connect(update_derived_data, sender=model,
+            dispatch_uid='update_derived_data_delete_%s' % model.__name__)
@@ -1,3 +1,1352 @@
-from django.test import TestCase
+import csv
+import importlib
+import json
+import os
+import pstats
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from StringIO import StringIO
+from contextlib import contextmanager
 
-# Create your tests here.
+from django.apps import apps
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection, connections, transaction
+from django.db.backends.utils import CursorWrapper
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext, captured_stdout
+
+from .models import Student, Adult, Guardian, Family, Address, OLSClass
+from .models import FamilyCard, DirectoryVersion
+from .models import normalize_phone, normalize_email
+from .cache import cache_stats
+from .pagination import keyset_page
+from . import loader, metrics, pragmas, reports, search, typeahead
+from .signals import bulk_update, deferred_update
+
+def make_class(title="First Grade", rank="05"):
+    teacher = Adult.objects.create(firstname="Ann", lastname="Teacher")
+    return OLSClass.objects.create(title=title, grade=title,
+            gradelevel="1", rank=rank, teacher=teacher)
+
+def make_family(lastname, olsclass, nchildren=2):
+    address = Address.objects.create(street="1 Main St", city="Lowell",
+            state="MA", zipcode="01850")
+    family = Family.objects.create(name=lastname, address=address,
+            private=False)
+    for firstname, relation in (("Jane", Guardian.MOTHER),
+                                ("John", Guardian.FATHER)):
+        adult = Adult.objects.create(firstname=firstname, lastname=lastname,
+                email="%s@example.com" % firstname.lower(),
+                homephone="555-1234", cellphone="555-9876")
+        Guardian.objects.create(person=adult, relation=relation,
+                family=family)
+    for idx in range(nchildren):
+        Student.objects.create(firstname="Kid%d" % idx, lastname=lastname,
+                olsclass=olsclass, family=family)
+    return family
+
+class DirectoryTestCase(TestCase):
+    def setUp(self):
+        # Generations restart with each test, so cached pages must not
+        # outlive it.
+        caches['default'].clear()
+
+class FamilyIndexTests(DirectoryTestCase):
+    def setUp(self):
+        super(FamilyIndexTests, self).setUp()
+        self.olsclass = make_class()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_flat(self):
+        url = reverse('contacts:family_index')
+        for idx in range(3):
+            make_family("Smith%d" % idx, self.olsclass)
+        few = self.count_queries(url)
+        for idx in range(30):
+            make_family("Jones%d" % idx, self.olsclass)
+        many = self.count_queries(url)
+        self.assertEqual(few, many)
+        self.assertEqual(many, 2)
+
+    def test_family_entry(self):
+        make_family("Smith", self.olsclass, nchildren=1)
+        response = self.client.get(reverse('contacts:family_index'))
+        (family,) = response.context['families']
+        self.assertEqual(family['parents'], "Jane & John Smith")
+        self.assertEqual(family['address'], ["1 Main St", "Lowell, MA 01850"])
+        self.assertEqual([s['firstname'] for s in family['students']],
+                ["Kid0"])
+        self.assertEqual(family['phone_numbers'][0],
+                {'label': "Mom home", 'value': "555-1234"})
+
+class FamilyCardTests(TestCase):
+    def setUp(self):
+        self.olsclass = make_class()
+        self.family = make_family("Smith", self.olsclass, nchildren=1)
+
+    def card(self):
+        return FamilyCard.objects.get(family=self.family).directory_info()
+
+    def test_card_matches_family(self):
+        family = Family.objects.directory().get(pk=self.family.pk)
+        self.assertEqual(self.card(), family.directory_info())
+
+    def test_migration_fills_cards(self):
+        migration = importlib.import_module(
+                'contacts.migrations.0014_familycard')
+        make_family("Jones", self.olsclass)
+        cards = list(FamilyCard.objects.values())
+        FamilyCard.objects.all().delete()
+        with CaptureQueriesContext(connection) as ctx:
+            migration.fill_family_cards(apps, None)
+        self.assertEqual(list(FamilyCard.objects.values()), cards)
+        # Columns added by later migrations aren't read
+        for query in ctx.captured_queries:
+            self.assertNotIn("_digits", query['sql'])
+
+    def test_adult_change_updates_card(self):
+        adult = self.family.guardian_set.get(relation=Guardian.MOTHER).person
+        adult.firstname = "Janet"
+        adult.save()
+        self.assertEqual(self.card()['parents'], "Janet & John Smith")
+
+    def test_class_change_updates_card(self):
+        self.olsclass.grade = "Second Grade"
+        self.olsclass.save()
+        self.assertEqual(self.card()['students'][0]['grade'], "Second Grade")
+
+    def test_student_move_updates_both_cards(self):
+        other = make_family("Jones", self.olsclass, nchildren=1)
+        student = self.family.student_set.get()
+        student.family = other
+        student.save()
+        self.assertEqual(self.card()['students'], [])
+        card = FamilyCard.objects.get(family=other).directory_info()
+        self.assertEqual(sorted(s['firstname'] + " " + s['lastname']
+            for s in card['students']), ["Kid0 Jones", "Kid0 Smith"])
+        if search.search_available():
+            hits = search.search("Kid0 Smith")
+            self.assertEqual([r.object_id for r in hits
+                if r.kind == search.FAMILY], [other.id])
+
+    def test_student_delete_updates_card(self):
+        self.family.student_set.all().delete()
+        self.assertEqual(self.card()['students'], [])
+
+    def test_family_delete_removes_card(self):
+        self.family.delete()
+        self.assertFalse(FamilyCard.objects.exists())
+
+    def test_bulk_update_rebuilds_once(self):
+        with bulk_update():
+            make_family("Jones", self.olsclass)
+            self.assertEqual(FamilyCard.objects.count(), 1)
+        self.assertEqual(FamilyCard.objects.count(), 2)
+
+    def test_deferred_update_refreshes_touched_families(self):
+        other = make_family("Jones", self.olsclass)
+        generation = DirectoryVersion.objects.current()
+        with deferred_update():
+            adult = other.guardian_set.get(relation=Guardian.FATHER).person
+            adult.firstname = "Jack"
+            adult.save()
+            self.assertEqual(FamilyCard.objects.get(family=other).parents,
+                    "Jane & John Jones")
+        self.assertEqual(FamilyCard.objects.get(family=other).parents,
+                "Jack & Jane Jones")
+        self.assertEqual(DirectoryVersion.objects.current(), generation + 1)
+
+    def test_rebuild_command(self):
+        FamilyCard.objects.all().delete()
+        call_command('rebuild_family_cards', stdout=StringIO())
+        self.assertEqual(FamilyCard.objects.count(), 1)
+
+class PageCacheTests(DirectoryTestCase):
+    def setUp(self):
+        super(PageCacheTests, self).setUp()
+        self.olsclass = make_class()
+        self.family = make_family("Smith", self.olsclass)
+        self.url = reverse('contacts:family_index')
+
+    def test_hit_costs_one_query(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(1):
+            second = self.client.get(self.url)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(cache_stats()['hits'], 1)
+        self.assertEqual(cache_stats()['misses'], 1)
+
+    def test_change_invalidates(self):
+        self.client.get(self.url)
+        generation = DirectoryVersion.objects.current()
+        Student.objects.create(firstname="Newkid", lastname="Smith",
+                olsclass=self.olsclass, family=self.family)
+        self.assertGreater(DirectoryVersion.objects.current(), generation)
+        response = self.client.get(self.url)
+        self.assertIn("Newkid", response.content)
+        self.assertEqual(cache_stats()['misses'], 2)
+
+    def test_stats_view(self):
+        self.client.get(self.url)
+        response = self.client.get(reverse('contacts:page_cache_stats'))
+        self.assertEqual(json.loads(response.content)['misses'], 1)
+
+class PaginationTests(DirectoryTestCase):
+    def setUp(self):
+        super(PaginationTests, self).setUp()
+        olsclass = make_class()
+        with bulk_update():
+            for name in ("Adams", "Brown", "Brown", "Brown", "Clark", "Davis"):
+                make_family(name, olsclass, nchildren=1)
+
+    def walk(self, limit):
+        url = reverse('contacts:api_families')
+        ids, after, pages = [], None, 0
+        while True:
+            params = {'limit': limit}
+            if after:
+                params['after'] = after
+            data = json.loads(self.client.get(url, params).content)
+            ids.extend(f['id'] for f in data['families'])
+            pages += 1
+            after = data['next']
+            if after is None:
+                return ids, pages
+
+    def test_walk_covers_every_family_once(self):
+        expected = list(Family.objects.order_by('name', 'id').values_list(
+            'id', flat=True))
+        for limit in (1, 2, 4, 6, 10):
+            ids, pages = self.walk(limit)
+            self.assertEqual(ids, expected)
+
+    def test_ties_are_ordered_by_the_cursor_key(self):
+        # Cards with the same name, whose families sort the other way
+        browns = list(Family.objects.filter(name="Brown").order_by('-id'))
+        for (idx, family) in enumerate(browns):
+            Family.objects.filter(pk=family.pk).update(name="Brown%d" % idx)
+        expected = list(FamilyCard.objects.order_by('name', 'family_id')
+                .values_list('family_id', flat=True))
+        for limit in (1, 2, 4):
+            ids, pages = self.walk(limit)
+            self.assertEqual(ids, expected)
+
+    def test_page_query_count_is_independent_of_position(self):
+        after = keyset_page(FamilyCard.objects.all(), None, 4).next_cursor
+        with self.assertNumQueries(1):
+            page = keyset_page(FamilyCard.objects.all(), after, 4)
+        self.assertEqual([c.name for c in page.items], ["Clark", "Davis"])
+        self.assertFalse(page.has_next())
+
+    def test_html_page(self):
+        response = self.client.get(reverse('contacts:family_index'),
+                {'limit': 2})
+        self.assertEqual(len(response.context['families']), 2)
+        self.assertContains(response, 'id="more-families"')
+
+    def test_bad_cursor(self):
+        response = self.client.get(reverse('contacts:family_index'),
+                {'after': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+class FamilyPrintTests(TestCase):
+    def test_streams_every_family(self):
+        olsclass = make_class()
+        with bulk_update():
+            for idx in range(250):
+                make_family("Family%03d" % idx, olsclass, nchildren=1)
+        response = self.client.get(reverse('contacts:family_print'))
+        self.assertTrue(response.streaming)
+        chunks = list(response.streaming_content)
+        self.assertIn("<html", chunks[0])
+        self.assertNotIn("family-", chunks[0])
+        content = "".join(chunks)
+        self.assertEqual(content.count('class="family whitebkg"'), 250)
+        self.assertLess(content.index("Family000"), content.index("Family249"))
+        self.assertIn("</html>", chunks[-1])
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.olsclass = make_class()
+        self.family = make_family("Smith", self.olsclass, nchildren=1)
+
+    def found(self, query):
+        return [(r.kind, r.object_id) for r in search.search(query)]
+
+    def test_migration_fills_index(self):
+        migration = importlib.import_module(
+                'contacts.migrations.0017_search_index')
+        make_family("Jones", self.olsclass)
+        cursor = connection.cursor()
+        cursor.execute("SELECT * FROM %s ORDER BY kind, object_id"
+                % search.TABLE)
+        documents = cursor.fetchall()
+        cursor.execute("DELETE FROM %s" % search.TABLE)
+        with CaptureQueriesContext(connection) as ctx:
+            migration.fill_search_index(apps, connection.schema_editor())
+        cursor.execute("SELECT * FROM %s ORDER BY kind, object_id"
+                % search.TABLE)
+        self.assertEqual(cursor.fetchall(), documents)
+        self.assertEqual(len(documents), 3)
+        # Columns added by later migrations aren't read
+        for query in ctx.captured_queries:
+            self.assertNotIn("_digits", query['sql'])
+
+    def test_finds_family(self):
+        family = (search.FAMILY, self.family.id)
+        self.assertEqual(self.found("kid0"), [family])
+        self.assertEqual(self.found("jane smi"), [family])
+        self.assertEqual(self.found("jane@example.com"), [family])
+        self.assertEqual(self.found("5551234"), [family])
+        self.assertEqual(self.found("Lowell"), [family])
+        self.assertEqual(self.found("nobody"), [])
+
+    def test_finds_class(self):
+        self.assertIn((search.CLASS, self.olsclass.id), self.found("teacher"))
+
+    def test_index_follows_changes(self):
+        adult = self.family.guardian_set.get(relation=Guardian.MOTHER).person
+        adult.firstname = "Janet"
+        adult.save()
+        self.assertEqual(self.found("janet"), [(search.FAMILY, self.family.id)])
+        self.family.delete()
+        self.assertEqual(self.found("janet"), [])
+
+    def test_rebuild_command(self):
+        with bulk_update():
+            make_family("Jones", self.olsclass)
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.found("kid0")), 2)
+
+    def test_view(self):
+        response = self.client.get(reverse('contacts:search'), {'q': "kid0"})
+        url = reverse('contacts:family_detail', args=[self.family.id])
+        self.assertContains(response, 'href="%s"' % url)
+        self.assertContains(response, "<b>Kid0</b>")
+        make_family("Jones", self.olsclass)
+        response = self.client.get(url)
+        self.assertEqual([f['id'] for f in response.context['families']],
+                [self.family.id])
+        self.assertNotContains(response, "Jones")
+        response = self.client.get(reverse('contacts:family_detail',
+            args=[self.family.id + 100]))
+        self.assertEqual(response.status_code, 404)
+
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        typeahead.invalidate()
+        self.index = typeahead.NameIndex([
+            typeahead.Person('student', 1, "Maria Garcia-Lopez", 1),
+            typeahead.Person('adult', 2, "Jane Smith", 2),
+            typeahead.Person('adult', 3, "John Smithers", 2),
+            typeahead.Person('student', 4, "Sam Jones", 3),
+            ])
+
+    def ids(self, query):
+        return [p.id for p in self.index.lookup(query)]
+
+    def test_prefix(self):
+        self.assertEqual(self.ids("smi"), [2, 3])
+        self.assertEqual(self.ids("jo smi"), [3])
+        self.assertEqual(self.ids(""), [])
+
+    def test_hyphenated(self):
+        self.assertEqual(self.ids("lopez"), [1])
+        self.assertEqual(self.ids("garcia-l"), [1])
+        self.assertEqual(self.ids("garcialopez"), [1])
+
+    def test_typos(self):
+        self.assertEqual(self.ids("smoth")[0], 2)
+        self.assertEqual(self.ids("jonse sa"), [4])
+
+    def test_view_answers_from_memory(self):
+        olsclass = make_class()
+        family = make_family("Smith", olsclass)
+        url = reverse('contacts:autocomplete')
+        self.client.get(url, {'q': "x"})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'q': "jane sm"})
+        (person,) = json.loads(response.content)['results']
+        self.assertEqual(person['name'], "Jane Smith")
+        self.assertEqual(person['family'], family.id)
+
+    def test_view_limit_is_at_least_one(self):
+        make_family("Smith", make_class())
+        response = self.client.get(reverse('contacts:autocomplete'),
+                {'q': "smith", 'limit': -5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)['results']), 1)
+
+    def test_change_invalidates(self):
+        olsclass = make_class()
+        family = make_family("Smith", olsclass)
+        self.assertEqual(typeahead.lookup("newkid"), [])
+        Student.objects.create(firstname="Newkid", lastname="Smith",
+                olsclass=olsclass, family=family)
+        self.assertEqual(len(typeahead.lookup("newkid")), 1)
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.olsclass = make_class()
+        self.family = make_family("Smith", self.olsclass)
+
+    def get_json(self, name):
+        response = self.client.get(reverse('contacts:api_' + name))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)[name]
+
+    def test_shapes(self):
+        (family,) = self.get_json('families')
+        self.assertEqual(family['parents'], "Jane & John Smith")
+        self.assertEqual(family['id'], self.family.id)
+        (olsclass,) = self.get_json('classes')
+        self.assertEqual(olsclass['teacher'], "Ann Teacher")
+        self.assertEqual(olsclass['students'], ["Kid0 Smith", "Kid1 Smith"])
+        self.assertEqual(len(self.get_json('students')), 2)
+        self.assertEqual(len(self.get_json('adults')), 3)
+
+    def test_students_and_adults_are_paged(self):
+        family = make_family("Jones", self.olsclass)
+        # Added last, but first by name among the Joneses
+        Student.objects.create(firstname="Abe", lastname="Jones",
+                olsclass=self.olsclass, family=family)
+        Adult.objects.create(firstname="Abby", lastname="Jones")
+        for (name, total) in (('students', 5), ('adults', 6)):
+            url = reverse('contacts:api_' + name)
+            seen = []
+            params = {'limit': 2}
+            while True:
+                data = json.loads(self.client.get(url, params).content)
+                self.assertLessEqual(len(data[name]), 2)
+                seen.extend((item['lastname'], item['firstname'], item['id'])
+                        for item in data[name])
+                if data['next'] is None:
+                    break
+                params['after'] = data['next']
+            self.assertEqual(len(set(seen)), total)
+            self.assertEqual(seen, sorted(seen))
+
+    def test_not_modified(self):
+        url = reverse('contacts:api_families')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, "")
+
+    def test_etag_changes_with_data(self):
+        url = reverse('contacts:api_students')
+        etag = self.client.get(url)['ETag']
+        Student.objects.create(firstname="Newkid", lastname="Smith",
+                olsclass=self.olsclass, family=self.family)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+class ReverseLookupTests(TestCase):
+    def setUp(self):
+        self.olsclass = make_class()
+        self.family = make_family("Smith", self.olsclass)
+        self.mother = self.family.guardian_set.get(
+                relation=Guardian.MOTHER).person
+        self.mother.cellphone = "+1 (978) 555-0101"
+        self.mother.email = " Jane.Smith@Example.COM"
+        self.mother.save()
+
+    def lookup(self, **params):
+        response = self.client.get(reverse('contacts:api_lookup'), params)
+        return json.loads(response.content)['matches']
+
+    def test_normalize(self):
+        self.assertEqual(normalize_phone("1-978-555-0101"), "9785550101")
+        self.assertEqual(normalize_phone("555.1234"), "5551234")
+        self.assertEqual(normalize_phone(None), "")
+        self.assertEqual(normalize_email(" A@B.com "), "a@b.com")
+
+    def test_save_fills_keys(self):
+        self.assertEqual(self.mother.cellphone_digits, "9785550101")
+        self.assertEqual(self.mother.email_key, "jane.smith@example.com")
+
+    def test_lookup_phone(self):
+        (match,) = self.lookup(phone="978.555.0101")
+        self.assertEqual(match['id'], self.mother.id)
+        self.assertEqual(match['relation'], Guardian.MOTHER)
+        self.assertEqual(match['family']['id'], self.family.id)
+        self.assertEqual([c['name'] for c in match['children']],
+                ["Kid0 Smith", "Kid1 Smith"])
+
+    def test_lookup_email(self):
+        (match,) = self.lookup(email="JANE.SMITH@example.com")
+        self.assertEqual(match['name'], "Jane Smith")
+
+    def test_lookup_staff(self):
+        teacher = self.olsclass.teacher
+        teacher.homephone = "617-555-0199"
+        teacher.save()
+        (match,) = self.lookup(phone="6175550199")
+        self.assertEqual(match['relation'], None)
+        self.assertEqual(match['children'], [])
+
+    def test_lookup_query_count(self):
+        with self.assertNumQueries(3):
+            self.lookup(phone="9785550101")
+
+class StudentIndexTests(TestCase):
+    def setUp(self):
+        with bulk_update():
+            for rank, title in (("05", "First Grade"), ("04", "Kindergarten")):
+                olsclass = make_class(title, rank)
+                for name in ("Adams", "Baker", "Clark"):
+                    make_family(name + title[0], olsclass)
+
+    def data(self, **params):
+        defaults = {'sEcho': 3, 'iDisplayStart': 0, 'iDisplayLength': 5,
+                'iSortingCols': 1, 'iSortCol_0': 0, 'sSortDir_0': 'asc'}
+        defaults.update(params)
+        response = self.client.get(reverse('contacts:student_data'), defaults)
+        return json.loads(response.content)
+
+    def test_page(self):
+        with self.assertNumQueries(2):
+            data = self.data()
+        self.assertEqual(data['sEcho'], 3)
+        self.assertEqual(data['iTotalRecords'], 12)
+        self.assertEqual(data['iTotalDisplayRecords'], 12)
+        self.assertEqual(len(data['aaData']), 5)
+        self.assertEqual(data['aaData'][0], ["AdamsF", "Kid0", "First Grade",
+            "AdamsF"])
+        data = self.data(iDisplayStart=10)
+        self.assertEqual([row[0] for row in data['aaData']],
+                ["ClarkK", "ClarkK"])
+
+    def test_values_are_escaped(self):
+        Student.objects.filter(firstname="Kid0", lastname="AdamsF").update(
+                firstname="<img src=x onerror=alert(1)>")
+        row = self.data()['aaData'][0]
+        self.assertEqual(row[1], "&lt;img src=x onerror=alert(1)&gt;")
+
+    def test_sort_by_class_rank(self):
+        data = self.data(iSortCol_0=2, sSortDir_0='asc')
+        self.assertEqual(data['aaData'][0][2], "Kindergarten")
+        data = self.data(iSortCol_0=2, sSortDir_0='desc')
+        self.assertEqual(data['aaData'][0][2], "First Grade")
+
+    def test_search(self):
+        data = self.data(sSearch="kid1 kinder")
+        self.assertEqual(data['iTotalDisplayRecords'], 3)
+        self.assertEqual(set(row[1] for row in data['aaData']), set(["Kid1"]))
+
+    def test_page_view(self):
+        response = self.client.get(reverse('contacts:student_index'))
+        self.assertContains(response, reverse('contacts:student_data'))
+
+class AdultIndexTests(TestCase):
+    def setUp(self):
+        olsclass = make_class()
+        olsclass.aide = Adult.objects.create(firstname="Al", lastname="Aide")
+        self.family = make_family("Smith", olsclass)
+        olsclass.classmom = self.family.guardian_set.get(
+                relation=Guardian.MOTHER).person
+        olsclass.save()
+
+    def data(self, **params):
+        defaults = {'sEcho': 1, 'iDisplayStart': 0, 'iDisplayLength': 10,
+                'iSortingCols': 1, 'iSortCol_0': 0, 'sSortDir_0': 'asc'}
+        defaults.update(params)
+        response = self.client.get(reverse('contacts:adult_data'), defaults)
+        return json.loads(response.content)
+
+    def roles(self, **params):
+        return dict((row[1] + " " + row[0], row[2])
+                for row in self.data(**params)['aaData'])
+
+    def test_roles(self):
+        with self.assertNumQueries(2):
+            roles = self.roles()
+        self.assertEqual(roles, {
+            "Ann Teacher": "Teacher",
+            "Al Aide": "Aide",
+            "Jane Smith": "Class Mom, Mother",
+            "John Smith": "Father",
+            })
+
+    def test_filter_by_role(self):
+        self.assertEqual(self.roles(role="Father").keys(), ["John Smith"])
+        self.assertEqual(sorted(self.roles(role="staff")),
+                ["Al Aide", "Ann Teacher", "Jane Smith"])
+        self.assertEqual(sorted(self.roles(role="guardian")),
+                ["Jane Smith", "John Smith"])
+        self.assertEqual(self.roles(role="Class Mom").keys(), ["Jane Smith"])
+
+    def test_sort_by_role(self):
+        data = self.data(iSortCol_0=2, sSortDir_0='desc')
+        self.assertEqual(data['aaData'][0][2], "Teacher")
+
+    def test_page_view(self):
+        response = self.client.get(reverse('contacts:adult_index'))
+        self.assertContains(response, '<option value="Class Mom">')
+
+    def test_search_phone_and_email(self):
+        self.assertEqual(self.data(sSearch="5551234")['iTotalDisplayRecords'], 2)
+        self.assertEqual(self.roles(sSearch="jane@"), {
+            "Jane Smith": "Class Mom, Mother"})
+
+class ClassIndexTests(DirectoryTestCase):
+    def test_query_count_is_constant(self):
+        for idx in range(40):
+            olsclass = make_class("Class %02d" % idx, rank="%02d" % idx)
+            olsclass.aide = Adult.objects.create(firstname="Al",
+                    lastname="Aide%d" % idx)
+            olsclass.classmom = Adult.objects.create(firstname="Mo",
+                    lastname="Mom%d" % idx)
+            olsclass.save()
+        family = Family.objects.create(name="Big", private=False)
+        Student.objects.bulk_create([
+            Student(firstname="Kid%02d" % n, lastname="Big",
+                olsclass=olsclass, family=family)
+            for olsclass in OLSClass.objects.all() for n in range(30)])
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('contacts:class_index'))
+        classes = response.context['classes']
+        self.assertEqual(len(classes), 40)
+        self.assertEqual(classes[0]['grade'], "Class 39")
+        self.assertEqual(classes[0]['aide'], "Al Aide39")
+        self.assertEqual(len(classes[0]['students']), 30)
+        self.assertEqual(classes[0]['students'][0], "Kid00 Big")
+
+class ReportTests(DirectoryTestCase):
+    def setUp(self):
+        super(ReportTests, self).setUp()
+        self.olsclass = make_class()
+        make_family("Smith", self.olsclass)
+        make_family("Jones", self.olsclass, nchildren=1)
+
+    def test_report_from_database(self):
+        report = reports.reports['directory-by-family'](
+                reports.database_directory())
+        [(filename, contents)] = report.outputs("2016-17")
+        self.assertEqual(filename, "ols-family-directory-2016-17.txt")
+        self.assertEqual(contents.split("\n\n")[0].split("\n"), [
+            "Jones, Kid0 (First Grade)", "Jane & John Jones",
+            "1 Main St", "Lowell, MA 01850",
+            "555-1234", "555-9876 (Mom cell)", "555-9876 (Dad cell)",
+            "jane@example.com (Mom)", "john@example.com (Dad)"])
+
+    def test_class_renamed_in_admin(self):
+        olsclass = make_class(title="Enrichment - Room 12", rank="20")
+        make_family("Brown", olsclass, nchildren=1)
+        [renamed] = [cls for cls in
+                reports.database_directory().classes.values()
+                if cls.title == "Enrichment - Room 12"]
+        self.assertEqual((renamed.grade, renamed.gradelevel, renamed.rank),
+                ("Enrichment - Room 12", "1", "20"))
+        for name in reports.reports:
+            response = self.client.get(reverse('contacts:report_download',
+                args=[name]))
+            self.assertEqual(response.status_code, 200)
+
+    def test_query_count_is_flat(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                reports.database_directory(chunk_size=100)
+            return len(ctx.captured_queries)
+        before = count_queries()
+        for idx in range(5):
+            make_family("Family%d" % idx, self.olsclass)
+        self.assertEqual(count_queries(), before)
+
+    def test_download_is_cached(self):
+        url = reverse('contacts:report_download', args=["mail-merge"])
+        first = self.client.get(url)
+        self.assertEqual(first['Content-Disposition'],
+                'attachment; filename="vertical-response-2016-17.csv"')
+        self.assertEqual(len(first.content.splitlines()), 5)
+        with self.assertNumQueries(1):
+            second = self.client.get(url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Disposition'],
+                first['Content-Disposition'])
+
+    def test_multiple_files_download_as_zip(self):
+        response = self.client.get(reverse('contacts:report_download',
+            args=["class-parents"]))
+        self.assertEqual(response['Content-Type'], "application/zip")
+        archive = zipfile.ZipFile(StringIO(response.content))
+        self.assertEqual(archive.namelist(), ["contact-info-FirstGrade.csv"])
+
+    def test_index(self):
+        response = self.client.get(reverse('contacts:report_index'))
+        self.assertEqual(response.status_code, 200)
+        for report in reports.reports.values():
+            self.assertContains(response, '<a href="%s">%s</a>' % (
+                reverse('contacts:report_download', args=[report.name]),
+                report.title), html=True)
+
+    def test_unknown_report(self):
+        response = self.client.get(reverse('contacts:report_download',
+            args=["nonesuch"]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_command(self):
+        outdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outdir)
+        call_command('generate_reports', 'class-roster', year="2016-17",
+                output_dir=outdir, stdout=StringIO())
+        with open(os.path.join(outdir, "ols-classes-2016-17.txt")) as fp:
+            self.assertIn("First Grade - Ann Teacher", fp.read())
+
+class LoaderFamilyTests(TestCase):
+    def setUp(self):
+        self.family = loader.Family(False, "1 Main St", "Lowell", "MA",
+                "01850")
+        self.family.guardians = [
+            loader.Guardian("John", "Smith", "Father", "john@example.com",
+                "555-1234", "555-9876"),
+            loader.Guardian("Jane", "Smith", "Mother", "jane@example.com",
+                "555-1234", "555-5555")]
+
+    def test_views_follow_guardian_changes(self):
+        self.assertEqual(self.family.phone_numbers(), ["555-1234",
+            "555-5555 (Mom cell)", "555-9876 (Dad cell)"])
+        self.assertIs(self.family.guardians_ladies_first(),
+                self.family.guardians_ladies_first())
+        self.family.add_guardian(loader.Guardian("Ann", "Smith",
+            "Grandmother", "ann@example.com"))
+        self.assertEqual(self.family.emails(), ["jane@example.com (Mom)",
+            "ann@example.com (Grandmother)", "john@example.com (Dad)"])
+
+    def test_orderings_leave_members_alone(self):
+        olsclass = loader.OLSClass("1A", "First Grade - A")
+        older = loader.OLSClass("2A", "Second Grade - A")
+        self.family.children.append(loader.Student("Kim", "Smith", olsclass))
+        self.family.children.append(loader.Student("Lee", "Smith", older))
+        self.assertEqual([g.firstname for g in
+            self.family.guardians_ladies_first()], ["Jane", "John"])
+        self.assertEqual(self.family.children_names(), "Lee and Kim Smith")
+        self.assertEqual(self.family.parent_names(), "John & Jane Smith")
+        self.assertEqual(self.family.parent_names(ladies_first=True),
+                "Jane & John Smith")
+        self.assertEqual([c.firstname for c in self.family.children],
+                ["Kim", "Lee"])
+        self.assertEqual([g.firstname for g in self.family.guardians],
+                ["John", "Jane"])
+        self.assertEqual(self.family.sortkey(),
+                (("Smith", "Kim"), ("Smith", "Lee")))
+
+class MetricsTests(DirectoryTestCase):
+    def setUp(self):
+        super(MetricsTests, self).setUp()
+        metrics.registry.reset()
+        make_family("Smith", make_class())
+
+    def sample(self, text, name, view):
+        prefix = '%s{view="%s"} ' % (name, view)
+        for line in text.splitlines():
+            if line.startswith(prefix):
+                return float(line[len(prefix):])
+        self.fail("no %s in the metrics" % prefix)
+
+    def test_requests_are_counted_by_view(self):
+        url = reverse('contacts:family_index')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        # The captured queries are read from the log the next request clears
+        queries = len(ctx.captured_queries)
+        self.client.get(url)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith("text/plain"))
+        text = response.content
+        view = "contacts:family_index"
+        self.assertEqual(self.sample(text,
+            "directory_request_duration_seconds_count", view), 2)
+        self.assertIn('directory_request_duration_seconds_bucket'
+                '{view="%s",le="+Inf"} 2' % view, text)
+        # The second request was answered from the page cache
+        self.assertGreater(queries, 1)
+        self.assertEqual(self.sample(text, "directory_sql_queries_total",
+            view), queries + 1)
+        self.assertGreater(self.sample(text,
+            "directory_sql_duration_seconds_total", view), 0)
+
+    def test_unmatched_requests(self):
+        self.client.get("/no/such/page")
+        text = metrics.registry.render()
+        self.assertEqual(self.sample(text,
+            "directory_request_duration_seconds_count", metrics.UNMATCHED), 1)
+
+@contextmanager
+def recorded_statements():
+    """
+    Collect the (sql, params) of each query run in the block, ready to
+    be run again under EXPLAIN.
+    """
+    statements = []
+
+    class RecordingCursor(CursorWrapper):
+        def execute(self, sql, params=None):
+            statements.append((sql, params))
+            return self.cursor.execute(sql, params)
+
+    # Instrument the connection for metrics now, so the middleware
+    # doesn't wrap the recording cursors and then lose its wrapping
+    metrics.instrument(connection)
+    make_cursor = connection.make_cursor
+    connection.make_cursor = lambda cursor: RecordingCursor(
+            make_cursor(cursor), connection)
+    try:
+        yield statements
+    finally:
+        connection.make_cursor = make_cursor
+
+def query_plan(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+# A plan step reading a whole table without an index ("SCAN TABLE x" in
+# older SQLite versions)
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?\S+( AS \S+)?$")
+
+def sorts_whole_table(plan):
+    return (any(FULL_SCAN.match(step) for step in plan) and
+            "USE TEMP B-TREE FOR ORDER BY" in plan)
+
+class QueryPlanTests(DirectoryTestCase):
+    """
+    The lists behind the directory pages should be read in index order,
+    not by scanning a table and sorting it.
+    """
+    datatables = {'draw': 1, 'start': 0, 'length': 10}
+    pages = [
+        ('contacts:family_index', (), {}),
+        ('contacts:family_print', (), {}),
+        ('contacts:class_index', (), {}),
+        ('contacts:adult_data', (), datatables),
+        ('contacts:student_data', (), datatables),
+        ('contacts:api_families', (), {}),
+        ('contacts:api_classes', (), {}),
+        ('contacts:api_students', (), {}),
+        ('contacts:api_adults', (), {}),
+        ('contacts:report_download', ('family-spreadsheet',), {}),
+    ]
+
+    def setUp(self):
+        super(QueryPlanTests, self).setUp()
+        olsclass = make_class()
+        for idx in range(3):
+            make_family("Smith%d" % idx, olsclass)
+
+    def assertIndexed(self, sql, params, what):
+        plan = query_plan(sql, params)
+        self.assertFalse(sorts_whole_table(plan),
+                "%s sorts a whole table:\n%s\n%s" % (what, sql,
+                    "\n".join(plan)))
+
+    def test_pages(self):
+        for (name, args, params) in self.pages:
+            with recorded_statements() as statements:
+                response = self.client.get(reverse(name, args=args), params)
+                if response.streaming:
+                    "".join(response.streaming_content)
+            self.assertEqual(response.status_code, 200)
+            selects = [(sql, params) for (sql, params) in statements
+                    if sql.startswith("SELECT")]
+            self.assertTrue(selects)
+            for (sql, params) in selects:
+                self.assertIndexed(sql, params, name)
+
+    def test_default_orderings(self):
+        for model in (Student, Adult, Guardian, Family, Address, OLSClass,
+                FamilyCard):
+            (sql, params) = model.objects.all().query.sql_with_params()
+            self.assertIndexed(sql, params, model.__name__)
+
+    def test_students_by_class(self):
+        olsclass = OLSClass.objects.get()
+        (sql, params) = Student.objects.filter(
+                olsclass=olsclass).query.sql_with_params()
+        plan = query_plan(sql, params)
+        self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plan)
+
+def run_in_threads(funcs):
+    """
+    Call each function in a thread of its own, closing the thread's
+    database connection after, and re-raise the first exception.
+    """
+    errors = []
+    def run(func):
+        try:
+            func()
+        except Exception as err:
+            errors.append(err)
+        finally:
+            connection.close()
+    threads = [threading.Thread(target=run, args=(func,)) for func in funcs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+def import_families(prefix, count, importing=None, proceed=None):
+    """
+    Replace the directory with `count` families in one transaction, as
+    the spreadsheet import does.  If given, `importing` is set while the
+    transaction is open and its rows written, and `proceed` is waited
+    for before committing.
+    """
+    with transaction.atomic():
+        with bulk_update():
+            for model in (Student, Guardian, Family, Address, OLSClass,
+                    Adult):
+                model.objects.all().delete()
+            olsclass = make_class()
+            for idx in range(count):
+                make_family("%s%d" % (prefix, idx), olsclass)
+            if importing is not None:
+                importing.set()
+                proceed.wait(10)
+                importing.clear()
+
+class SQLiteTuningTests(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.database = dict(connection.settings_dict,
+                NAME=os.path.join(tmpdir, "directory.sqlite3"))
+
+    def test_pragmas(self):
+        database = connections['default'].__class__(self.database, 'tuning')
+        database.ensure_connection()
+        try:
+            cursor = database.connection.cursor()
+            def pragma(name):
+                return cursor.execute("PRAGMA " + name).fetchone()[0]
+            self.assertEqual(pragma("journal_mode"), "wal")
+            self.assertEqual(pragma("busy_timeout"), 5000)
+            self.assertEqual(pragma("synchronous"), 1)     # NORMAL
+            self.assertEqual(pragma("cache_size"), -16000)
+        finally:
+            database.close()
+
+    def test_setting_replaces_defaults(self):
+        self.assertEqual(pragmas.sqlite_pragmas()[0], ('journal_mode', 'wal'))
+        self.assertEqual(dict(pragmas.sqlite_pragmas()),
+                pragmas.DEFAULT_PRAGMAS)
+        with self.settings(DIRECTORY_SQLITE_PRAGMAS={'cache_size': -2000}):
+            self.assertEqual(pragmas.sqlite_pragmas(), [('cache_size', -2000)])
+        with self.settings(DIRECTORY_SQLITE_PRAGMAS={}):
+            self.assertEqual(pragmas.sqlite_pragmas(), [])
+
+    @override_settings(DIRECTORY_SQLITE_PRAGMAS={'journal_mode': "wal; --"})
+    def test_bad_pragma(self):
+        with self.assertRaises(ImproperlyConfigured):
+            pragmas.sqlite_pragmas()
+
+    @override_settings(DIRECTORY_PAGE_CACHE='pages', CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'pages': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_pages_are_served_during_an_import(self):
+        # The test database is in memory, where threads can't share it,
+        # so the threads here connect to a database file instead
+        saved = connections.databases['default']
+        connections.databases['default'] = self.database
+        self.addCleanup(connections.databases.__setitem__, 'default', saved)
+        run_in_threads([lambda: call_command('migrate', verbosity=0)])
+        run_in_threads([lambda: import_families("Old", 10)])
+
+        url = reverse('contacts:family_index')
+        importing = threading.Event()   # the import's rows are written
+        enough = threading.Event()      # pages were read meanwhile
+        done = threading.Event()
+        reads = []      # (during the import, status, saw the old data)
+        connection_counts = []
+
+        def importer():
+            try:
+                # A small page cache makes this import spill its rows to
+                # the database before committing, as a large one does
+                with connection.cursor() as cursor:
+                    cursor.execute("PRAGMA cache_size = 10")
+                import_families("New", 30, importing, enough)
+            finally:
+                enough.set()
+                done.set()
+
+        def reader():
+            client = Client()
+            used = set()
+            try:
+                while not done.is_set():
+                    during = importing.is_set()
+                    response = client.get(url)
+                    during = during and importing.is_set()
+                    used.add(id(connection.connection))
+                    reads.append((during, response.status_code,
+                        "Old0" in response.content))
+                    if sum(1 for read in reads if read[0]) >= 20:
+                        enough.set()
+            finally:
+                enough.set()
+                connection_counts.append(len(used))
+
+        run_in_threads([importer] + [reader] * 4)
+
+        self.assertTrue(all(status == 200 for (_, status, _) in reads))
+        during = [old for (during, _, old) in reads if during]
+        self.assertGreaterEqual(len(during), 20)
+        self.assertTrue(all(during))
+        # Each reader kept one connection for all its requests
+        self.assertEqual(connection_counts, [1] * 4)
+
+        def read_after():
+            content = Client().get(url).content
+            self.assertIn("New0", content)
+            self.assertNotIn("Old0", content)
+        run_in_threads([read_after])
+
+# The scripts aren't a package, so their tests import them from their
+# directory
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "scripts")
+
+def import_script(name):
+    if SCRIPTS not in sys.path:
+        sys.path.insert(0, SCRIPTS)
+    return __import__(name)
+
+def directory_rows():
+    """
+    Return the directory's rows by their natural keys, leaving out the
+    ids, so that two imports of the same data compare equal.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT kind, title, body FROM %s" % search.TABLE)
+    return {
+        'classes': sorted(OLSClass.objects.values_list('title', 'grade',
+            'gradelevel', 'rank', 'teacher__email', 'aide__lastname',
+            'classmom__email')),
+        'families': sorted(Family.objects.values_list('name', 'email',
+            'private', 'address__street', 'address__city',
+            'address__zipcode')),
+        'adults': sorted(Adult.objects.values_list('firstname', 'lastname',
+            'email', 'homephone', 'cellphone', 'homephone_digits',
+            'cellphone_digits', 'email_key')),
+        'guardians': sorted(Guardian.objects.values_list('family__name',
+            'person__lastname', 'person__firstname', 'relation')),
+        'students': sorted(Student.objects.values_list('family__name',
+            'lastname', 'firstname', 'olsclass__title')),
+        'cards': sorted(FamilyCard.objects.values_list('name', 'private',
+            'parents', 'address', 'phone_numbers', 'emails', 'students')),
+        'search': sorted(cursor.fetchall()),
+    }
+
+class LoadSpreadsheetTestCase(DirectoryTestCase):
+    """
+    Runs scripts/load_spreadsheet.py on a small synthetic directory.
+    """
+    nfamilies = 12
+
+    def setUp(self):
+        super(LoadSpreadsheetTestCase, self).setUp()
+        self.script = import_script("load_spreadsheet")
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.directory_file = os.path.join(self.tmpdir, "directory.csv")
+        self.class_file = os.path.join(self.tmpdir, "classes.csv")
+        import_script("synthetic_directory").write_directory(
+                self.directory_file, self.class_file,
+                nfamilies=self.nfamilies)
+
+    def load(self, *args):
+        """Run the script with the given options, returning its output."""
+        with captured_stdout() as output:
+            self.script.main(["--student-file", self.directory_file,
+                "--class-file", self.class_file] + list(args))
+        return output.getvalue()
+
+    def rewrite(self, filename, edit):
+        """Replace the rows of one of the spreadsheets with edit(rows)."""
+        with open(filename, "rb") as fp:
+            reader = csv.DictReader(fp)
+            (fieldnames, rows) = (reader.fieldnames, list(reader))
+        with open(filename, "wb") as fp:
+            writer = csv.DictWriter(fp, fieldnames)
+            writer.writeheader()
+            writer.writerows(edit(rows))
+
+class BulkImportTests(LoadSpreadsheetTestCase):
+    def test_import(self):
+        self.load("--dry-run")
+        self.script.populate_database()
+
+        families = self.script.families.values()
+        self.assertEqual(Family.objects.count(), self.nfamilies)
+        self.assertEqual(Student.objects.count(), len(self.script.students))
+        self.assertEqual(Guardian.objects.count(),
+                sum(len(family.guardians) for family in families))
+        self.assertEqual(OLSClass.objects.count(), len(self.script.classes))
+        self.assertEqual(FamilyCard.objects.count(), self.nfamilies)
+        cursor = connection.cursor()
+        cursor.execute("SELECT count(*) FROM %s" % search.TABLE)
+        self.assertEqual(cursor.fetchone()[0],
+                self.nfamilies + len(self.script.classes))
+        self.assertEqual(len(search.search(families[0].name())), 1)
+        for adult in Adult.objects.all():
+            self.assertEqual(adult.homephone_digits,
+                    normalize_phone(adult.homephone))
+            self.assertEqual(adult.cellphone_digits,
+                    normalize_phone(adult.cellphone))
+            self.assertEqual(adult.email_key, normalize_email(adult.email))
+
+    def test_matches_import_by_row(self):
+        self.load("--dry-run")
+        self.script.populate_database()
+        rows = directory_rows()
+        # Reload, as the import records database ids in the directory
+        self.load("--dry-run")
+        self.script.populate_database_by_row()
+        self.assertEqual(directory_rows(), rows)
+
+def directory_ids():
+    """Return the id of each family, student and adult by natural key."""
+    ids = {}
+    for family in Family.objects.all():
+        ids['family', family.name] = family.id
+    for student in Student.objects.select_related('family'):
+        ids['student', student.family.name, student.firstname] = student.id
+    for adult in Adult.objects.all():
+        ids['adult', adult.firstname, adult.lastname, adult.email] = adult.id
+    return ids
+
+class DatabaseSyncTests(LoadSpreadsheetTestCase):
+    def setUp(self):
+        super(DatabaseSyncTests, self).setUp()
+        self.load("--django")
+
+    def change_directory(self):
+        """
+        Move one family, change a student's class, drop a family and
+        add another.  Returns the name of the family that was dropped.
+        """
+        synthetic = import_script("synthetic_directory")
+        added = list(synthetic.family_rows(99, synthetic.sections(22),
+            random.Random(1)))
+        families = self.script.families.values()
+        (moved, dropped) = (families[0].children[0].lastname,
+                families[1].children[0].lastname)
+        def edit(rows):
+            for row in rows:
+                if row["Last Name"] == moved:
+                    row["Street"] = "2 New St"
+                    row["Grade Level"] = "KA"
+                if row["Last Name"] != dropped:
+                    yield row
+            for row in added:
+                yield row
+        self.rewrite(self.directory_file, edit)
+        return families[1].name()
+
+    def test_incremental_twice_changes_nothing(self):
+        self.change_directory()
+        self.load("--incremental")
+        (rows, ids) = (directory_rows(), directory_ids())
+        output = self.load("--incremental")
+        self.assertIn("0 inserts, 0 updates, 0 deletes", output)
+        self.assertEqual(directory_rows(), rows)
+        self.assertEqual(directory_ids(), ids)
+
+    def test_unchanged_rows_keep_their_ids(self):
+        before = directory_ids()
+        dropped = self.change_directory()
+        self.load("--incremental")
+        after = directory_ids()
+        kept = set(before) & set(after)
+        self.assertEqual(dict((key, after[key]) for key in kept),
+                dict((key, before[key]) for key in kept))
+        # Only the dropped family's rows went away
+        self.assertTrue(all(dropped in key or key[0] == 'adult'
+            for key in set(before) - kept))
+        self.assertIn(('family', dropped), before)
+        self.assertNotIn(('family', dropped), after)
+
+    def test_matches_a_full_import(self):
+        self.change_directory()
+        output = self.load("--incremental")
+        self.assertIn("- family ", output)
+        self.assertIn("+ family Brown99", output)
+        self.assertIn("~ address of ", output)
+        self.assertIn("olsclass ", output)
+        rows = directory_rows()
+        self.load("--django")
+        self.assertEqual(directory_rows(), rows)
+
+    def test_diff_writes_nothing(self):
+        (rows, ids) = (directory_rows(), directory_ids())
+        generation = DirectoryVersion.objects.current()
+        self.change_directory()
+        output = self.load("--diff")
+        self.assertIn("+ family Brown99", output)
+        self.assertEqual(directory_rows(), rows)
+        self.assertEqual(directory_ids(), ids)
+        self.assertEqual(DirectoryVersion.objects.current(), generation)
+
+    def test_report_is_sorted(self):
+        self.change_directory()
+        lines = self.load("--diff").splitlines()
+        changes = lines[lines.index("") + 2:-1]
+        order = "+~-"
+        self.assertEqual(changes, sorted(changes,
+            key=lambda line: (order.index(line[0]), line)))
+
+    def test_students_of_a_dropped_class(self):
+        olsclass = self.script.families.values()[0].children[0].olsclass
+        self.rewrite(self.class_file, lambda rows: [row for row in rows
+            if row["class"] != olsclass.key])
+        output = self.load("--diff")
+        self.assertIn("(class not in the class spreadsheet): olsclass "
+                "u'%s' -> u'Unknown'" % olsclass.title, output)
+        self.assertIn("- class %s" % olsclass.title, output)
+
+class GroupFamiliesTests(LoadSpreadsheetTestCase):
+    def ingest(self, window=None):
+        """Return each family's key and children, in the order grouped."""
+        with captured_stdout():
+            (classes, classnames) = self.script.load_class_data(
+                    self.class_file)
+            return [(family.key(), sorted(child.firstname
+                for child in family.children))
+                for family in self.script.ingest_directory(
+                    self.directory_file, classes, window)]
+
+    def separate_siblings(self, distance):
+        """
+        Move the first child of the first family with several children
+        to `distance` records after the last of their siblings.
+        """
+        def edit(rows):
+            names = [row["Last Name"] for row in rows]
+            lastname = next(name for name in names if names.count(name) > 1)
+            child = rows.pop(names.index(lastname))
+            last = len(names) - 2 - names[::-1].index(lastname)
+            rows.insert(last + 1 + distance, child)
+            return rows
+        self.rewrite(self.directory_file, edit)
+
+    def test_unwindowed(self):
+        families = self.ingest()
+        self.assertEqual(len(families), self.nfamilies)
+        self.separate_siblings(20)
+        self.assertEqual(sorted(self.ingest()), sorted(families))
+
+    def test_windowed(self):
+        families = self.ingest()
+        self.assertEqual(self.ingest(window=1), families)
+        self.separate_siblings(2)
+        self.assertEqual(sorted(self.ingest(window=5)), sorted(families))
+
+    def test_sibling_outside_the_window(self):
+        families = self.ingest()
+        self.separate_siblings(20)
+        self.assertEqual(sorted(self.ingest(window=30)), sorted(families))
+        with self.assertRaises(ValueError):
+            self.ingest(window=5)
+
+class ParallelReportTests(LoadSpreadsheetTestCase):
+    def write_reports(self, name, *args):
+        """
+        Write the reports into a new directory, returning the output
+        and each file's contents by name.
+        """
+        outdir = os.path.join(self.tmpdir, name)
+        os.mkdir(outdir)
+        cwd = os.getcwd()
+        os.chdir(outdir)
+        try:
+            output = self.load(*args)
+        finally:
+            os.chdir(cwd)
+        files = {}
+        for filename in os.listdir(outdir):
+            with open(os.path.join(outdir, filename), "rb") as fp:
+                files[filename] = fp.read()
+        return (output, files)
+
+    def test_jobs_match_serial_output(self):
+        (output, files) = self.write_reports("serial")
+        self.assertGreater(len(files), len(reports.reports))
+        self.assertEqual(self.write_reports("parallel", "--jobs", "2"),
+                (output, files))
+
+class StageTimerTests(LoadSpreadsheetTestCase):
+    def test_nested_stages(self):
+        timer = self.script.StageTimer(enabled=True)
+        with timer.stage("outer"):
+            with timer.stage("inner"):
+                time.sleep(0.05)
+        self.assertEqual(list(timer.iterate("items", range(3))), [0, 1, 2])
+        with timer.stage("inner"):
+            pass
+        self.assertEqual(timer.stages.keys(), ["outer", "inner", "items"])
+        # Each stage is charged only for its own time
+        self.assertGreaterEqual(timer.stages["inner"].wall, 0.05)
+        self.assertLess(timer.stages["outer"].wall, 0.05)
+        lines = timer.summary().splitlines()
+        self.assertEqual([line.split()[0] for line in lines],
+                ["Stage", "outer", "inner", "items", "Total"])
+
+    def test_disabled(self):
+        timer = self.script.StageTimer()
+        with timer.stage("outer"):
+            self.assertEqual(list(timer.iterate("items", range(3))),
+                    [0, 1, 2])
+        self.assertEqual(timer.stages, {})
+
+    def stage_names(self, output):
+        """Return the stage names in the summary ending the output."""
+        lines = output.splitlines()
+        summary = lines[lines.index("") + 1:]
+        summary = summary[summary.index(next(line for line in summary
+            if line.startswith("Stage "))):]
+        self.assertTrue(summary[-1].startswith("Total "))
+        return [line[:32].strip() for line in summary[1:-1]]
+
+    def test_timings(self):
+        self.assertNotIn("Stage ", self.load("--dry-run"))
+        # Stages are listed as first entered, and building the families
+        # is what reads the directory
+        self.assertEqual(self.stage_names(self.load("--dry-run",
+            "--timings")), ["load classes", "build families",
+                "read directory", "sort rosters"])
+        self.assertEqual(self.stage_names(self.load("--django",
+            "--timings"))[4:], ["set up django", "commit",
+                "rebuild derived data", "clear database", "insert directory"])
+
+    def test_profile(self):
+        profile_dir = os.path.join(self.tmpdir, "profiles")
+        output = self.load("--dry-run", "--profile", profile_dir)
+        self.assertIn("wrote profiles to %s" % profile_dir, output)
+        self.assertEqual(sorted(os.listdir(profile_dir)),
+                ["build-families.prof", "load-classes.prof",
+                    "read-directory.prof", "sort-rosters.prof"])
+        stats = pstats.Stats(os.path.join(profile_dir, "load-classes.prof"))
+        self.assertTrue(any(name == "load_class_data"
+            for (filename, line, name) in stats.stats))
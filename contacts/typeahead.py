@@ -0,0 +1,144 @@
+"""
+An in-memory name index for typeahead lookups.
+
+The index covers every student and adult.  It is built on first use,
+thrown away whenever the directory changes (see contacts.signals), and
+otherwise answers lookups without touching the database.  Because an
+import run in another process can't reach this one's signals, the
+index is also rebuilt once it is older than TYPEAHEAD_MAX_AGE seconds.
+
+Names are split into lower-cased words on spaces and hyphens.  Each
+query word matches any word it is a prefix of, or, failing that, any
+word whose trigrams are similar enough, so "garcia-l" finds
+"Garcia-Lopez" and "smoth" finds "Smith".
+"""
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+
+from django.conf import settings
+
+from .models import Student, Adult
+from .signals import directory_changed
+
+# The least trigram similarity at which a word counts as a typo.
+FUZZY_THRESHOLD = 0.3
+
+Person = namedtuple('Person', ('kind', 'id', 'name', 'family'))
+
+def words(name):
+    name = name.lower()
+    found = re.findall(r"\w+", name, re.UNICODE)
+    for hyphenated in re.findall(r"\w+(?:-\w+)+", name, re.UNICODE):
+        found.append(hyphenated.replace("-", ""))
+    return found
+
+def trigrams(word):
+    padded = "  " + word + " "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+class NameIndex(object):
+    def __init__(self, people):
+        self.people = people
+        self.word_people = {}
+        for idx, person in enumerate(people):
+            for word in set(words(person.name)):
+                self.word_people.setdefault(word, []).append(idx)
+        self.sorted_words = sorted(self.word_people)
+        self.word_trigrams = {}
+        self.trigram_words = {}
+        for word in self.sorted_words:
+            grams = trigrams(word)
+            self.word_trigrams[word] = grams
+            for gram in grams:
+                self.trigram_words.setdefault(gram, []).append(word)
+
+    def matching_words(self, query_word):
+        """
+        Return a dict of the indexed words matching a query word, with
+        a score of 1.0 for a prefix match and the trigram similarity
+        for a fuzzy one.
+        """
+        matches = {}
+        idx = bisect_left(self.sorted_words, query_word)
+        while (idx < len(self.sorted_words) and
+                self.sorted_words[idx].startswith(query_word)):
+            matches[self.sorted_words[idx]] = 1.0
+            idx += 1
+        if len(query_word) < 3:
+            return matches
+        grams = trigrams(query_word)
+        shared = {}
+        for gram in grams:
+            for word in self.trigram_words.get(gram, ()):
+                shared[word] = shared.get(word, 0) + 1
+        for word, count in shared.iteritems():
+            if word in matches:
+                continue
+            similarity = float(count) / (
+                    len(grams) + len(self.word_trigrams[word]) - count)
+            if similarity >= FUZZY_THRESHOLD:
+                matches[word] = similarity
+        return matches
+
+    def lookup(self, query, limit=10):
+        """
+        Return up to `limit` people matching every word of the query,
+        best matches first.
+        """
+        scores = None
+        for query_word in set(words(query)):
+            word_scores = {}
+            for word, score in self.matching_words(query_word).iteritems():
+                for idx in self.word_people[word]:
+                    if score > word_scores.get(idx, 0.0):
+                        word_scores[idx] = score
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = dict((idx, scores[idx] + score)
+                        for idx, score in word_scores.iteritems()
+                        if idx in scores)
+            if not scores:
+                return []
+        if scores is None:
+            return []
+        best = heapq.nsmallest(limit, scores.iteritems(),
+                key=lambda item: (-item[1], self.people[item[0]].name))
+        return [self.people[idx] for idx, score in best]
+
+def build_index():
+    people = []
+    for pk, first, last, family in Student.objects.values_list(
+            'id', 'firstname', 'lastname', 'family_id'):
+        people.append(Person('student', pk, first + " " + last, family))
+    for pk, first, last, family in Adult.objects.values_list(
+            'id', 'firstname', 'lastname', 'guardian__family_id'):
+        people.append(Person('adult', pk, first + " " + last, family))
+    return NameIndex(people)
+
+_lock = threading.Lock()
+_index = None
+_built = 0.0
+
+def get_index():
+    global _index, _built
+    max_age = getattr(settings, 'TYPEAHEAD_MAX_AGE', 300)
+    with _lock:
+        if _index is None or time.time() - _built > max_age:
+            _index = build_index()
+            _built = time.time()
+        return _index
+
+def invalidate(**kwargs):
+    global _index
+    with _lock:
+        _index = None
+
+directory_changed.connect(invalidate, dispatch_uid='typeahead_invalidate')
+
+def lookup(query, limit=10):
+    return get_index().lookup(query, limit)
@@ -1,11 +1,27 @@
 from django.conf.urls import url
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     url(r'^adults/$', views.adult_index, name='adult_index'),
+    url(r'^adults/data/$', views.adult_data, name='adult_data'),
     url(r'^students/$', views.student_index, name='student_index'),
+    url(r'^students/data/$', views.student_data, name='student_data'),
     url(r'^families/$', views.family_index, name='family_index'),
+    url(r'^families/print/$', views.family_print, name='family_print'),
+    url(r'^families/(?P<family_id>\d+)/$', views.family_detail,
+        name='family_detail'),
     url(r'^classes/$', views.class_index, name='class_index'),
+    url(r'^reports/$', views.report_index, name='report_index'),
+    url(r'^reports/(?P<name>[\w-]+)/$', views.report_download,
+        name='report_download'),
+    url(r'^search/$', views.search_index, name='search'),
+    url(r'^autocomplete/$', views.autocomplete, name='autocomplete'),
+    url(r'^api/families/$', api.families, name='api_families'),
+    url(r'^api/classes/$', api.classes, name='api_classes'),
+    url(r'^api/students/$', api.students, name='api_students'),
+    url(r'^api/adults/$', api.adults, name='api_adults'),
+    url(r'^api/lookup/$', api.lookup, name='api_lookup'),
+    url(r'^cache-stats/$', views.page_cache_stats, name='page_cache_stats'),
     url(r'^$', views.index, name='index'),
 ]
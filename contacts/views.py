@@ -1,55 +1,123 @@
-from django.shortcuts import render
-from django.http import HttpResponse
+import zipfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.core.urlresolvers import reverse
+from django.shortcuts import get_object_or_404, render
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.http import JsonResponse
+from django.http import StreamingHttpResponse
 from django.template import RequestContext, loader
 
-from .models import Student, Adult, Family, OLSClass
+from . import metrics, reports, search, typeahead
+from .cache import directory_page, cache_stats
+from .datatables import Column, datatables_response
+from .forms import SearchForm
+from .pagination import InvalidCursor, keyset_chunks, keyset_page, page_params
+from .models import Student, Adult, Guardian, Family, FamilyCard, OLSClass
+from .models import AdultQuerySet
 
 def index(request):
     return HttpResponse("Welcome! You've safely arrived at the contacts index!")
 
+adult_columns = [
+    Column("Last Name", ('lastname', 'firstname'), lambda a: a.lastname),
+    Column("First Name", ('firstname', 'lastname'), lambda a: a.firstname),
+    Column("Role", ('staff_role', 'relation', 'lastname', 'firstname'),
+        lambda a: a.role()),
+    Column("Phone", ('cellphone_digits', 'homephone_digits'),
+        lambda a: a.cellphone or a.homephone or ""),
+    Column("Email", ('email_key',), lambda a: a.email or ""),
+]
+
+adult_role_choices = (
+    [("", "Everyone"), (AdultQuerySet.ANY_STAFF, "All staff"),
+     (AdultQuerySet.ANY_GUARDIAN, "All parents & guardians")] +
+    [(role, role) for role in AdultQuerySet.STAFF_ROLES] +
+    list(Guardian.RELATION_CHOICES))
+
 def adult_index(request):
-    return HttpResponse("Welcome! You've safely arrived at the adult index!")
+    return render(request, 'contacts/adult_index.html',
+            {'columns': adult_columns,
+             'roles': adult_role_choices,
+             'data_url': reverse('contacts:adult_data')})
+
+def adult_data(request):
+    adults = Adult.objects.with_roles()
+    role = request.GET.get('role')
+    if role:
+        adults = adults.with_role(role)
+    return datatables_response(request, adults, adult_columns,
+            ('firstname', 'lastname', 'email', 'homephone', 'cellphone',
+             'homephone_digits', 'cellphone_digits'))
+
+student_columns = [
+    Column("Last Name", ('lastname', 'firstname'), lambda s: s.lastname),
+    Column("First Name", ('firstname', 'lastname'), lambda s: s.firstname),
+    Column("Class", ('olsclass__rank', 'olsclass__title', 'lastname',
+        'firstname'), lambda s: s.olsclass.title),
+    Column("Family", ('family__name', 'lastname', 'firstname'),
+        lambda s: s.family.name),
+]
 
 def student_index(request):
-    students 
-    return HttpResponse("Welcome! You've safely arrived at the student index!")
+    return render(request, 'contacts/datatable_index.html',
+            {'columns': student_columns,
+             'data_url': reverse('contacts:student_data')})
 
+def student_data(request):
+    return datatables_response(request,
+            Student.objects.select_related('olsclass', 'family'),
+            student_columns,
+            ('firstname', 'lastname', 'olsclass__title', 'family__name'))
+
+@directory_page
 def family_index(request):
-    families = []
-    for family in Family.objects.all():
-        familyinfo = {
-                'students': [],
-                'parents': family.parent_names(),
-                'email': '(no email)',
-                'address': ['(no address)'],
-                'phone_numbers': family.phone_numbers(),
-                'emails': family.emails(),
-                }
-        if family.address is not None:
-                familyinfo['address'] = family.address.multiline()
-        for student in family.student_set.all():
-            familyinfo['students'].append({
-                'firstname': student.firstname,
-                'lastname': student.lastname,
-                'grade': student.olsclass.grade,
-                })
-        families.append(familyinfo)
+    try:
+        after, limit = page_params(request)
+        page = keyset_page(FamilyCard.objects.all(), after, limit)
+    except InvalidCursor as err:
+        return HttpResponseBadRequest(str(err))
+    families = [card.directory_info() for card in page.items]
     template = loader.get_template('contacts/family_index.html')
-    context = RequestContext(request, {'families': families })
+    context = RequestContext(request, {'families': families, 'page': page })
     return HttpResponse(template.render(context))
 
+@directory_page
+def family_detail(request, family_id):
+    """
+    A single family's card, as linked from the search results.
+    """
+    card = get_object_or_404(FamilyCard, family_id=family_id)
+    return render(request, 'contacts/family_index.html',
+            {'families': [card.directory_info()]})
+
+STREAM_MARKER = "<!-- family cards -->"
+
+def family_print(request):
+    """
+    The full family directory, streamed: the page header goes out at
+    once, followed by the family cards a chunk at a time.
+    """
+    template = loader.get_template('contacts/family_print.html')
+    context = RequestContext(request, {'stream_marker': STREAM_MARKER})
+    head, tail = template.render(context).split(STREAM_MARKER)
+    card = loader.get_template('contacts/family_card.html')
+
+    def render():
+        yield head
+        for chunk in keyset_chunks(FamilyCard.objects.all()):
+            yield "".join(card.render({'family': c.directory_info()})
+                    for c in chunk)
+        yield tail
+
+    return StreamingHttpResponse(render())
+
+@directory_page
 def class_index(request):
     classes = []
-    for idx, olsclass in enumerate(OLSClass.objects.all()):
-        classinfo = {
-                'tag': olsclass.tag(),
-                'grade': olsclass.grade,
-                'teacher': olsclass.teacher_name(),
-                'aide': olsclass.aide_name(),
-                'classmom': olsclass.classmom_name(),
-                'students': [] }
-        for student in olsclass.student_set.all():
-            classinfo['students'].append(student.name())
+    for idx, classinfo in enumerate(OLSClass.objects.rosters()):
         if len(classinfo['students']) > 0:
             classes.append(classinfo)
             if idx % 3 == 0:
@@ -59,3 +127,62 @@ def class_index(request):
     template = loader.get_template('contacts/classes_index.html')
     context = RequestContext(request, {'classes': classes })
     return HttpResponse(template.render(context))
+
+def search_index(request):
+    form = SearchForm(request.GET)
+    query = form.data.get('q', "").strip()
+    results = search.search(query) if query else []
+    paginator = Paginator(results, 20)
+    try:
+        page = paginator.page(request.GET.get('page', 1))
+    except PageNotAnInteger:
+        page = paginator.page(1)
+    except EmptyPage:
+        page = paginator.page(paginator.num_pages)
+    return render(request, 'search/search.html',
+            {'form': form, 'query': query, 'page': page})
+
+def autocomplete(request):
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+    except ValueError:
+        return HttpResponseBadRequest("bad limit")
+    results = typeahead.lookup(request.GET.get('q', ""), limit)
+    return JsonResponse({'results': [p._asdict() for p in results]})
+
+def page_cache_stats(request):
+    return JsonResponse(cache_stats())
+
+def metrics_export(request):
+    """The request and SQL metrics, for Prometheus to scrape."""
+    return HttpResponse(metrics.registry.render(),
+            content_type="text/plain; version=0.0.4; charset=utf-8")
+
+def report_index(request):
+    return render(request, 'contacts/report_index.html',
+            {'reports': reports.reports.values()})
+
+@directory_page
+def report_download(request, name):
+    """
+    Generate one of the directory reports from the database.  A report
+    made of several files is downloaded as a zip archive.
+    """
+    if name not in reports.reports:
+        raise Http404("No such report")
+    year = getattr(settings, 'DIRECTORY_SCHOOL_YEAR', "")
+    report = reports.reports[name](reports.database_directory())
+    outputs = list(report.outputs(year))
+    if report.single_file:
+        [(filename, contents)] = outputs
+        response = HttpResponse(contents, content_type=report.content_type)
+    else:
+        filename = "%s-%s.zip" % (name, year)
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for (outfile, contents) in outputs:
+                zf.writestr(outfile, contents)
+        response = HttpResponse(archive.getvalue(),
+                content_type="application/zip")
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
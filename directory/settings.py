@@ -41,6 +41,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'contacts.metrics.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -79,9 +80,45 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Keep each thread's connection open between requests
+        'CONN_MAX_AGE': 600,
     }
 }
 
+# Each new SQLite connection is given the PRAGMAs in
+# contacts.pragmas.DEFAULT_PRAGMAS, which put the database in WAL mode
+# so the pages can be read while an import writes.  Set
+# DIRECTORY_SQLITE_PRAGMAS to a dict to use other PRAGMAs instead, or to
+# an empty dict to leave SQLite's defaults.
+
+
+# Caches
+# https://docs.djangoproject.com/en/1.8/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Cache used for rendered directory pages, and how long (in seconds)
+# to keep them.  Pages are invalidated when the directory changes, so
+# None (forever) is safe.
+DIRECTORY_PAGE_CACHE = 'default'
+DIRECTORY_PAGE_CACHE_TIMEOUT = None
+
+# Number of families per page of the family directory, by default and
+# at most.
+DIRECTORY_PAGE_SIZE = 60
+DIRECTORY_MAX_PAGE_SIZE = 500
+
+# Longest time (in seconds) the in-memory typeahead index is used before
+# being rebuilt, to pick up changes made by other processes.
+TYPEAHEAD_MAX_AGE = 300
+
+# School year named in the files of the downloadable reports
+DIRECTORY_SCHOOL_YEAR = "2016-17"
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
@@ -16,7 +16,10 @@ Including another URLconf
 from django.conf.urls import include, url
 from django.contrib import admin
 
+from contacts import views as contacts_views
+
 urlpatterns = [
     url(r'^contacts/', include('contacts.urls', namespace='contacts')),
     url(r'^admin/', include(admin.site.urls)),
+    url(r'^metrics$', contacts_views.metrics_export, name='metrics'),
 ]
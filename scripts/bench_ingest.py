@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+#  Measure the peak memory of load_spreadsheet.py's streaming ingestion
+#  pipeline on synthetic directories of growing size.  Each measurement
+#  runs in its own process so that peak RSS figures are independent.
+#
+#  The synthetic directories list siblings together, as the real export
+#  does, so this measures the pipeline at its best: a family stays open
+#  only while its own children are read.  Input that separates siblings
+#  by more than --window records makes the streaming run fail.
+#
+import os, sys
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+import load_spreadsheet
+import synthetic_directory
+
+def peak_rss():
+    """Return this process's peak resident set size, in kilobytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024
+    return rss
+
+def measure(directory_file, class_file, window):
+    """
+    Run the ingestion pipeline over a directory file, discarding each
+    family as it is emitted, and print the student and family counts
+    followed by the peak RSS.
+    """
+    sys.stdout = open(os.devnull, "w")
+    try:
+        (classes, classnames) = load_spreadsheet.load_class_data(class_file)
+        nstudents = nfamilies = 0
+        for family in load_spreadsheet.ingest_directory(directory_file,
+                classes, window):
+            nstudents += len(family.children)
+            nfamilies += 1
+    finally:
+        sys.stdout.close()
+        sys.stdout = sys.__stdout__
+    print nstudents, nfamilies, peak_rss()
+
+def run(directory_file, class_file, window):
+    args = [sys.executable, os.path.abspath(__file__), "--measure",
+            directory_file, class_file]
+    if window is None:
+        args.append("--unbounded")
+    else:
+        args.extend(["--window", str(window)])
+    output = subprocess.check_output(args)
+    return [int(field) for field in output.split()]
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+            description="Benchmark load_spreadsheet.py ingestion memory.")
+    parser.add_argument("--families", type=int, default=2000,
+            help="Number of synthetic families in the smallest input "
+            "(default: 2000)")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10],
+            help="Input sizes, as multiples of --families (default: 1 10)")
+    parser.add_argument("--window", type=int, default=50,
+            help="Records a family may stay open in the pipeline "
+            "(default: 50)")
+    parser.add_argument("--measure", nargs=2, metavar=("DIRECTORY", "CLASSES"),
+            help=argparse.SUPPRESS)
+    parser.add_argument("--unbounded", action="store_true",
+            help=argparse.SUPPRESS)
+    return parser.parse_args(args)
+
+def main(args):
+    opt = parse_args(args)
+    if opt.measure:
+        window = None if opt.unbounded else opt.window
+        measure(opt.measure[0], opt.measure[1], window)
+        return
+
+    workdir = tempfile.mkdtemp()
+    try:
+        print "%10s %10s %16s %16s" % ("families", "students",
+                "streaming (KB)", "unbounded (KB)")
+        for scale in opt.scale:
+            directory_file = os.path.join(workdir, "directory.csv")
+            class_file = os.path.join(workdir, "classes.csv")
+            stdout = sys.stdout
+            sys.stdout = open(os.devnull, "w")
+            try:
+                synthetic_directory.write_directory(directory_file,
+                        class_file, opt.families * scale)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            (nstudents, nfamilies, streaming) = run(directory_file,
+                    class_file, opt.window)
+            unbounded = run(directory_file, class_file, None)[2]
+            print "%10d %10d %16d %16d" % (nfamilies, nstudents,
+                    streaming, unbounded)
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+#  Report the memory used per family by load_spreadsheet.py's directory
+#  objects on a synthetic directory, as they are (with __slots__) and
+#  as they would be with an instance __dict__ holding the same values.
+#
+import os, sys
+import shutil
+import argparse
+import tempfile
+
+import load_spreadsheet
+import synthetic_directory
+from bench_populate import quiet
+from contacts import loader
+
+class Plain(object):
+    pass
+
+def slot_values(obj):
+    """Yield (name, value) for each attribute set in an object's slots."""
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if hasattr(obj, name):
+                yield (name, getattr(obj, name))
+
+def slotted_size(obj):
+    return sys.getsizeof(obj)
+
+def dict_backed_size(obj):
+    """
+    Return the size of an object and its __dict__ if it kept the same
+    attribute values in a __dict__ instead of slots.
+    """
+    plain = Plain()
+    for (name, value) in slot_values(obj):
+        setattr(plain, name, value)
+    return sys.getsizeof(plain) + sys.getsizeof(plain.__dict__)
+
+def family_objects(family):
+    """Yield the directory objects belonging to one family."""
+    yield family
+    yield family.address
+    for guardian in family.guardians:
+        yield guardian
+    for child in family.children:
+        yield child
+
+def measure(families):
+    """
+    Return (object bytes with slots, object bytes with dicts, value
+    bytes) for the families.  Values - strings and lists - are counted
+    once each, and are the same either way.
+    """
+    directory_types = (loader.Student, loader.Adult, loader.Address,
+            loader.Family, loader.OLSClass)
+    slotted = dict_backed = values = 0
+    seen = set()
+    for family in families:
+        for obj in family_objects(family):
+            slotted += slotted_size(obj)
+            dict_backed += dict_backed_size(obj)
+            for (name, value) in slot_values(obj):
+                if isinstance(value, directory_types) or id(value) in seen:
+                    continue
+                seen.add(id(value))
+                if isinstance(value, (str, unicode, list, tuple)):
+                    values += sys.getsizeof(value)
+    return (slotted, dict_backed, values)
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+            description="Benchmark the memory used by the loader objects.")
+    parser.add_argument("--students", type=int, default=50000,
+            help="Approximate number of synthetic students (default: 50000)")
+    return parser.parse_args(args)
+
+def main(args):
+    opt = parse_args(args)
+    workdir = tempfile.mkdtemp()
+    try:
+        directory_file = os.path.join(workdir, "directory.csv")
+        class_file = os.path.join(workdir, "classes.csv")
+        with quiet():
+            # The synthetic families average about 2.2 children
+            synthetic_directory.write_directory(directory_file, class_file,
+                    int(opt.students / 2.2))
+            load_spreadsheet.main(["--student-file", directory_file,
+                "--class-file", class_file, "--dry-run"])
+    finally:
+        shutil.rmtree(workdir)
+
+    families = load_spreadsheet.families.values()
+    nfamilies = len(families)
+    nstudents = len(load_spreadsheet.students)
+    (slotted, dict_backed, values) = measure(families)
+    print "%d students in %d families" % (nstudents, nfamilies)
+    print "%-26s %10s %10s" % ("bytes per family", "objects", "total")
+    print "%-26s %10.0f %10.0f" % ("with __dict__ (before)",
+            float(dict_backed) / nfamilies,
+            float(dict_backed + values) / nfamilies)
+    print "%-26s %10.0f %10.0f" % ("with __slots__ (after)",
+            float(slotted) / nfamilies, float(slotted + values) / nfamilies)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+#  Compare the bulk and row-by-row database imports of load_spreadsheet.py
+#  on a synthetic directory, using a scratch copy of the Django database.
+#
+import os, sys
+import time
+import shutil
+import argparse
+import tempfile
+from contextlib import contextmanager
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(script_dir))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "directory.settings")
+
+import load_spreadsheet
+import synthetic_directory
+
+@contextmanager
+def quiet():
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def load(directory_file, class_file):
+    with quiet():
+        load_spreadsheet.main(["--student-file", directory_file,
+            "--class-file", class_file, "--dry-run"])
+
+def time_import(populate, directory_file, class_file):
+    load(directory_file, class_file)
+    start = time.time()
+    with quiet():
+        populate()
+    return time.time() - start
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+            description="Benchmark load_spreadsheet.py --django imports.")
+    parser.add_argument("--families", type=int, default=5000,
+            help="Number of synthetic families (default: 5000)")
+    parser.add_argument("--skip-row-by-row", action="store_true",
+            help="Only time the bulk import")
+    return parser.parse_args(args)
+
+def main(args):
+    opt = parse_args(args)
+
+    import django
+    from django.conf import settings
+    django.setup()
+    from django.db import connection
+    from contacts import models
+
+    workdir = tempfile.mkdtemp()
+    try:
+        directory_file = os.path.join(workdir, "directory.csv")
+        class_file = os.path.join(workdir, "classes.csv")
+        nstudents = synthetic_directory.write_directory(directory_file,
+                class_file, opt.families)
+        print "%d students in %d families" % (nstudents, opt.families)
+
+        settings.DATABASES['default']['TEST'] = {
+                'NAME': os.path.join(workdir, "bench.sqlite3")}
+        connection.creation.create_test_db(verbosity=0)
+
+        bulk = time_import(load_spreadsheet.populate_database,
+                directory_file, class_file)
+        print "bulk import:       %8.2f s" % bulk
+        assert models.Student.objects.count() == nstudents
+
+        if not opt.skip_row_by_row:
+            by_row = time_import(load_spreadsheet.populate_database_by_row,
+                    directory_file, class_file)
+            print "row-by-row import: %8.2f s" % by_row
+            print "speedup:           %8.1fx" % (by_row / bulk)
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
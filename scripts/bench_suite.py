@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+#
+#  Time the directory pipeline end to end on synthetic directories of
+#  several sizes: parsing the spreadsheets, grouping families, each
+#  report, the --django import, and rendering the family and class
+#  pages.  Results are written as JSON so runs can be compared.
+#
+import os, sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(script_dir)
+sys.path.insert(0, repo_dir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "directory.settings")
+
+import load_spreadsheet
+import synthetic_directory
+from bench_populate import quiet
+from contacts.loader import Directory
+from contacts.reports import reports
+
+def best_of(repeat, func, setup=None):
+    """
+    Call func() `repeat` times, each after an untimed call to setup(),
+    returning the fastest and all of the wall-clock times, in seconds.
+    """
+    runs = []
+    for idx in range(repeat):
+        with quiet():
+            if setup is not None:
+                setup()
+            start = time.time()
+            func()
+            runs.append(time.time() - start)
+    return (min(runs), runs)
+
+def parse_stages(opt, directory_file, class_file):
+    """
+    Yield (stage, func, setup) for the stages that run without Django.
+    """
+    with quiet():
+        (classes, classnames) = load_spreadsheet.load_class_data(class_file)
+
+    def parse():
+        records = load_spreadsheet.validate_records(
+                load_spreadsheet.read_directory(directory_file), classes)
+        return list(load_spreadsheet.normalize_records(records, classes))
+    yield ("parse", parse, None)
+
+    with quiet():
+        items = parse()
+    def group():
+        for family in load_spreadsheet.group_families(iter(items)):
+            pass
+    yield ("group", group, None)
+
+    def load():
+        load_spreadsheet.main(["--student-file", directory_file,
+            "--class-file", class_file, "--dry-run"])
+    yield ("load", load, None)
+
+    def index():
+        return Directory(load_spreadsheet.families.values(),
+                load_spreadsheet.students, load_spreadsheet.classes,
+                load_spreadsheet.classnames, load_spreadsheet.class_roster)
+    yield ("index", index, load)
+
+    # Each report starts from freshly loaded objects, so it pays for
+    # the per-family values it derives rather than finding them cached
+    directories = []
+    def fresh_directory():
+        load()
+        directories[:] = [index()]
+    for name in reports:
+        def render(name=name):
+            for output in reports[name](directories[0]).outputs(opt.year):
+                pass
+        yield ("report:" + name, render, fresh_directory)
+
+    with quiet():
+        load()
+
+def database_stages(opt):
+    """
+    Yield (stage, func, setup) for the import and the pages, which need
+    the directory loaded by parse_stages().
+    """
+    from django.core.cache import caches
+    from django.core.urlresolvers import reverse
+    from django.test import Client
+
+    yield ("populate_database", load_spreadsheet.populate_database, None)
+
+    client = Client()
+    for name in ('family_index', 'class_index'):
+        url = reverse('contacts:' + name)
+        def get(url=url):
+            assert client.get(url).status_code == 200
+        yield ("page:%s" % name, get, caches['default'].clear)
+        yield ("page:%s:cached" % name, get, None)
+
+def baseline_times(filename):
+    """
+    Return the fastest time of each (students, stage) in an earlier
+    run's JSON results.
+    """
+    with open(filename) as fp:
+        baseline = json.load(fp)
+    return dict(((run['students'], stage['stage']), stage['seconds'])
+            for run in baseline['runs'] for stage in run['stages'])
+
+def git_revision():
+    try:
+        with open(os.devnull, "w") as null:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                    cwd=repo_dir, stderr=null).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+            description="Benchmark the directory pipeline end to end.")
+    parser.add_argument("--students", type=int, nargs="+",
+            default=[100, 1000, 10000],
+            help="Synthetic directory sizes, in students "
+            "(default: 100 1000 10000)")
+    parser.add_argument("--repeat", type=int, default=3,
+            help="Times to run each stage; the fastest is reported "
+            "(default: 3)")
+    parser.add_argument("--year", default=load_spreadsheet.school_year,
+            help="School year to name the report files with")
+    parser.add_argument("--no-database", dest="database",
+            action="store_false",
+            help="Skip the import and page rendering stages")
+    parser.add_argument("--output", "-o",
+            help="Write the JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", metavar="RESULTS",
+            help="Show each time relative to an earlier run's JSON results")
+    return parser.parse_args(args)
+
+def main(args):
+    opt = parse_args(args)
+    baseline = baseline_times(opt.compare) if opt.compare else {}
+
+    import django
+    from django.conf import settings
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    results = {
+        'started': datetime.datetime.utcnow().isoformat() + "Z",
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'repeat': opt.repeat,
+        'runs': [],
+    }
+
+    workdir = tempfile.mkdtemp()
+    try:
+        if opt.database:
+            setup_test_environment()
+            settings.DATABASES['default']['TEST'] = {
+                    'NAME': os.path.join(workdir, "bench.sqlite3")}
+            connection.creation.create_test_db(verbosity=0)
+
+        for nstudents in opt.students:
+            directory_file = os.path.join(workdir, "directory.csv")
+            class_file = os.path.join(workdir, "classes.csv")
+            synthetic_directory.write_directory(directory_file, class_file,
+                    nclasses=synthetic_directory.classes_for(nstudents),
+                    max_students=nstudents)
+
+            stages = list(parse_stages(opt, directory_file, class_file))
+            run = {
+                'students': nstudents,
+                'families': len(load_spreadsheet.families),
+                'classes': len(load_spreadsheet.classes),
+                'stages': [],
+            }
+            if opt.database:
+                stages.extend(database_stages(opt))
+            for (stage, func, setup) in stages:
+                (best, runs) = best_of(opt.repeat, func, setup)
+                run['stages'].append({'stage': stage, 'seconds': best,
+                    'runs': runs})
+                line = "%8d students  %-34s %9.4f s" % (nstudents, stage, best)
+                before = baseline.get((nstudents, stage))
+                if before:
+                    line += "  %6.2fx" % (best / before)
+                sys.stderr.write(line + "\n")
+            results['runs'].append(run)
+    finally:
+        shutil.rmtree(workdir)
+
+    if opt.output:
+        with open(opt.output, "w") as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,10 +2,16 @@
 #
 #  Read and work with OLS Caritas 2014-2015 directory
 #
-import os, sys
-import re
+import os, re, sys
 import csv
+import time
+import cProfile
 import argparse
+import resource
+import itertools
+import contextlib
+import collections
+import multiprocessing
 
 # Configuration
 school_year = "2016-17"
@@ -14,491 +20,175 @@ school_year = "2016-17"
 directory_tmpl = "{year} directory.csv"
 class_tmpl = "{year} classes.csv"
 
-# Default outputs
-class_roster_tmpl = "ols-classes-{year}.txt"
-directory_by_class_tmpl = "ols-class-directory-{year}.txt"
-directory_by_family_tmpl = "ols-family-directory-{year}.txt"
-caritas_hours_spreadsheet_tmpl = "ols-family-hours-{year}.csv"
-classmom_spreadsheet_tmpl = "contact-info-%s.csv"
-mothers_tmpl = "mothers-{year}.csv"
-vertical_response_spreadsheet_tmpl = "vertical-response-{year}.csv"
-
-guys_first_sortkey = { 
-    "Father": 0,
-    "Brother": 1,
-    "Grandfather": 2,
-    "Uncle": 3,
-    "Mother": 10,
-    "Sister": 11,
-    "Grandmother": 12,
-    "Aunt": 13,
-    "Guardian": 20 }
-
-ladies_first_sortkey = { 
-    "Mother": 0,
-    "Sister": 1,
-    "Grandmother": 2,
-    "Aunt": 3,
-    "Father": 10,
-    "Brother": 11,
-    "Grandfather": 12,
-    "Uncle": 13,
-    "Guardian": 20 }
-
-# If True, private information will NOT be redacted.
-no_hidden_fields = False
+# The directory objects and reports live in the contacts app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from contacts import loader
+from contacts.loader import (Directory, Family, Guardian, OLSClass, Staff,
+        Student, group_key, lastname_sortkey)
+from contacts.reports import reports
 
 #######################################################################
-# Helper functions
+# Functions
 #######################################################################
 
-def cleanup_zipcode(zipcode):
-    try:
-        return "%05d" % int(zipcode)
-    except ValueError:
-        return zipcode
-
-def class_sortkey(classname):
-    if classname.startswith("P"):
-        return "00 " + classname
-    elif classname.startswith("K"):
-        return "01 " + classname
-    else:
-        return "02 " + classname
-
-def is_couple(g1, g2):
-    if g1.relation == "Father" and g2.relation == "Mother":
-        return True
-    elif g1.relation == "Mother" and g2.relation == "Father":
-        return True
-    elif g1.relation == "Grandfather" and g2.relation == "Grandmother":
-        return True
-    elif g1.relation == "Grandmother" and g2.relation == "Grandfather":
-        return True
-    elif g1.relation == "Uncle" and g2.relation == "Aunt":
-        return True
-    elif g1.relation == "Aunt" and g2.relation == "Uncle":
-        return True
-    else:
-        return False
-
-def group_key(persons):
-    return "; ".join(sorted([p.key() for p in persons]))
-
-grade_names = [
-    ("Unknown", "??"),
-    ("Pre-K 2.5", "PK2"),
-    ("Pre-K 3", "PK3"),
-    ("Pre-K 4", "PK4"),
-    ("Kindergarten", "K"),
-    ("First Grade", "1"),
-    ("Second Grade", "2"),
-    ("Third Grade", "3"),
-    ("Fourth Grade", "4"),
-    ("Fifth Grade", "5"),
-    ("Sixth Grade", "6"),
-    ("Seventh Grade", "7"),
-    ("Eighth Grade", "8"),
-]
-
-gradelevel = {}
-graderank = {}
-
-for idx, item in enumerate(grade_names):
-    name, level = item
-    gradelevel[name] = level
-    graderank[name] = "%02d" % idx
-
-def redacted(field):
-    """
-    If the given value was marked "private", by enclosing it in
-    square brackets, return the empty string.  Otherwise, return
-    the value as is.
+def read_directory(csvfile):
     """
-    if not field or no_hidden_fields:
-        return field
-    if field.startswith("[") or field.endswith("]"):
-        return ""
-    else:
-        return field
+    Read student & family data from the CSV export of Maria's directory
+    spreadsheet, one row at a time.
 
-#######################################################################
-# Classes
-#######################################################################
+    This generator yields a dict for each student, where the keys are
+    just the column names from the spreadsheet.  Only the current row is
+    held in memory.
+    """
+    with open(csvfile, "r") as fp:
+        dir_reader = csv.DictReader(fp, delimiter=",", quotechar='"')
+        for row in dir_reader:
+            yield row
 
-class Student(object):
-    def __init__(self, firstname, lastname, olsclass):
-        self.firstname = firstname
-        self.lastname = lastname
-        self.olsclass = olsclass
-        self.family = None
-        self._id = None     # database id
+def load_directory_data(csvfile):
+    """
+    Read student & family data from the CSV export of Maria's directory
+    spreadsheet.  
+    
+    This function returns a list of dicts - one for each student - where
+    the keys are just the column names from the spreadsheet. 
+    """
+    return list(read_directory(csvfile))
 
-    def key(self):
-        return self.name(lastname_first=True)
+def validate_records(records, classes):
+    """
+    Check each record from the directory spreadsheet, reporting students
+    whose class is not in the classes spreadsheet and dropping rows that
+    don't name a student at all.
+    """
+    for rec in records:
+        if not (rec["First Name"] or rec["Last Name"]):
+            continue
+        classname = rec["Grade Level"]
+        if not classname in classes:
+            print "ERROR: %s %s class %s not in classes DB" % (
+                    rec["First Name"], rec["Last Name"], classname)
+        yield rec
 
-    def name(self, lastname_first=False):
-        if lastname_first:
-            return self.lastname + ", " + self.firstname
-        else:
-            return self.firstname + " " + self.lastname
-
-    def siblings(self):
-        sibs = set(self.family.children)
-        sibs.discard(self)
-        return sibs
-
-    def sortkey(self):
-        return(class_sortkey(self.olsclass.key), self.firstname)
-
-class Adult(object):
-    def __init__(self, firstname, lastname, 
-            email=None, homephone=None, cellphone=None):
-        self.firstname = firstname
-        self.lastname = lastname
-        self.email = email
-        self.homephone = homephone
-        self.cellphone = cellphone
-        self.address = None
-        self._id = None     # database id
-
-    def key(self):
-        return self.lastname + ", " + self.firstname
-
-    def name(self, lastname_first=False):
-        first, last = [redacted(f) for f in (self.firstname, self.lastname)]
-        if not first and not last:
-            return ""
-        elif first and last:
-            if lastname_first:
-                return last + ", " + first
-            else:
-                return first + " " + last
-        else:
-            return first + last
-
-class Staff(Adult):
-    def __init__(self, firstname, lastname, role, 
-            email=None, homephone=None, cellphone=None):
-        Adult.__init__(self, firstname, lastname, email, homephone, cellphone)
-        self.role = role
-        self.olsclass = None
-
-class Guardian(Adult):
-    def __init__(self, firstname, lastname, relation, 
-            email=None, homephone=None, cellphone=None):
-        Adult.__init__(self, firstname, lastname, email, homephone, cellphone)
-        if relation:
-            self.relation = relation.capitalize()
-        else:
-            self.relation = "Guardian"
-        self.family = None
-        self._id = None     # database id
+def record_guardian(rec, student, column, relation, email_column, 
+        phone_column, cell_column):
+    """
+    Return a Guardian for one of the parent columns of a record, or None
+    if the record has no name or email in that column.
+    """
+    if not (rec[column] or rec[email_column]):
+        return None
+    if rec[column]:
+        (lastname, firstname) = rec[column].split(",")
+    else:
+        (lastname, firstname) = (student.lastname, "_" + column.lower())
+    return Guardian(firstname.strip(), lastname.strip(), relation,
+            rec[email_column], rec[phone_column], rec[cell_column])
 
-    def guys_first(self):
-        return guys_first_sortkey[self.relation]
+def normalize_records(records, classes):
+    """
+    Turn each directory record into a Student and the Guardian objects
+    for the student's parents.
 
-    def ladies_first(self):
-        return ladies_first_sortkey[self.relation]
+    This generator yields (student, guardians, record) tuples.
+    """
+    for rec in records:
+        olsclass = classes.get(rec["Grade Level"], "")
 
-    def shortrelation(self):
-        if self.relation == "Mother" or self.relation == "_mother":
-            return "Mom"
-        elif self.relation == "Father" or self.relation == "_father":
-            return "Dad"
-        else:
-            return self.relation
-
-class Address(object):
-    def __init__(self, street, city, state, zipcode):
-        self.street = street
-        self.city = city
-        self.state = state
-        self.zipcode = cleanup_zipcode(zipcode)
-        self.residents = []
-        self._id = None     # database id
-
-    def oneline(self):
-        parts = []
-        street, city, state, zipcode = [redacted(f) for f in (
-            self.street, self.city, self.state, self.zipcode)]
-        if street:
-            parts.append(street)
-        if city:
-            parts.append(city)
-        if state or zipcode:
-            parts.append(" ".join((state, zipcode)))
-        if parts:
-            return ", ".join(parts)
-        else:
-            return ""
-
-    def multiline(self):
-        lines = []
-        street, city, state, zipcode = [redacted(f) for f in (
-            self.street, self.city, self.state, self.zipcode)]
-        if street:
-            lines.append(street)
-        if city:
-            if state or zipcode:
-                lines.append(city + ", " + state + " " + zipcode)
-            else:
-                lines.append(city)
-        if lines:
-            return "\n".join(lines)
-        else:
-            return "(no address)"
-
-    def address_line1(self):
-        return self.street
-
-    def address_line2(self):
-        city, state, zipcode = [redacted(f) for f in (
-            self.city, self.state, self.zipcode)]
-        if city:
-            if state or zipcode:
-                return city + ", " + state + " " + zipcode
-            else:
-                return city
-        else:
-            return ""
-
-class Family(object):
-    def __init__(self, private, street, city, state, zipcode, email=None):
-        self.address = Address(street, city, state, zipcode)
-        self.email = email
-        self.private = private
-        self.guardians = []
-        self.children = []
-        self._name = None
-        self._sortkey = None
-        self._id = None     # database id
-
-    def key(self):
-        return group_key(self.guardians)
-
-    def sortkey(self):
-        if not self._sortkey:
-            self.children.sort(key=Student.sortkey)
-            self._sortkey = group_key(self.children)
-        return self._sortkey
-
-    def name(self):
-        if not self._name:
-            names = []
-            for p in self.children + self.guardians:
-                names.extend(p.lastname.split("-"))
-            parts = []
-            used = set()
-            for name in names:
-                if not name in used:
-                    parts.append(name)
-                    used.add(name)
-            self._name = "-".join(parts)
-        return self._name
-
-    def add_guardian(self, adult):
-        self.guardians.append(adult)
-        self.guardians_sorted = False
-
-    def parent_names(self, if_none=""):
-        guardians = [g for g in self.guardians if g.name() != ""
-                and not g.name().startswith("_")]
-        if len(guardians) == 0:
-            return if_none
-        if len(guardians) == 1:
-            return guardians[0].name()
-        if len(guardians) == 2:
-            (g1, g2) = (guardians[0], guardians[1])
-            if g1.lastname == g2.lastname and is_couple(g1, g2):
-                return g1.firstname + " & " + g2.firstname + " " + g2.lastname
-            else:
-                return g1.name() + " & " + g2.name()
-        return " & ".join([g.name() for g in guardians])
-
-    def children_names(self):
-        last_names = set([child.lastname for child in self.children])
-        if len(last_names) == 1:
-            names = [child.firstname for child in self.children] 
-            names[-1] += " " + self.children_last_name()
-        else:
-            names = [child.name() for child in self.children]
-        if len(names) > 1:
-            final = " and ".join((names[-2], names[-1]))
-            names = names[:-2] + [final]
-        return ", ".join(names)
+        # Create a Student object for this record
+        student = Student(rec["First Name"], rec["Last Name"], olsclass)
 
-    def child_with_grade(self, index=0, lastname_first=False):
-        try:
-            child = self.children[index]
-            return "%s (%s)" % (child.name(lastname_first), child.olsclass.grade)
-        except IndexError:
-            return ""
-
-    def children_with_grades(self, lastname_first=False):
-        return "\n".join(["%s (%s)" % (c.name(lastname_first), c.olsclass.grade) 
-            for c in self.children])
-
-    def children_first_names(self):
-        names = [c.firstname for c in self.children]
-        if len(names) > 1:
-            final = " and ".join((names[-2], names[-1]))
-            names = names[:-2] + [final]
-        return ", ".join(names)
-
-    def children_last_name(self):
-        return self.children[0].lastname
-
-    def children_grade_levels(self):
-        grades = [c.olsclass.gradelevel for c in self.children]
-        return ",".join(grades)
-
-    def guardian_relation(self, index=0):
+        # Create Guardian objects for this child's parents
+        guardians = []
         try:
-            guard = self.guardians[index]
-            return guard.relation
-        except IndexError:
-            return "Other"
-
-    def guardian_name(self, index=0, lastname_first=False):
+            father = record_guardian(rec, student, "Father", "Father",
+                    "Ftr Email", "Father Home Phone", "Father cell phone")
+            if father:
+                guardians.append(father)
+        except Exception as err:
+            if not "deceased" in rec["Father"].lower():
+                print "ERROR: '%s' - %s" % (rec["Father"], err)
         try:
-            guard = self.guardians[index]
-            if guard.firstname.startswith("_"):
-                return ""
-            return guard.name(lastname_first)
-        except IndexError:
-            return ""
-
-    def guardian_email(self, index=0):
+            mother = record_guardian(rec, student, "Mother", "Mother",
+                    "Mtr Email", "Mother Home Phone", "Mother cell phone")
+            if mother:
+                guardians.append(mother)
+        except Exception as err:
+            if not "deceased" in rec["Mother"].lower():
+                print "ERROR: '%s' - %s" % (rec["Mother"], err)
         try:
-            guard = self.guardians[index]
-            return guard.email
-        except IndexError:
-            return ""
+            guardian = record_guardian(rec, student, "Guardian",
+                    rec["Guardian Relation"], "Guardian Email",
+                    "Guardian Home Phone", "Guardian cell phone")
+            if guardian:
+                guardians.append(guardian)
+        except Exception as err:
+            print "ERROR: '%s' - %s" % (rec["Guardian"], err)
 
-    def guardian_homephone(self, index=0):
-        try:
-            guard = self.guardians[index]
-            return guard.homephone
-        except IndexError:
-            return ""
+        if not guardians:
+            print "** No guardian names or emails for %s" % student.name()
 
-    def guardian_cellphone(self, index=0):
-        try:
-            guard = self.guardians[index]
-            return guard.cellphone
-        except IndexError:
-            return ""
-
-    def oneline_address(self):
-        return self.address.oneline()
-
-    def multiline_address(self):
-        return self.address.multiline()
-
-    def address_line1(self):
-        return self.address.address_line1()
-
-    def address_line2(self):
-        return self.address.address_line2()
-
-    def phone_numbers(self, sep=None):
-        guardians = sorted(self.guardians, key=Guardian.ladies_first)
-        lines = []
-        homephone = None
-        for g in guardians:
-            ghome, gcell = [redacted(f) for f in (g.homephone, g.cellphone)]
-            if ghome:
-                if not homephone:
-                    homephone = ghome
-                elif ghome != homephone:
-                    lines.append(ghome + " (%s home)" % g.shortrelation())
-            if gcell:
-                lines.append(gcell + " (%s cell)" % g.shortrelation())
-        if homephone:
-            lines.insert(0, homephone)
-        if sep is None:
-            return lines
-        if lines:
-            return sep.join(lines)
-        else:
-            return "(no phone numbers)"
-
-    def emails(self, sep=None):
-        guardians = sorted(self.guardians, key=Guardian.ladies_first)
-        lines = []
-        if self.email:
-            lines.append(self.email)
-        for g in guardians:
-            if g.email:
-                lines.append(g.email + " (%s)" % g.shortrelation())
-        if sep is None:
-            return lines
-        if lines:
-            return "\n".join(lines)
-        else:
-            return "(no email addresses)"
-
-    def primary_phone(self):
-        guardians = sorted(self.guardians, key=Guardian.ladies_first)
-        for g in guardians:
-            if g.homephone:
-                return g.homephone
-            if g.cellphone:
-                return g.cellphone
-
-    def primary_email(self):
-        guardians = sorted(self.guardians, key=Guardian.ladies_first)
-        lines = []
-        if self.email:
-            return self.email
-        for g in guardians:
-            if g.email:
-                return g.email
-
-class OLSClass(object):
-    def __init__(self, key, title, teacher=None, aide=None, classmom=None, roster=[]):
-        self.key = key
-        self.title = title
-        self.grade = re.sub(r" - \S+$", "", title)
-        self.gradelevel = gradelevel[self.grade]
-        self.rank = graderank[self.grade]
-        self.teacher = teacher
-        self.aide = aide
-        self.classmom = classmom
-        self.roster = roster
-        self._id = None     # database id
-
-    def add_staff(self, person):
-        if person.role == "Teacher":
-            self.teacher = person
-        elif person.role == "Aide":
-            self.aide = person
-        elif person.role == "Classmom":
-            self.classmom = person
-        else:
-            return
-        person.olsclass = self
+        yield (student, guardians, rec)
 
-#######################################################################
-# Functions
-#######################################################################
+def group_families(items, window=None):
+    """
+    Collect the (student, guardians, record) tuples from
+    normalize_records() into Family objects, yielding each family once
+    it is complete.
+
+    With no window, every family is held until the end of the input.
+    Otherwise a family is taken to be complete once `window` records
+    have gone by without another of its children, so only the families
+    seen within the last `window` records are kept in memory.  The
+    export lists siblings together, so a small window is enough.  A
+    child listed after their family was complete raises ValueError
+    rather than starting a second copy of the family.
+    """
+    groups = collections.OrderedDict()  # open families, oldest first
+    last_seen = {}
+    closed = set()  # keys of the families already yielded
+    for (index, (student, guardians, rec)) in enumerate(items):
+        # Get the Family object for this family (or create a new one)
+        fkey = group_key(guardians)
+        if fkey in closed:
+            raise ValueError("%s is listed more than %d records after "
+                    "the rest of their family; use a larger window" % (
+                        student.name(), window))
+        family = groups.pop(fkey, None)
+        if family is None:
+            private = (rec.get("NO DIRECTORY", "") == "TRUE") 
+            family = Family(private, rec["Street"], rec["City"], rec["State"],
+                    rec["Zip"])
+            family.guardians =  guardians
+            for person in guardians:
+                person.family = family
+        groups[fkey] = family
+        last_seen[fkey] = index
 
-def load_directory_data(csvfile):
+        # Add this student to their family
+        family.children.append(student)
+        student.family = family
+
+        if window is not None:
+            while groups:
+                oldest = next(iter(groups))
+                if index - last_seen[oldest] < window:
+                    break
+                del last_seen[oldest]
+                closed.add(oldest)
+                yield groups.pop(oldest)
+
+    for family in groups.itervalues():
+        yield family
+
+def ingest_directory(csvfile, classes, window=None):
     """
-    Read student & family data from the CSV export of Maria's directory
-    spreadsheet.  
-    
-    This function returns a list of dicts - one for each student - where
-    the keys are just the column names from the spreadsheet. 
+    Run the directory spreadsheet through the read, validate, normalize
+    and group stages, yielding a Family object for each family.
     """
-    records = []    # a list of all records read in from the spreadsheet
-    fieldnames = [] # the column names from the spreadsheet
-    with open(csvfile, "r") as fp:
-        dir_reader = csv.DictReader(fp, delimiter=",", quotechar='"')
-        fieldnames = dir_reader.fieldnames  
-        records = [row for row in dir_reader]
-    return records
+    records = validate_records(read_directory(csvfile), classes)
+    return group_families(normalize_records(records, classes), window)
 
 def load_class_data(csvfile):
     """
@@ -547,242 +237,135 @@ def load_class_data(csvfile):
     return (classes, classnames)
 
 #######################################################################
-# Reports
+# Stage timing
 #######################################################################
 
-def write_class_roster(outfile):
-    """
-    """
-    lines = []
-    lines.append("\nClasses")
-    for classname in classnames:
-        if len(class_roster[classname]) == 0:
-            continue
-        cls = classes[classname]
-        if cls.teacher:
-            lines.append("%s - %s" % (cls.grade, cls.teacher.name()))
-        else:
-            lines.append("%s - " % (cls.grade))
-        if cls.aide:
-            lines.append("Aide: " + cls.aide.name())
-        if cls.classmom:
-            lines.append("Class parent: " + cls.classmom.name())
-        lines.append("")
-        for student in class_roster[classname]:
-            sibs = student.siblings()
-            if sibs:
-                lines.append("    " + student.name() + " *")
-            else:
-                lines.append("    " + student.name())
-        lines.append("")
-    lines.append("")
-    with open(outfile, "w") as fp:
-        fp.write("\n".join(lines))
-    print "wrote", outfile
-
-def lastname_sortkey(person):
-    return person.lastname
-
-def write_classmom_spreadsheets(outfile_template):
-    """
-    """
-    for classname in classnames:
-        if len(class_roster[classname]) == 0:
-            continue
-        cls = classes[classname]
-        if cls.grade.startswith('Pre'):
-            class_label = cls.grade + '-' + cls.teacher.lastname[0]
-        else:
-            class_label = cls.grade
-        outfile = outfile_template % class_label
-        outfile = outfile.replace("Pre-K", "PreK")
-        outfile = outfile.replace(" ", "")
-            
-        with open(outfile, "w") as fp:
-            wtr = csv.writer(fp)
-            header = ["Child", "Parent1", "Email1", "Cell1", "Phone1",
-                    "Parent2", "Email2", "Cell2", "Phone2",
-                    ""]
-            wtr.writerow(header)
-            for student in class_roster[classname]:
-                family = student.family
-                if student.family.private:
-                    family.guardians.sort(key=Guardian.ladies_first)
-                    row = [student.name(),
-                           family.guardian_name(0),
-                           "",
-                           "",
-                           "",
-                           family.guardian_name(1),
-                           "",
-                           "",
-                           "",
-                           "" ]
-                else:
-                    family.guardians.sort(key=Guardian.ladies_first)
-                    row = [student.name(),
-                           family.guardian_name(0),
-                           family.guardian_email(0),
-                           family.guardian_cellphone(0),
-                           family.guardian_homephone(0),
-                           family.guardian_name(1),
-                           family.guardian_email(1),
-                           family.guardian_cellphone(1),
-                           family.guardian_homephone(1),
-                           "" ]
-                wtr.writerow(row)
-        print "wrote", outfile
-
-def write_directory_by_class(outfile):
-    """
-    """
-    lines = []
-    for classname in classnames:
-        if len(class_roster[classname]) == 0:
-            continue
-        cls = classes[classname]
-        lines.append("- " * 16)
-        if cls.teacher:
-            lines.append("%s - %s" % (cls.grade, cls.teacher.name()))
-        else:
-            lines.append("%s" % (cls.grade))
-        lines.append("- " * 16)
-        if cls.classmom:
-            lines.append("Class parent: " + cls.classmom.name())
-        if cls.aide:
-            lines.append("Aide: " + cls.aide.name())
-        lines.append("")
-        for student in class_roster[classname]:
-            if student.family.private:
-                continue
-            lines.append(student.name(lastname_first=True))
-            lines.append(student.family.parent_names("(no parent names)"))
-            lines.append(student.family.multiline_address())
-            lines.append(student.family.phone_numbers(sep="\n"))
-            lines.append(student.family.emails(sep="\n"))
-            lines.append("")
-    lines.append("")
-    with open(outfile, "w") as fp:
-        fp.write("\n".join(lines))
-    print "wrote", outfile
-
-def write_directory_by_family(outfile):
-    """
-    """
-    lines = []
+class Stage(object):
+    def __init__(self, name, profile=False):
+        self.name = name
+        self.wall = 0.0     # seconds
+        self.cpu = 0.0      # seconds of user and system time
+        self.peak = 0       # the process's peak RSS, in KB
+        self.growth = 0     # how much the peak RSS rose, in KB
+        self.profiler = cProfile.Profile() if profile else None
 
-    for family in sorted(families.values(), key=Family.sortkey):
-        family.children.sort(key=Student.sortkey, reverse=True) # oldest first
-        if family.private:
-            continue
-        lines.append(family.children_with_grades(lastname_first=True))
-        lines.append(family.parent_names("(no parent names)"))
-        if family.private:
-            lines.append("(contact information withheld)")
-        else:
-            lines.append(family.multiline_address())
-            lines.append(family.phone_numbers(sep="\n"))
-            lines.append(family.emails(sep="\n"))
-        lines.append("")
-    lines.append("")
-    with open(outfile, "w") as fp:
-        fp.write("\n".join(lines))
-    print "wrote", outfile
-
-def write_mothers_spreadsheet(outfile):
+class StageTimer(object):
     """
+    Measure the wall time, CPU time and peak memory of each stage of a
+    run, and optionally profile each stage with cProfile.
+
+    Stages nest, and each is charged only for the time it isn't running
+    a stage inside it.  This lets a stage that streams its input from
+    another (see iterate()) be told apart from its source.  Memory is
+    the peak RSS reported by getrusage(), which never falls, so a stage
+    is charged for how much it raised the high-water mark.
     """
-    with open(outfile, "w") as fp:
-        wtr = csv.writer(fp)
-        header = ["Guardian", "Children"]
-        wtr.writerow(header)
-        for family in sorted(families.values(), key=Family.sortkey):
-            family.children.sort(key=Student.sortkey, reverse=True) # oldest first
-            family.guardians.sort(key=Guardian.ladies_first)
-            if family.guardians:
-                g = family.guardians[0]
-                if g.lastname != family.children_last_name():
-                    row = [g.name(), 
-                           family.children_names()]
-                    wtr.writerow(row)
-            else:
-                print "!! no guardians for", family.children_last_name()
-    print "wrote", outfile
-
-def write_family_spreadsheet(outfile):
-    """
-    """
-    with open(outfile, "w") as fp:
-        wtr = csv.writer(fp)
-        header = ["Family", "Parents", "Children", "Grades", 
-                "Student1", "Student2", "Student3",
-                "Address", "Address2",
-                "Relation1", "Email1", "Cell1", "Phone1",
-                "Relation2", "Email2", "Cell2", "Phone2",
-                ""]
-        wtr.writerow(header)
-        for family in sorted(families.values(), key=Family.sortkey):
-            family.children.sort(key=Student.sortkey, reverse=True) # oldest first
-            family.guardians.sort(key=Guardian.ladies_first)
-            row = [family.children_last_name(),
-                   family.parent_names(),
-                   family.children_names(),
-                   family.children_grade_levels(), 
-                   family.child_with_grade(0), 
-                   family.child_with_grade(1), 
-                   family.child_with_grade(2), 
-                   family.address_line1(),
-                   family.address_line2(),
-                   family.guardian_relation(0),
-                   family.guardian_email(0),
-                   family.guardian_cellphone(0),
-                   family.guardian_homephone(0),
-                   family.guardian_relation(1),
-                   family.guardian_email(1),
-                   family.guardian_cellphone(1),
-                   family.guardian_homephone(1),
-                   "" ]
-            wtr.writerow(row)
-    print "wrote", outfile
-
-def write_mailmerge_spreadsheet(outfile):
-    """
-    """
-    with open(outfile, "w") as fp:
-        wtr = csv.writer(fp)
-        header = ["Email", "Relation", "Family", "Parents", "Children", "Grades", 
-                "Student1", "Student2", "Student3",
-                "Address",
-                "Relation1", "Email1", "Cell1", "Phone1",
-                "Relation2", "Email2", "Cell2", "Phone2",
-                ""]
-        wtr.writerow(header)
-        for family in sorted(families.values(), key=Family.sortkey):
-            family.children.sort(key=Student.sortkey, reverse=True) # oldest first
-            family.guardians.sort(key=Guardian.ladies_first)
-            for g in family.guardians: 
-                if g.email:
-                    row = [g.email, 
-                           g.relation, 
-                           family.children_last_name(),
-                           family.parent_names(),
-                           family.children_names(),
-                           family.children_grade_levels(), 
-                           family.child_with_grade(0), 
-                           family.child_with_grade(1), 
-                           family.child_with_grade(2), 
-                           family.oneline_address(),
-                           family.guardian_relation(0),
-                           family.guardian_email(0),
-                           family.guardian_cellphone(0),
-                           family.guardian_homephone(0),
-                           family.guardian_relation(1),
-                           family.guardian_email(1),
-                           family.guardian_cellphone(1),
-                           family.guardian_homephone(1),
-                           "" ]
-                    wtr.writerow(row)
-    print "wrote", outfile
+    def __init__(self, enabled=False, profile_dir=None):
+        self.enabled = enabled or profile_dir is not None
+        self.profile_dir = profile_dir
+        self.stages = collections.OrderedDict()
+        self.stack = []
+        self.mark = None    # the usage when the current stage resumed
+
+    def usage(self):
+        ru = resource.getrusage(resource.RUSAGE_SELF)
+        maxrss = ru.ru_maxrss
+        if sys.platform == "darwin":
+            maxrss //= 1024     # reported in bytes rather than KB
+        return (time.time(), ru.ru_utime + ru.ru_stime, maxrss)
+
+    def enter(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = Stage(name, profile=self.profile_dir is not None)
+            self.stages[name] = stage
+        self.pause()
+        self.stack.append(stage)
+        self.resume()
+
+    def exit(self):
+        self.pause()
+        self.stack.pop()
+        self.resume()
+
+    def pause(self):
+        if not self.stack:
+            return
+        stage = self.stack[-1]
+        if stage.profiler is not None:
+            stage.profiler.disable()
+        (wall, cpu, maxrss) = self.usage()
+        stage.wall += wall - self.mark[0]
+        stage.cpu += cpu - self.mark[1]
+        stage.peak = max(stage.peak, maxrss)
+        stage.growth += maxrss - self.mark[2]
+
+    def resume(self):
+        self.mark = self.usage()
+        if self.stack and self.stack[-1].profiler is not None:
+            self.stack[-1].profiler.enable()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Charge the body of a with statement to the named stage."""
+        if not self.enabled:
+            yield
+            return
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def iterate(self, name, iterable):
+        """
+        Charge the time spent producing each item of an iterable to the
+        named stage.
+        """
+        if not self.enabled:
+            return iterable
+        return self._iterate(name, iter(iterable))
+
+    def _iterate(self, name, iterator):
+        while True:
+            self.enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            yield item
+
+    def summary(self):
+        lines = ["%-32s %10s %10s %10s %10s" % ("Stage", "Wall (s)",
+            "CPU (s)", "Peak (MB)", "Grew (MB)")]
+        for stage in self.stages.values():
+            lines.append("%-32s %10.3f %10.3f %10.1f %10.1f" % (stage.name,
+                stage.wall, stage.cpu, stage.peak / 1024.0,
+                stage.growth / 1024.0))
+        lines.append("%-32s %10.3f %10.3f" % ("Total",
+            sum(stage.wall for stage in self.stages.values()),
+            sum(stage.cpu for stage in self.stages.values())))
+        return "\n".join(lines)
+
+    def finish(self):
+        """Print the summary and write each stage's profile."""
+        if not self.enabled:
+            return
+        print
+        print self.summary()
+        if self.profile_dir is None:
+            return
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        for stage in self.stages.values():
+            filename = re.sub(r"[^\w-]+", "-", stage.name) + ".prof"
+            stage.profiler.dump_stats(os.path.join(self.profile_dir,
+                filename))
+        print "wrote profiles to", self.profile_dir
+
+timer = StageTimer()
 
 #######################################################################
 # Main code
@@ -803,11 +386,26 @@ def parse_args(args):
             help="Populate database for Django app; don't create outputs")
     parser.add_argument("--django", dest="django", action="store_true",
             help="Populate database for Django app; don't create outputs")
+    parser.add_argument("--incremental", dest="incremental",
+            action="store_true",
+            help="Update the Django database in place, changing only "
+            "what differs from the input")
+    parser.add_argument("--diff", dest="diff", action="store_true",
+            help="Report how --incremental would change the Django "
+            "database, without changing it")
     parser.add_argument("--dry-run", dest="dryrun", action="store_true",
             help="Process data, but don't create outputs.")
     parser.add_argument("--no-hidden", dest="nohidden", action="store_true",
             help="Don't redact private information")
-    opt = parser.parse_args()
+    parser.add_argument("--jobs", dest="jobs", type=int, default=1,
+            help="Number of processes to write the output files with")
+    parser.add_argument("--timings", dest="timings", action="store_true",
+            help="Print the time and memory taken by each stage "
+            "(each report is timed separately only with --jobs 1)")
+    parser.add_argument("--profile", dest="profile", metavar="DIR",
+            help="Like --timings, and also write each stage's cProfile "
+            "statistics to DIR")
+    opt = parser.parse_args(args)
 
     if not opt.directory_file:
         opt.directory_file = directory_tmpl.format(year=opt.year)
@@ -819,17 +417,18 @@ def parse_args(args):
 def main(args):
     global families, students, class_roster
     global classes, classnames
-    global no_hidden_fields
+    global timer
 
     opt = parse_args(args)
+    timer = StageTimer(opt.timings, opt.profile)
 
-    no_hidden_fields = opt.nohidden
+    loader.no_hidden_fields = opt.nohidden
 
-    records = load_directory_data(opt.directory_file)
-    (classes, classnames) = load_class_data(opt.class_file)
+    with timer.stage("load classes"):
+        (classes, classnames) = load_class_data(opt.class_file)
 
-    # Loop over the records, creating Student, Guardian, and Family objects
-    # to hold the data in a manageable form
+    # Stream the records through the ingestion pipeline, collecting the
+    # Student and Family objects it produces into the global structures
     #
     families = {}  # each family, indexed by its unique "family key"
     students = []  # a list of all students
@@ -838,147 +437,537 @@ def main(args):
     for classname in classnames:
         class_roster[classname] = []
 
-    for rec in records:
-        # Verify classnames and build class rosters
-        classname = rec["Grade Level"]
-        if not classname in classes:
-            print "ERROR: %s %s class %s not in classes DB" % (
-                    rec["First Name"], rec["Last Name"], classname)
-        if not classname in class_roster:
-            class_roster[classname] = []
-        olsclass = classes.get(classname, "")
-
-        # Create a Student object for this record
-        student = Student(rec["First Name"], rec["Last Name"], olsclass)
+    def enroll(items):
+        for (student, guardians, rec) in items:
+            # Add this student to the list of all students and their class
+            students.append(student)
+            class_roster.setdefault(rec["Grade Level"], []).append(student)
+            yield (student, guardians, rec)
 
-        # Add this student to the list of all students
-        students.append(student)
-
-        # Add this student to their class
-        class_roster[classname].append(student)
-
-        # Create Guardian objects for this child's parents
-        guardians = []
-        if rec["Father"] or rec["Ftr Email"]:
-            try:
-                if rec["Father"]:
-                    (lastname, firstname) = rec["Father"].split(",")
-                else:
-                    (lastname, firstname) = (student.lastname, "_father")
-                father = Guardian(firstname.strip(), lastname.strip(), "Father",
-                        rec["Ftr Email"], rec["Father Home Phone"], 
-                        rec["Father cell phone"])
-                guardians.append(father)
-            except Exception as err:
-                if not "deceased" in rec["Father"].lower():
-                    print "ERROR: '%s' - %s" % (rec["Father"], err)
-        if rec["Mother"] or rec["Mtr Email"]:
-            try:
-                if rec["Mother"]:
-                    (lastname, firstname) = rec["Mother"].split(",")
-                else:
-                    (lastname, firstname) = (student.lastname, "_mother")
-                mother = Guardian(firstname.strip(), lastname.strip(), "Mother", 
-                        rec["Mtr Email"], rec["Mother Home Phone"], 
-                        rec["Mother cell phone"])
-                guardians.append(mother)
-            except Exception as err:
-                if not "deceased" in rec["Mother"].lower():
-                    print "ERROR: '%s' - %s" % (rec["Mother"], err)
-        if rec["Guardian"] or rec["Guardian Email"]:
-            try:
-                if rec["Guardian"]:
-                    (lastname, firstname) = rec["Guardian"].split(",")
-                else:
-                    (lastname, firstname) = (student.lastname, "_guardian")
-                relation = rec["Guardian Relation"]
-                guardian = Guardian(firstname.strip(), lastname.strip(), relation,
-                        rec["Guardian Email"], rec["Guardian Home Phone"], 
-                        rec["Guardian cell phone"])
-                guardians.append(guardian)
-            except Exception as err:
-                print "ERROR: '%s' - %s" % (rec["Guardian"], err)
-
-        if not guardians:
-            print "** No guardian names or emails for %s" % student.name()
-
-        # Get the Family object for this family (or create a new one)
-        fkey = group_key(guardians)
-        if fkey in families:
-            family = families[fkey]
-        else:
-            private = (rec.get("NO DIRECTORY", "") == "TRUE") 
-            family = Family(private, rec["Street"], rec["City"], rec["State"],
-                    rec["Zip"])
-            family.guardians =  guardians
-            for person in guardians:
-                person.family = family
-            families[fkey] = family
-
-        # Add this student to their family
-        family.children.append(student)
-        student.family = family
+    records = validate_records(timer.iterate("read directory",
+        read_directory(opt.directory_file)), classes)
+    items = enroll(normalize_records(records, classes))
+    for family in timer.iterate("build families", group_families(items)):
+        families[family.key()] = family
 
     # Produce the directory
     #
     # classnames = sorted(class_roster.keys(), key=class_sortkey)
-    for classname in classnames:
-        class_roster[classname].sort(key=lastname_sortkey)
+    with timer.stage("sort rosters"):
+        for classname in classnames:
+            class_roster[classname].sort(key=lastname_sortkey)
 
     print
     print "There are", len(students), "students in", len(families), "families"
 
     if opt.dryrun:
-        return
-    
-    if opt.django:
+        pass
+    elif opt.diff or opt.incremental:
+        sync = sync_database(apply=opt.incremental)
+        print sync.report()
+    elif opt.django:
         populate_database()
     else:
         write_output_files(opt)
 
+    timer.finish()
+
+
+def freeze_directory():
+    """
+    Return a snapshot of the parsed directory for the reports to share
+    with worker processes.
+
+    The Directory orders the families and class rosters as it is
+    built, so the workers share that work instead of each repeating it.
+    """
+    return dict(directory=Directory(families.values(), students, classes,
+            classnames, class_roster),
+            no_hidden_fields=loader.no_hidden_fields)
+
+def install_snapshot(snapshot):
+    """Make a frozen directory snapshot the directory of a worker."""
+    global snapshot_directory
+    snapshot_directory = snapshot['directory']
+    loader.no_hidden_fields = snapshot['no_hidden_fields']
+
+def write_report(job):
+    """
+    Write one report's files for the directory, returning the messages
+    to print.
+    """
+    (name, year, directory) = job
+    if directory is None:
+        directory = snapshot_directory
+    report = reports[name](directory)
+    messages = []
+    for (outfile, contents) in report.outputs(year):
+        with open(outfile, "w") as fp:
+            fp.write(contents)
+        messages.extend(["!! " + problem for problem in report.problems])
+        del report.problems[:]
+        messages.append("wrote %s" % outfile)
+    return messages
 
 def write_output_files(opt):
-    # Outputs
-    class_roster_file = class_roster_tmpl.format(year=opt.year)
-    directory_by_class_file = directory_by_class_tmpl.format(year=opt.year)
-    directory_by_family_file = directory_by_family_tmpl.format(year=opt.year)
-    caritas_hours_spreadsheet_file = caritas_hours_spreadsheet_tmpl.format(year=opt.year)
-    classmom_spreadsheet_file = classmom_spreadsheet_tmpl.format(year=opt.year)
-    mothers_file = mothers_tmpl.format(year=opt.year)
-    vertical_response_spreadsheet_file = vertical_response_spreadsheet_tmpl.format(year=opt.year)
-
-    write_class_roster(class_roster_file)
-    write_directory_by_class(directory_by_class_file)
-    write_directory_by_family(directory_by_family_file)
-    write_family_spreadsheet(caritas_hours_spreadsheet_file)
-    write_mothers_spreadsheet(mothers_file)
-    write_classmom_spreadsheets(classmom_spreadsheet_file)
-    write_mailmerge_spreadsheet(vertical_response_spreadsheet_file)
+    if opt.jobs <= 1:
+        with timer.stage("index directory"):
+            directory = Directory(families.values(), students, classes,
+                    classnames, class_roster)
+        for name in reports:
+            with timer.stage("report " + name):
+                messages = write_report((name, opt.year, directory))
+            for message in messages:
+                print message
+        return
 
-def populate_database():
+    with timer.stage("index directory"):
+        snapshot = freeze_directory()
+    # The reports are written by the workers, so only their total shows
+    with timer.stage("write reports"):
+        pool = multiprocessing.Pool(opt.jobs, install_snapshot, (snapshot,))
+        try:
+            jobs = [(name, opt.year, None) for name in reports]
+            for messages in pool.map(write_report, jobs, chunksize=1):
+                for message in messages:
+                    print message
+        finally:
+            pool.close()
+            pool.join()
+
+def setup_django():
     global models
 
     import django
     django.setup()
     from contacts import models
 
-    models.Student.objects.all().delete()
-    models.Adult.objects.all().delete()
-    models.Guardian.objects.all().delete()
-    models.Family.objects.all().delete()
-    models.Address.objects.all().delete()
-    models.OLSClass.objects.all().delete()
+def populate_database():
+    """
+    Replace the contents of the Django database with the directory,
+    inserting each table with bulk_create() inside one transaction.
+    """
+    with timer.stage("set up django"):
+        setup_django()
+    from django.db import transaction
+    from contacts.signals import bulk_update
+
+    # The outer stages are charged only for what happens outside the
+    # inner ones: the rebuild as bulk_update() exits, and the commit
+    with timer.stage("commit"), transaction.atomic():
+        with timer.stage("rebuild derived data"), bulk_update():
+            with timer.stage("clear database"):
+                clear_database()
+            with timer.stage("insert directory"):
+                bulk_insert_directory()
+
+def populate_database_by_row():
+    """
+    Replace the contents of the Django database with the directory,
+    saving one row at a time.  This is much slower than
+    populate_database(), and is kept for comparison.
+    """
+    setup_django()
+    from contacts.signals import bulk_update
+
+    with bulk_update():
+        models.Student.objects.all().delete()
+        models.Adult.objects.all().delete()
+        models.Guardian.objects.all().delete()
+        models.Family.objects.all().delete()
+        models.Address.objects.all().delete()
+        models.OLSClass.objects.all().delete()
+
+        for olsclass in classes.values():
+            olsclass_obj = get_or_create_olsclass(olsclass)
+
+        for family in families.values():
+            family_obj = get_or_create_family(family)
+            for guardian in family.guardians:
+                guardian_obj = get_or_create_guardian(guardian)
+            for child in family.children:
+                student_obj = get_or_create_student(child)
+
+def clear_database():
+    """
+    Delete every directory row with one DELETE per table, dependents
+    first.  No signals are sent; the caller rebuilds derived data.
+    """
+    from django.db import connection
+    cursor = connection.cursor()
+    for model in (models.Student, models.Guardian, models.FamilyCard,
+            models.Family, models.OLSClass, models.Adult, models.Address):
+        cursor.execute("DELETE FROM %s" % connection.ops.quote_name(
+            model._meta.db_table))
+
+def bulk_insert_directory():
+    """
+    Insert all classes and families, building every row in memory and
+    writing each table with a single bulk_create(), in dependency order.
+    Ids are assigned here (SQLite doesn't report them back from a bulk
+    insert) and recorded in each object's _id.
+    """
+    from django.db.models import Max
+
+    def next_ids(model):
+        return itertools.count(1 + (model.objects.aggregate(
+            top=Max('id'))['top'] or 0))
+
+    rows = dict((model, []) for model in (models.Address, models.Adult,
+        models.OLSClass, models.Family, models.Guardian, models.Student))
+    ids = dict((model, next_ids(model)) for model in rows)
+    adult_ids = {}
+
+    def add_adult(adult):
+        if adult is None:
+            return None
+        if adult not in adult_ids:
+            adult_obj = models.Adult(id=next(ids[models.Adult]),
+                    firstname=adult.firstname, lastname=adult.lastname,
+                    email=adult.email, homephone=adult.homephone,
+                    cellphone=adult.cellphone)
+            adult_obj.normalize()   # bulk_create() doesn't call save()
+            rows[models.Adult].append(adult_obj)
+            adult_ids[adult] = adult_obj.id
+        return adult_ids[adult]
 
     for olsclass in classes.values():
-        olsclass_obj = get_or_create_olsclass(olsclass)
+        olsclass._id = next(ids[models.OLSClass])
+        rows[models.OLSClass].append(models.OLSClass(id=olsclass._id,
+            title=olsclass.title, grade=olsclass.grade,
+            gradelevel=olsclass.gradelevel, rank=olsclass.rank,
+            teacher_id=add_adult(olsclass.teacher),
+            aide_id=add_adult(olsclass.aide),
+            classmom_id=add_adult(olsclass.classmom)))
 
     for family in families.values():
-        family_obj = get_or_create_family(family)
+        address = family.address
+        if address.oneline() != "":
+            address._id = next(ids[models.Address])
+            rows[models.Address].append(models.Address(id=address._id,
+                street=address.street, city=address.city,
+                state=address.state, zipcode=address.zipcode))
+        family._id = next(ids[models.Family])
+        rows[models.Family].append(models.Family(id=family._id,
+            name=family.name(), email=family.email, address_id=address._id,
+            private=family.private))
         for guardian in family.guardians:
-            guardian_obj = get_or_create_guardian(guardian)
+            adult_id = add_adult(guardian)
+            guardian._id = next(ids[models.Guardian])
+            rows[models.Guardian].append(models.Guardian(id=guardian._id,
+                person_id=adult_id, relation=guardian.relation,
+                family_id=family._id))
         for child in family.children:
-            student_obj = get_or_create_student(child)
+            olsclass = child.olsclass or classes[""]
+            child._id = next(ids[models.Student])
+            rows[models.Student].append(models.Student(id=child._id,
+                firstname=child.firstname, lastname=child.lastname,
+                family_id=family._id, olsclass_id=olsclass._id))
+
+    for model in (models.Address, models.Adult, models.OLSClass,
+            models.Family, models.Guardian, models.Student):
+        model.objects.bulk_create(rows[model])
 
+class DatabaseSync(object):
+    """
+    Record (and, if `apply` is set, make) the inserts, updates and
+    deletes that bring the Django database into line with the loaded
+    directory.
+    """
+    def __init__(self, apply=True):
+        self.apply = apply
+        self.changes = []   # (action, kind, description)
+
+    def record(self, action, kind, description):
+        self.changes.append((action, kind, description))
+
+    def insert(self, obj, kind, description=None):
+        if description is not None:
+            self.record("insert", kind, description)
+        if self.apply:
+            obj.save()
+        return obj
+
+    def update(self, obj, kind, description, **values):
+        changed = sorted(name for name, value in values.items()
+                if getattr(obj, name) != value)
+        if not changed:
+            return obj
+        self.record("update", kind, "%s: %s" % (description, ", ".join(
+            "%s %s -> %s" % (name, describe(getattr(obj, name)),
+                describe(values[name])) for name in changed)))
+        if self.apply:
+            for name in changed:
+                setattr(obj, name, values[name])
+            obj.save(update_fields=changed)
+        return obj
+
+    def link(self, obj, field, value):
+        """
+        Point a foreign key at a row whose insert or delete has already
+        been recorded.
+        """
+        if self.apply:
+            setattr(obj, field, value)
+            obj.save(update_fields=[field])
+
+    def delete(self, obj, kind, description=None):
+        if description is not None:
+            self.record("delete", kind, description)
+        if self.apply:
+            obj.delete()
+
+    def summary(self):
+        counts = {}
+        for action, kind, description in self.changes:
+            counts[action] = counts.get(action, 0) + 1
+        return ", ".join("%d %ss" % (counts.get(action, 0), action)
+                for action in ("insert", "update", "delete"))
+
+    def report(self):
+        """
+        Return the changes, inserts then updates then deletes, each
+        sorted by kind and description, followed by the summary.
+        """
+        actions = ("insert", "update", "delete")
+        symbols = dict(zip(actions, "+~-"))
+        changes = sorted(self.changes, key=lambda change:
+                (actions.index(change[0]),) + change[1:])
+        lines = ["%s %s %s" % (symbols[action], kind, description)
+                for (action, kind, description) in changes]
+        lines.append(self.summary())
+        return "\n".join(lines)
+
+def describe(value):
+    """Show a changed value in the report: rows by name, others by repr."""
+    from django.db.models import Model
+    if isinstance(value, Model):
+        return repr(text(value))
+    return repr(value)
+
+def sync_database(apply=True):
+    """
+    Update the Django database to match the loaded directory, matching
+    classes by title, families by their guardians' group_key(),
+    guardians by name within their family and students by name within
+    their family, and writing only what differs, in one transaction.
+    Returns the DatabaseSync holding the changes.
+    """
+    with timer.stage("set up django"):
+        setup_django()
+    from django.db import transaction
+    from contacts.signals import deferred_update
+
+    sync = DatabaseSync(apply)
+    # As in populate_database(), the outer stages time the commit and
+    # the refresh as deferred_update() exits
+    with timer.stage("commit"), transaction.atomic():
+        with timer.stage("refresh derived data"), deferred_update():
+            with timer.stage("sync classes"):
+                (class_objs, old_classes) = sync_classes(sync)
+            with timer.stage("sync families"):
+                sync_families(sync, class_objs)
+            with timer.stage("delete old classes"):
+                for olsclass_obj in old_classes:
+                    sync.delete(olsclass_obj, "class", olsclass_obj.title)
+                    for role in ("teacher", "aide", "classmom"):
+                        staff_obj = getattr(olsclass_obj, role)
+                        if staff_obj is not None:
+                            sync.delete(staff_obj, "adult")
+    return sync
+
+def text(value):
+    from django.utils.encoding import force_text
+    if value is None:
+        return None
+    return force_text(value)
+
+def adult_values(adult):
+    return dict(firstname=text(adult.firstname),
+            lastname=text(adult.lastname), email=text(adult.email),
+            homephone=text(adult.homephone), cellphone=text(adult.cellphone))
+
+def address_values(address):
+    return dict(street=text(address.street), city=text(address.city),
+            state=text(address.state), zipcode=text(address.zipcode))
+
+def sync_classes(sync):
+    """
+    Sync the classes and their staff.  Returns a dict of the class rows
+    by loader class key, and a list of the class rows no longer in the
+    directory, which are left for the caller to delete once their
+    students have moved.
+    """
+    existing = dict((c.title, c) for c in models.OLSClass.objects.with_staff())
+    class_objs = {}
+    for key, olsclass in classes.items():
+        title = text(olsclass.title)
+        olsclass_obj = existing.pop(title, None)
+        values = dict(grade=text(olsclass.grade),
+                gradelevel=text(olsclass.gradelevel), rank=text(olsclass.rank))
+        if olsclass_obj is None:
+            olsclass_obj = sync.insert(models.OLSClass(title=title, **values),
+                    "class", title)
+        else:
+            sync.update(olsclass_obj, "class", title, **values)
+        for role in ("teacher", "aide", "classmom"):
+            sync_staff(sync, olsclass_obj, role, getattr(olsclass, role))
+        olsclass._id = olsclass_obj.id
+        class_objs[key] = olsclass_obj
+    return (class_objs, existing.values())
+
+def sync_staff(sync, olsclass_obj, role, person):
+    current = getattr(olsclass_obj, role)
+    what = "%s of %s" % (role, olsclass_obj.title)
+    if person is None:
+        if current is not None:
+            sync.link(olsclass_obj, role, None)
+            sync.delete(current, "adult", "%s: %s" % (what, current.name()))
+    elif current is None:
+        adult_obj = models.Adult(**adult_values(person))
+        sync.insert(adult_obj, "adult", "%s: %s" % (what, adult_obj.name()))
+        sync.link(olsclass_obj, role, adult_obj)
+    else:
+        sync.update(current, "adult", what, **adult_values(person))
+
+def db_family_key(family_obj):
+    return "; ".join(sorted(g.person.lastname + ", " + g.person.firstname
+        for g in family_obj.guardian_set.all()))
+
+def sync_families(sync, class_objs):
+    existing = {}
+    extras = []
+    for family_obj in models.Family.objects.directory():
+        key = db_family_key(family_obj)
+        if key in existing:
+            extras.append(family_obj)
+        else:
+            existing[key] = family_obj
+    for key, family in families.items():
+        family_obj = existing.pop(text(key), None)
+        if family_obj is None:
+            insert_family(sync, family, class_objs)
+        else:
+            update_family(sync, family_obj, family, class_objs)
+    for family_obj in existing.values() + extras:
+        sync.delete(family_obj, "family", unicode(family_obj))
+        for guardian_obj in family_obj.guardian_set.all():
+            sync.delete(guardian_obj.person, "adult")
+        if family_obj.address is not None:
+            sync.delete(family_obj.address, "address")
+
+def student_class(student, class_objs):
+    return class_objs[student.olsclass.key if student.olsclass else ""]
+
+def student_description(student, family_name):
+    """
+    Describe a student in the report, noting a student whose class
+    isn't in the class spreadsheet (validate_records() has named it),
+    as they are put in the Unknown class.
+    """
+    description = "%s of %s" % (student.key(), family_name)
+    if student.olsclass == "":
+        description += " (class not in the class spreadsheet)"
+    return description
+
+def insert_family(sync, family, class_objs):
+    address_obj = None
+    if family.address.oneline() != "":
+        address_obj = sync.insert(models.Address(
+            **address_values(family.address)), "address")
+    family_obj = sync.insert(models.Family(name=text(family.name()),
+        email=text(family.email), private=family.private,
+        address=address_obj), "family", "%s (%d guardians, %d students)" % (
+            family.name(), len(family.guardians), len(family.children)))
+    for guardian in family.guardians:
+        insert_guardian(sync, family_obj, guardian, record=False)
+    for child in family.children:
+        insert_student(sync, family_obj, child, class_objs, record=False)
+    family._id = family_obj.id
+
+def insert_guardian(sync, family_obj, guardian, record=True):
+    adult_obj = sync.insert(models.Adult(**adult_values(guardian)), "adult")
+    description = None
+    if record:
+        description = "%s of %s" % (guardian.key(), family_obj.name)
+    guardian_obj = sync.insert(models.Guardian(person=adult_obj,
+        relation=guardian.relation, family=family_obj), "guardian",
+        description)
+    guardian._id = guardian_obj.id
+
+def insert_student(sync, family_obj, student, class_objs, record=True):
+    description = None
+    if record:
+        description = student_description(student, family_obj.name)
+    student_obj = sync.insert(models.Student(firstname=text(student.firstname),
+        lastname=text(student.lastname), family=family_obj,
+        olsclass=student_class(student, class_objs)), "student", description)
+    student._id = student_obj.id
+
+def pop_match(rows, key):
+    """
+    Remove and return the first of the rows (a dict of lists) with the
+    given natural key, or None.
+    """
+    matches = rows.get(key)
+    if not matches:
+        return None
+    return matches.pop(0)
+
+def update_family(sync, family_obj, family, class_objs):
+    name = family_obj.name
+    sync.update(family_obj, "family", name, name=text(family.name()),
+            email=text(family.email), private=family.private)
+    family._id = family_obj.id
+
+    address_obj = family_obj.address
+    if family.address.oneline() == "":
+        if address_obj is not None:
+            sync.link(family_obj, "address", None)
+            sync.delete(address_obj, "address", "of " + name)
+    elif address_obj is None:
+        address_obj = sync.insert(models.Address(
+            **address_values(family.address)), "address", "of " + name)
+        sync.link(family_obj, "address", address_obj)
+    else:
+        sync.update(address_obj, "address", "of " + name,
+                **address_values(family.address))
+
+    guardian_objs = {}
+    for guardian_obj in family_obj.guardian_set.all():
+        key = guardian_obj.person.lastname + ", " + guardian_obj.person.firstname
+        guardian_objs.setdefault(key, []).append(guardian_obj)
+    for guardian in family.guardians:
+        guardian_obj = pop_match(guardian_objs, text(guardian.key()))
+        if guardian_obj is None:
+            insert_guardian(sync, family_obj, guardian)
+        else:
+            what = "%s of %s" % (guardian.key(), name)
+            sync.update(guardian_obj.person, "adult", what,
+                    **adult_values(guardian))
+            sync.update(guardian_obj, "guardian", what,
+                    relation=text(guardian.relation))
+            guardian._id = guardian_obj.id
+    for guardian_obj in itertools.chain(*guardian_objs.values()):
+        sync.delete(guardian_obj.person, "guardian", "%s of %s" % (
+            guardian_obj.person.name(lastname_first=True), name))
+
+    student_objs = {}
+    for student_obj in family_obj.student_set.all():
+        key = student_obj.name(lastname_first=True)
+        student_objs.setdefault(key, []).append(student_obj)
+    for child in family.children:
+        student_obj = pop_match(student_objs, text(child.key()))
+        if student_obj is None:
+            insert_student(sync, family_obj, child, class_objs)
+        else:
+            sync.update(student_obj, "student",
+                    student_description(child, name),
+                    olsclass=student_class(child, class_objs))
+            child._id = student_obj.id
+    for student_obj in itertools.chain(*student_objs.values()):
+        sync.delete(student_obj, "student", "%s of %s" % (
+            student_obj.name(lastname_first=True), name))
 
 def get_or_create_olsclass(olsclass):
     """
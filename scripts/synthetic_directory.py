@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+#  Write synthetic directory and class spreadsheets, in the layout that
+#  load_spreadsheet.py reads, for testing and benchmarking.
+#
+import sys
+import csv
+import random
+import argparse
+import itertools
+
+directory_fieldnames = [
+    "Last Name", "First Name", "Grade Level",
+    "Father", "Ftr Email", "Father Home Phone", "Father cell phone",
+    "Mother", "Mtr Email", "Mother Home Phone", "Mother cell phone",
+    "Guardian", "Guardian Relation", "Guardian Email",
+    "Guardian Home Phone", "Guardian cell phone",
+    "Street", "City", "State", "Zip", "NO DIRECTORY",
+]
+
+class_fieldnames = [
+    "class", "class title", "teacher", "teacher e-mail", "aide",
+    "class mom", "class mom e-mail",
+]
+
+# (class key, class title)
+class_list = [
+    ("PK3", "Pre-K 3"),
+    ("PK4", "Pre-K 4"),
+    ("K", "Kindergarten"),
+    ("1", "First Grade"),
+    ("2", "Second Grade"),
+    ("3", "Third Grade"),
+    ("4", "Fourth Grade"),
+    ("5", "Fifth Grade"),
+    ("6", "Sixth Grade"),
+    ("7", "Seventh Grade"),
+    ("8", "Eighth Grade"),
+]
+
+surnames = ["Smith", "Johnson", "Garcia", "Brown", "Lopez", "Murphy",
+    "Nguyen", "Kelly", "Rossi", "Walsh", "Costa", "Sullivan", "Silva",
+    "Reilly", "Patel", "Doyle"]
+boys = ["James", "John", "Michael", "Luis", "Sean", "Daniel", "Kevin",
+    "Matthew", "Jose", "Liam", "Ryan", "Brendan"]
+girls = ["Mary", "Maria", "Ann", "Kathleen", "Sophia", "Grace", "Emma",
+    "Julia", "Ana", "Claire", "Nora", "Rose"]
+streets = ["Main St", "Oak Ave", "Elm St", "Chestnut St", "Bridge St",
+    "Pine Rd", "School St", "Park Ave"]
+cities = ["Lowell", "Dracut", "Chelmsford", "Tewksbury", "Billerica"]
+
+def phone(rnd):
+    number = "978-%03d-%04d" % (rnd.randint(200, 999), rnd.randint(0, 9999))
+    if rnd.random() < 0.02:
+        number = "[" + number + "]"     # marked private
+    return number
+
+def sections(nclasses):
+    """
+    Return the (key, title) of each of `nclasses` classes, spreading
+    them over the grades with one or more sections per grade.
+    """
+    per_grade = max(1, nclasses // len(class_list))
+    result = []
+    for key, title in class_list:
+        for section in range(per_grade):
+            letter = chr(ord("A") + section % 26) + (
+                    str(section // 26) if section >= 26 else "")
+            result.append((key + letter, title + " - " + letter))
+    return result
+
+def class_rows(classes, rnd):
+    for idx, (key, title) in enumerate(classes):
+        teacher = (rnd.choice(girls), "Teacher%d" % idx)
+        aide = (rnd.choice(girls), "Aide%d" % idx)
+        mom = (rnd.choice(girls), "Classmom%d" % idx)
+        yield {
+            "class": key,
+            "class title": title,
+            "teacher": " ".join(teacher),
+            "teacher e-mail": "%s.%s@school.example.org" % teacher,
+            "aide": " ".join(aide) if idx % 3 else "",
+            "class mom": " ".join(mom),
+            "class mom e-mail": "%s.%s@example.com" % mom,
+        }
+
+def family_rows(index, classes, rnd):
+    """
+    Yield one spreadsheet row per child of the index'th family.
+    """
+    lastname = "%s%d" % (surnames[index % len(surnames)], index)
+    father = rnd.choice(boys)
+    mother = rnd.choice(girls)
+    kind = rnd.random()
+    family = {
+        "Street": "%d %s" % (rnd.randint(1, 999), rnd.choice(streets)),
+        "City": rnd.choice(cities),
+        "State": "MA",
+        "Zip": "%05d" % rnd.randint(1800, 1899),
+        "NO DIRECTORY": "TRUE" if rnd.random() < 0.03 else "",
+    }
+    for key in directory_fieldnames:
+        family.setdefault(key, "")
+    homephone = phone(rnd)
+    if kind < 0.85:
+        family.update({
+            "Father": "%s, %s" % (lastname, father),
+            "Ftr Email": "%s.%s@example.com" % (father, lastname),
+            "Father Home Phone": homephone,
+            "Father cell phone": phone(rnd),
+        })
+        if rnd.random() < 0.02:
+            family["Father"] = ""       # only an email address
+    elif kind < 0.87:
+        family["Father"] = "Deceased"
+    if kind < 0.95:
+        mother_last = lastname if rnd.random() < 0.8 else "Maiden%d" % index
+        family.update({
+            "Mother": "%s, %s" % (mother_last, mother),
+            "Mtr Email": "%s.%s@example.com" % (mother, mother_last),
+            "Mother Home Phone": homephone,
+            "Mother cell phone": phone(rnd),
+        })
+    else:
+        family.update({
+            "Guardian": "%s, %s" % (lastname, rnd.choice(girls)),
+            "Guardian Relation": rnd.choice(["grandmother", "aunt"]),
+            "Guardian Email": "guardian.%s@example.com" % lastname,
+            "Guardian Home Phone": homephone,
+            "Guardian cell phone": "",
+        })
+    nchildren = rnd.choice([1, 1, 2, 2, 2, 3, 4])
+    for firstname in rnd.sample(boys + girls, nchildren):
+        row = dict(family)
+        row["Last Name"] = lastname
+        row["First Name"] = firstname
+        row["Grade Level"] = rnd.choice(classes)[0]
+        yield row
+
+def classes_for(nstudents):
+    """
+    Return a number of classes giving about 25 students per class, and
+    at least two sections of each grade.
+    """
+    return max(2 * len(class_list), nstudents // 25)
+
+def write_directory(directory_file, class_file, nfamilies=None, nclasses=22,
+        seed=0, max_students=None):
+    """
+    Write synthetic directory and class spreadsheets for `nfamilies`
+    families in `nclasses` classes.  With `max_students`, families are
+    written until there are that many students (the last family may be
+    cut short).  Returns the number of students.
+    """
+    rnd = random.Random(seed)
+    classes = sections(nclasses)
+    with open(class_file, "wb") as fp:
+        wtr = csv.DictWriter(fp, class_fieldnames)
+        wtr.writeheader()
+        wtr.writerows(class_rows(classes, rnd))
+    nstudents = 0
+    with open(directory_file, "wb") as fp:
+        wtr = csv.DictWriter(fp, directory_fieldnames)
+        wtr.writeheader()
+        for index in itertools.count():
+            if index == nfamilies or nstudents == max_students:
+                break
+            for row in family_rows(index, classes, rnd):
+                wtr.writerow(row)
+                nstudents += 1
+                if nstudents == max_students:
+                    break
+    return nstudents
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+            description="Write synthetic school directory spreadsheets.")
+    parser.add_argument("--families", type=int,
+            help="Number of families (default: 500, or as many as "
+            "--students needs)")
+    parser.add_argument("--students", type=int,
+            help="Number of students, e.g. 100 to 100000")
+    parser.add_argument("--classes", type=int,
+            help="Number of classes (default: 22, or about 25 students "
+            "per class with --students)")
+    parser.add_argument("--seed", type=int, default=0,
+            help="Random seed (default: 0)")
+    parser.add_argument("--student-file", dest="directory_file",
+            default="synthetic directory.csv",
+            help="Directory spreadsheet to write")
+    parser.add_argument("--class-file", dest="class_file",
+            default="synthetic classes.csv",
+            help="Class spreadsheet to write")
+    return parser.parse_args(args)
+
+def main(args):
+    opt = parse_args(args)
+    if opt.families is None and opt.students is None:
+        opt.families = 500
+    if opt.classes is None:
+        opt.classes = classes_for(opt.students) if opt.students else 22
+    nstudents = write_directory(opt.directory_file, opt.class_file,
+            opt.families, opt.classes, opt.seed, opt.students)
+    print "wrote %d students to %s" % (nstudents, opt.directory_file)
+    print "wrote", opt.class_file
+
+if __name__ == '__main__':
+    main(sys.argv[1:])